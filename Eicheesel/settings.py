@@ -28,6 +28,10 @@ ALPHA_VANTAGE_API_KEY = os.getenv('API_KEY')
 DEBUG = os.getenv("DEBUG")
 ALLOWED_HOSTS = str(os.getenv("ALLOWED_HOSTS")).split(",")
 
+# "materialized" stores one ConsolidatedResult row per simulated year,
+# "computed" projects the results from the Simulation parameters on read
+SIMULATION_RESULTS_MODE = os.getenv("SIMULATION_RESULTS_MODE", "materialized")
+
 #SESSION_COOKIE_SECURE = True
 #CSRF_COOKIE_SECURE = True
 CSRF_TRUSTED_ORIGINS = ['http://localhost', 'http://127.0.0.1',
@@ -100,6 +104,66 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# "locmem" is per process: with several gunicorn workers use "file" or "db"
+# (run python manage.py createcachetable for the latter)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "locmem")
+
+if CACHE_BACKEND == "file":
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv("CACHE_LOCATION", "/var/tmp/eicheesel_cache"),
+        }
+    }
+elif CACHE_BACKEND == "db":
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': os.getenv("CACHE_LOCATION", "eicheesel_cache"),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'eicheesel',
+        }
+    }
+
+CHART_CACHE_TIMEOUT = int(os.getenv("CHART_CACHE_TIMEOUT", 60 * 60))
+
+# Imports, recalculations and stock refreshes are queued and run by
+# "python manage.py run_jobs" instead of inside the request
+BACKGROUND_JOBS = os.getenv("BACKGROUND_JOBS", "false").lower() == "true"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", os.cpu_count() or 1))
+# Jobs left running longer than this by a worker that died are queued
+# again when run_jobs starts
+JOB_STALE_TIMEOUT_MINUTES = int(os.getenv("JOB_STALE_TIMEOUT_MINUTES", 60))
+
+# Quotes fetched at the same time when refreshing the stocks
+MARKET_DATA_CONCURRENCY = int(os.getenv("MARKET_DATA_CONCURRENCY", 8))
+
+# Market data API quota, shared by every thread and process of the host
+# through a token bucket file. Batch refreshes leave the reserved requests
+# to the pages waiting on a quote.
+MARKET_DATA_RATE_PER_MINUTE = float(os.getenv("MARKET_DATA_RATE_PER_MINUTE", 5))
+MARKET_DATA_INTERACTIVE_RESERVE = int(os.getenv("MARKET_DATA_INTERACTIVE_RESERVE", 1))
+MARKET_DATA_TIMEOUT = float(os.getenv("MARKET_DATA_TIMEOUT", 10))
+MARKET_DATA_MAX_RETRIES = int(os.getenv("MARKET_DATA_MAX_RETRIES", 4))
+if os.getenv("MARKET_DATA_RATE_FILE"):
+    MARKET_DATA_RATE_FILE = os.getenv("MARKET_DATA_RATE_FILE")
+
+# A stock price older than this is refreshed, quotes stay cached as long
+QUOTE_MAX_AGE_MINUTES = int(os.getenv("QUOTE_MAX_AGE_MINUTES", 15))
+
+# Memory-mapped daily price histories, one file per symbol, rebuilt from
+# the DailyPrice table with "python manage.py sync_prices --rebuild-history"
+PRICE_HISTORY_DIR = os.getenv("PRICE_HISTORY_DIR", str(BASE_DIR / "price_history"))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
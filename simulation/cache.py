@@ -0,0 +1,113 @@
+from typing import Any, Callable, Hashable, Iterable, Optional, Tuple
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CHART_CACHE_TIMEOUT = getattr(settings, 'CHART_CACHE_TIMEOUT', 60 * 60)
+
+GLOBAL_VERSION_KEY = 'charts:version:global'
+PRICES_VERSION_KEY = 'portfolios:version:prices'
+
+
+def _user_version_key(user_id: int) -> str:
+    return f'charts:version:user:{user_id}'
+
+
+def _portfolio_version_key(portfolio_id: int) -> str:
+    return f'portfolios:version:{portfolio_id}'
+
+
+def _new_version() -> int:
+    # Start from the clock rather than 1, so a version key lost to eviction
+    # can never be reset to a value that still has payloads cached under it
+    return time.time_ns()
+
+
+def _bump(key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), None)
+
+
+def _get_versions(*keys: str) -> str:
+    versions = cache.get_many(keys)
+
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+
+    return '.'.join(str(versions[key]) for key in keys)
+
+
+def get_cache_version(user_id: int) -> str:
+    """Return the current version of the cached payloads of a user."""
+    return _get_versions(GLOBAL_VERSION_KEY, _user_version_key(user_id))
+
+
+def get_portfolio_cache_version(portfolio_id: int) -> str:
+    """Return the current version of the cached payloads of a portfolio."""
+    return _get_versions(PRICES_VERSION_KEY, _portfolio_version_key(portfolio_id))
+
+
+def invalidate_user_cache(user_ids: Iterable[Optional[int]]) -> None:
+    """Bump the version of the given users once the current transaction commits."""
+    keys = {_user_version_key(user_id) for user_id in user_ids if user_id is not None}
+    for key in keys:
+        transaction.on_commit(lambda key=key: _bump(key))
+
+
+def invalidate_all_caches() -> None:
+    """Bump the global version, for data shared by every user (inflation rates)."""
+    transaction.on_commit(lambda: _bump(GLOBAL_VERSION_KEY))
+
+
+def invalidate_portfolio_cache(portfolio_ids: Iterable[Optional[int]]) -> None:
+    """Bump the version of the given portfolios once the current transaction commits."""
+    keys = {_portfolio_version_key(portfolio_id) for portfolio_id in portfolio_ids if portfolio_id is not None}
+    for key in keys:
+        transaction.on_commit(lambda key=key: _bump(key))
+
+
+def invalidate_price_caches() -> None:
+    """Bump the version of every portfolio payload, once price histories have changed."""
+    # Price history files aren't transactional, they are already written
+    _bump(PRICES_VERSION_KEY)
+
+
+def cached_user_payload(
+        user_id: int,
+        name: str,
+        params: Tuple[Hashable, ...],
+        builder: Callable[[], Any]
+) -> Any:
+    """
+    Return the payload built by builder for this user and these parameters,
+    from the cache when the user's data hasn't changed since it was stored.
+    """
+    digest = hashlib.md5(repr(params).encode()).hexdigest()
+    key = f'charts:{name}:{user_id}:{get_cache_version(user_id)}:{digest}'
+
+    payload = cache.get(key)
+    if payload is None:
+        payload = builder()
+        cache.set(key, payload, CHART_CACHE_TIMEOUT)
+    return payload
+
+
+def cached_portfolio_payload(portfolio_id: int, name: str, builder: Callable[[], Any]) -> Any:
+    """
+    Return the payload built by builder for this portfolio, from the cache
+    when neither its transactions nor the stored prices changed since.
+    """
+    key = f'portfolios:{name}:{portfolio_id}:{get_portfolio_cache_version(portfolio_id)}'
+
+    payload = cache.get(key)
+    if payload is None:
+        payload = builder()
+        cache.set(key, payload, CHART_CACHE_TIMEOUT)
+    return payload
@@ -0,0 +1,237 @@
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List, Tuple
+import json
+
+from django.db import transaction
+
+from .cache import invalidate_user_cache
+from .models import Simulation, RealAccountData, AnnualInflationRate
+from .projections import get_result_values
+
+
+def build_real_data_comparison(
+        simulation: Simulation,
+        show_inflation: bool = True
+) -> Tuple[Dict[str, list], List[RealAccountData]]:
+    """
+    Build the simulation vs real data chart of an account.
+
+    Each table is fetched once and keyed by year, so every dataset is a
+    single pass over the years. Return the chart data and the real data
+    entries ordered by year.
+    """
+    simulated: Dict[int, Decimal] = {
+        annee: montant for _, annee, montant in get_result_values([simulation])
+    }
+    real_data = list(RealAccountData.objects.filter(simulation=simulation).order_by('annee'))
+    real_by_year = {entry.annee: entry for entry in real_data}
+
+    years = sorted(simulated.keys() | real_by_year.keys())
+
+    datasets = [
+        {
+            'label': 'Simulation',
+            'data': [float(simulated[year]) if year in simulated else None for year in years],
+            'borderColor': 'rgb(54, 162, 235)',
+            'backgroundColor': 'rgba(54, 162, 235, 0.2)',
+            'borderWidth': 2
+        },
+        {
+            'label': 'Données réelles nominales',
+            'data': [
+                float(real_by_year[year].montant_reel) if year in real_by_year else None
+                for year in years
+            ],
+            'borderColor': 'rgb(255, 99, 132)',
+            'backgroundColor': 'rgba(255, 99, 132, 0.2)',
+            'borderWidth': 2
+        }
+    ]
+
+    if show_inflation:
+        datasets.append({
+            'label': 'Données réelles (ajustées inflation)',
+            'data': [
+                float(real_by_year[year].montant_reel_ajuste)
+                if year in real_by_year and real_by_year[year].montant_reel_ajuste is not None
+                else None
+                for year in years
+            ],
+            'borderColor': 'rgb(75, 192, 192)',
+            'backgroundColor': 'rgba(75, 192, 192, 0.2)',
+            'borderWidth': 2,
+            'borderDash': [5, 5]
+        })
+
+    chart_data = {
+        'labels': [str(year) for year in years],
+        'datasets': datasets
+    }
+    return chart_data, real_data
+
+
+def _differences(simulated: Decimal, real: Decimal, real_adjusted: Decimal) -> Dict[str, Decimal]:
+    differences = {
+        'difference': real - simulated,
+        'difference_adjusted': real_adjusted - simulated,
+        'difference_percent': Decimal('0'),
+        'difference_percent_adjusted': Decimal('0'),
+    }
+    if simulated:
+        differences['difference_percent'] = (real - simulated) / simulated * 100
+        differences['difference_percent_adjusted'] = (real_adjusted - simulated) / simulated * 100
+    return differences
+
+
+def build_summary_comparison(user, show_inflation: bool = True) -> dict:
+    """
+    Build the summary_comparison template context of a user.
+
+    Simulated and real values are pivoted into account x year dicts in a
+    single pass over each table, accumulating the year totals on the way.
+    The per-account and per-year figures are then plain lookups.
+    """
+    simulations = Simulation.objects.filter(user=user).select_related('categorie').order_by('id')
+
+    simulated: Dict[int, Dict[int, Decimal]] = defaultdict(dict)
+    simulated_totals: Dict[int, Decimal] = defaultdict(Decimal)
+    for simulation_id, annee, montant in get_result_values(simulations):
+        simulated[simulation_id][annee] = montant
+        simulated_totals[annee] += montant
+
+    real: Dict[int, Dict[int, Tuple[Decimal, Decimal, Decimal]]] = defaultdict(dict)
+    real_totals: Dict[int, Decimal] = defaultdict(Decimal)
+    real_adjusted_totals: Dict[int, Decimal] = defaultdict(Decimal)
+    weighted_inflation: Dict[int, Decimal] = defaultdict(Decimal)
+    for simulation_id, annee, montant_reel, taux_inflation in RealAccountData.objects.filter(
+            simulation__user=user
+    ).values_list('simulation_id', 'annee', 'montant_reel', 'taux_inflation'):
+        montant_ajuste = montant_reel / (1 + taux_inflation / 100)
+        real[simulation_id][annee] = (montant_reel, taux_inflation, montant_ajuste)
+        real_totals[annee] += montant_reel
+        real_adjusted_totals[annee] += montant_ajuste
+        weighted_inflation[annee] += taux_inflation * montant_reel
+
+    all_years = sorted(simulated_totals.keys() | real_totals.keys())
+
+    if not all_years:
+        return {
+            'summary_data': [],
+            'years': [],
+            'yearly_totals': {},
+            'chart_data': json.dumps({'labels': [], 'datasets': []}),
+            'show_inflation': show_inflation
+        }
+
+    yearly_totals = {}
+    for year in all_years:
+        simulated_amount = simulated_totals.get(year, Decimal('0'))
+        real_amount = real_totals.get(year, Decimal('0'))
+        real_adjusted = real_adjusted_totals.get(year, Decimal('0'))
+
+        yearly_totals[str(year)] = {
+            'simulated': simulated_amount,
+            'real': real_amount,
+            'real_adjusted': real_adjusted,
+            # Weighted average of the accounts' inflation rates
+            'inflation_rate': weighted_inflation[year] / real_amount if real_amount else Decimal('0'),
+            **_differences(simulated_amount, real_amount, real_adjusted),
+        }
+
+    summary_data = []
+    for simulation in simulations:
+        account_simulated = simulated.get(simulation.id, {})
+        account_real = real.get(simulation.id, {})
+        years = {}
+
+        for year in all_years:
+            simulated_amount = account_simulated.get(year, Decimal('0'))
+            real_values = account_real.get(year)
+
+            if real_values:
+                montant_reel, taux_inflation, montant_ajuste = real_values
+                years[str(year)] = {
+                    'simulated': simulated_amount,
+                    'has_real_data': True,
+                    'real': montant_reel,
+                    'real_adjusted': montant_ajuste,
+                    'inflation_rate': taux_inflation,
+                    **_differences(simulated_amount, montant_reel, montant_ajuste),
+                }
+            else:
+                years[str(year)] = {
+                    'simulated': simulated_amount,
+                    'has_real_data': False,
+                    'real': Decimal('0'),
+                    'real_adjusted': Decimal('0'),
+                    'inflation_rate': Decimal('0'),
+                    'difference': Decimal('0'),
+                    'difference_adjusted': Decimal('0'),
+                    'difference_percent': Decimal('0'),
+                    'difference_percent_adjusted': Decimal('0')
+                }
+
+        summary_data.append({
+            'account_name': simulation.nom_compte,
+            'category': simulation.categorie.category,
+            'years': years
+        })
+
+    # Prepare chart data with inflation adjustment
+    labels = [str(year) for year in all_years]
+    datasets = [
+        {
+            'label': 'Total Simulé',
+            'data': [float(yearly_totals[year]['simulated']) for year in labels],
+            'borderColor': 'rgb(54, 162, 235)',
+            'backgroundColor': 'rgba(54, 162, 235, 0.2)',
+            'borderWidth': 2
+        },
+        {
+            'label': 'Total Réel Nominal',
+            'data': [float(yearly_totals[year]['real']) for year in labels],
+            'borderColor': 'rgb(255, 99, 132)',
+            'backgroundColor': 'rgba(255, 99, 132, 0.2)',
+            'borderWidth': 2
+        }
+    ]
+
+    if show_inflation:
+        datasets.append({
+            'label': 'Total Réel (Ajusté Inflation)',
+            'data': [float(yearly_totals[year]['real_adjusted']) for year in labels],
+            'borderColor': 'rgb(75, 192, 192)',
+            'backgroundColor': 'rgba(75, 192, 192, 0.2)',
+            'borderWidth': 2,
+            'borderDash': [5, 5]
+        })
+
+    return {
+        'summary_data': summary_data,
+        'yearly_totals': yearly_totals,
+        'years': all_years,
+        'chart_data': json.dumps({'labels': labels, 'datasets': datasets}),
+        'show_inflation': show_inflation
+    }
+
+
+def apply_inflation_rates(simulation: Simulation) -> int:
+    """
+    Apply the current annual inflation rates (0 when a year has none) to the
+    real data of an account. Return the number of entries updated.
+    """
+    entries = list(RealAccountData.objects.filter(simulation=simulation))
+    inflation_rates = dict(AnnualInflationRate.objects.filter(
+        annee__in={entry.annee for entry in entries}
+    ).values_list('annee', 'taux_inflation'))
+
+    for entry in entries:
+        entry.taux_inflation = inflation_rates.get(entry.annee, Decimal('0'))
+        entry.montant_reel_ajuste = entry.montant_reel / (1 + entry.taux_inflation / 100)
+
+    with transaction.atomic():
+        RealAccountData.objects.bulk_update(entries, ['taux_inflation', 'montant_reel_ajuste'])
+        invalidate_user_cache([simulation.user_id])
+
+    return len(entries)
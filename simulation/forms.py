@@ -1,11 +1,9 @@
 from django import forms
 from django.core.exceptions import ValidationError
-from django.db import transaction
 from .models import Simulation, Category, RealAccountData, Stock, Portfolio, Position, Transaction, AnnualInflationRate
-from decimal import Decimal
+from .importers import create_simulations, format_row_errors, parse_simulation_csv
 import csv
-import io
-from typing import List, Dict, Any, Optional
+from typing import List, Optional
 
 
 
@@ -28,7 +26,8 @@ class SimulationForm(forms.ModelForm):
     class Meta:
         model = Simulation
         fields = ['categorie', 'nom_compte', 'montant_initial', 'currency',
-                  'taux_rentabilite', 'periode', 'annee_depart', 'montant_fixe_annuel']
+                  'taux_rentabilite', 'periode', 'annee_depart', 'montant_fixe_annuel',
+                  'volatilite', 'nombre_trajectoires']
         widgets = {
             'categorie': forms.Select(attrs={
                 'class': 'form-select',
@@ -69,6 +68,18 @@ class SimulationForm(forms.ModelForm):
                 'step': '0.01',
                 'required': True
             }),
+            'volatilite': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'step': '0.1',
+                'min': '0',
+                'max': '100'
+            }),
+            'nombre_trajectoires': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'step': '100',
+                'min': '0',
+                'max': '10000'
+            }),
         }
         labels = {
             'categorie': 'Catégorie',
@@ -78,12 +89,16 @@ class SimulationForm(forms.ModelForm):
             'taux_rentabilite': 'Taux de rentabilité (%)',
             'periode': 'Période (années)',
             'annee_depart': 'Année de départ',
-            'montant_fixe_annuel': 'Montant fixe annuel'
+            'montant_fixe_annuel': 'Montant fixe annuel',
+            'volatilite': 'Volatilité (%)',
+            'nombre_trajectoires': 'Nombre de trajectoires'
         }
         help_texts = {
             'taux_rentabilite': 'Entrez le taux en pourcentage (ex: 5 pour 5%)',
             'periode': 'Nombre d\'années de simulation',
-            'montant_fixe_annuel': 'Montant ajouté chaque année'
+            'montant_fixe_annuel': 'Montant ajouté chaque année',
+            'volatilite': 'Écart-type annuel du rendement, 0 pour une projection déterministe',
+            'nombre_trajectoires': 'Trajectoires Monte Carlo pour les bandes P5/P50/P95 (max 10000)'
         }
 
     def __init__(self, *args, user=None, **kwargs):
@@ -95,6 +110,16 @@ class SimulationForm(forms.ModelForm):
         self.fields['categorie'].queryset = Category.objects.all()
         self.fields['categorie'].empty_label = "Sélectionnez une catégorie"
 
+        # Monte Carlo parameters are optional, empty means deterministic
+        self.fields['volatilite'].required = False
+        self.fields['nombre_trajectoires'].required = False
+
+    def clean_volatilite(self):
+        return self.cleaned_data.get('volatilite') or 0
+
+    def clean_nombre_trajectoires(self):
+        return self.cleaned_data.get('nombre_trajectoires') or 0
+
     def save(self, commit=True):
         instance = super(SimulationForm, self).save(commit=False)
         if self.user:
@@ -171,10 +196,11 @@ class StockForm(forms.ModelForm):
 class PortfolioForm(forms.ModelForm):
     class Meta:
         model = Portfolio
-        fields = ['name', 'description']
+        fields = ['name', 'description', 'cost_method']
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
+            'cost_method': forms.Select(attrs={'class': 'form-select'}),
         }
 
 class PositionForm(forms.ModelForm):
@@ -235,7 +261,7 @@ class SimulationCSVImportForm(forms.Form):
         super().__init__(*args, **kwargs)
         self.user = user
 
-    def clean_csv_file(self) -> List[Dict[str, Any]]:
+    def clean_csv_file(self) -> List[Simulation]:
         csv_file = self.cleaned_data['csv_file']
 
         if not csv_file.name.endswith('.csv'):
@@ -243,83 +269,23 @@ class SimulationCSVImportForm(forms.Form):
 
         # Read and validate CSV content
         try:
-            decoded_file = csv_file.read().decode('utf-8')
-            csv_data = csv.DictReader(io.StringIO(decoded_file), delimiter=';')
-
-            required_fields = {
-                'categorie', 'nom_compte', 'montant_initial', 'currency',
-                'taux_rentabilite', 'periode', 'annee_depart', 'montant_fixe_annuel'
-            }
-
-            if not required_fields.issubset(csv_data.fieldnames):
-                missing_fields = required_fields - set(csv_data.fieldnames)
-                raise ValidationError(f"Colonnes manquantes: {', '.join(missing_fields)}")
-
-            processed_data = []
-            for row_num, row in enumerate(csv_data, start=2):  # start=2 because row 1 is headers
-                try:
-                    # Validate and convert data types
-                    processed_row = {
-                        'categorie': row['categorie'].strip(),
-                        'nom_compte': row['nom_compte'].strip(),
-                        'montant_initial': Decimal(row['montant_initial'].replace(',', '.')),
-                        'currency': row['currency'].strip(),
-                        'taux_rentabilite': float(row['taux_rentabilite'].replace(',', '.')),
-                        'periode': int(row['periode']),
-                        'annee_depart': int(row['annee_depart']),
-                        'montant_fixe_annuel': Decimal(row['montant_fixe_annuel'].replace(',', '.'))
-                    }
-
-                    # Validate category exists
-                    if not Category.objects.filter(category=processed_row['categorie']).exists():
-                        raise ValidationError(f"Catégorie invalide à la ligne {row_num}: {processed_row['categorie']}")
-
-                    # Validate currency
-                    if processed_row['currency'] not in dict(Simulation.CURRENCY_TYPE):
-                        raise ValidationError(f"Devise invalide à la ligne {row_num}: {processed_row['currency']}")
-
-                    processed_data.append(processed_row)
-
-                except (ValueError, TypeError) as e:
-                    raise ValidationError(f"Erreur de format à la ligne {row_num}: {str(e)}")
-
-            return processed_data
-
+            simulations, self.import_report = parse_simulation_csv(csv_file.read().decode('utf-8'))
         except UnicodeDecodeError:
             raise ValidationError("Le fichier n'est pas encodé en UTF-8")
         except csv.Error as e:
             raise ValidationError(f"Erreur lors de la lecture du CSV: {str(e)}")
 
+        if self.import_report.errors:
+            raise ValidationError(format_row_errors(self.import_report.errors))
+
+        return simulations
+
     def save(self) -> List[Simulation]:
         """Save the imported simulations to the database."""
         if not self.user:
             raise ValueError("User must be set to save simulations")
 
-        processed_data = self.cleaned_data['csv_file']
-        simulations = []
-
         try:
-            with transaction.atomic():
-                for row in processed_data:
-                    category = Category.objects.get(category=row['categorie'])
-                    simulation = Simulation(
-                        user=self.user,
-                        categorie=category,
-                        nom_compte=row['nom_compte'],
-                        montant_initial=row['montant_initial'],
-                        currency=row['currency'],
-                        taux_rentabilite=row['taux_rentabilite'],
-                        periode=row['periode'],
-                        annee_depart=row['annee_depart'],
-                        montant_fixe_annuel=row['montant_fixe_annuel']
-                    )
-                    simulation.full_clean()  # Validate the model
-                    simulations.append(simulation)
-
-                # Bulk create all simulations
-                Simulation.objects.bulk_create(simulations)
-
+            return create_simulations(self.user, self.cleaned_data['csv_file'])
         except Exception as e:
             raise ValidationError(f"Erreur lors de la sauvegarde des simulations: {str(e)}")
-
-        return simulations
@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+import logging
+import os
+import re
+import tempfile
+
+import numpy as np
+from django.conf import settings
+
+from .cache import invalidate_price_caches
+from .models import Stock, DailyPrice
+
+logger = logging.getLogger(__name__)
+
+PRICE_HISTORY_DIR = Path(getattr(settings, 'PRICE_HISTORY_DIR', Path(settings.BASE_DIR) / 'price_history'))
+
+# One record per trading day, in date order
+HISTORY_DTYPE = np.dtype([
+    ('date', 'datetime64[D]'),
+    ('close', 'float64'),
+    ('volume', 'int64'),
+])
+
+
+@dataclass(frozen=True)
+class PriceHistory:
+    """Daily closes and volumes of a symbol, as read-only views of its history file."""
+    dates: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+
+    def __len__(self):
+        return len(self.dates)
+
+    def returns(self) -> np.ndarray:
+        """Daily simple returns."""
+        return self.close[1:] / self.close[:-1] - 1
+
+    def volatility(self, periods_per_year: int = 252) -> float:
+        """Annualized volatility of the daily returns."""
+        if len(self) < 3:
+            return 0.0
+        return float(np.std(self.returns(), ddof=1) * np.sqrt(periods_per_year))
+
+
+def _history_path(symbol: str) -> Path:
+    # Symbols such as "AIR.PA" are kept readable, anything else is replaced
+    return PRICE_HISTORY_DIR / f"{re.sub(r'[^A-Za-z0-9._-]', '_', symbol)}.npy"
+
+
+# symbol -> (file mtime, history), so a read only costs a stat() while the
+# file is unchanged
+_open_histories: Dict[str, Tuple[int, PriceHistory]] = {}
+
+
+def load_price_history(symbol: str) -> Optional[PriceHistory]:
+    """
+    Return the price history of a symbol, memory-mapped from its file, or
+    None if it has none. No ORM row is loaded.
+    """
+    path = _history_path(symbol)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    cached = _open_histories.get(symbol)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    records = np.load(path, mmap_mode='r')
+    history = PriceHistory(records['date'], records['close'], records['volume'])
+    _open_histories[symbol] = (mtime, history)
+    return history
+
+
+def _records(rows) -> np.ndarray:
+    rows = list(rows)
+    records = np.empty(len(rows), dtype=HISTORY_DTYPE)
+    if rows:
+        dates, closes, volumes = zip(*rows)
+        records['date'] = np.array(dates, dtype='datetime64[D]')
+        records['close'] = np.array(closes, dtype='float64')
+        records['volume'] = np.array(volumes, dtype='int64')
+    return records
+
+
+def _write(symbol: str, records: np.ndarray) -> None:
+    """Replace the history file atomically, readers keep their previous map."""
+    PRICE_HISTORY_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=PRICE_HISTORY_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, records)
+        os.replace(tmp_path, _history_path(symbol))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def update_price_history(stock: Stock, rebuild: bool = False) -> int:
+    """
+    Append the daily prices stored after the end of a symbol's history file,
+    or rebuild it from every stored price. Return the number of days added.
+    """
+    history = None if rebuild else load_price_history(stock.symbol)
+
+    prices = DailyPrice.objects.filter(stock=stock)
+    if history is not None and len(history):
+        prices = prices.filter(date__gt=history.dates[-1].item())
+    new_records = _records(prices.order_by('date').values_list('date', 'close', 'volume'))
+    if not len(new_records) and not rebuild:
+        return 0
+
+    records = new_records
+    if history is not None:
+        # Read the file again rather than the map: another process may have
+        # appended the same days since, they must not be added twice
+        existing = np.load(_history_path(stock.symbol))
+        if len(existing):
+            new_records = new_records[new_records['date'] > existing['date'][-1]]
+        records = np.concatenate([existing, new_records])
+    _write(stock.symbol, records)
+    return len(new_records)
+
+
+def update_price_histories(stocks: Iterable[Stock], rebuild: bool = False) -> int:
+    added = 0
+    for stock in stocks:
+        try:
+            added += update_price_history(stock, rebuild)
+        except OSError as e:
+            logger.error(f"Error writing the price history of {stock.symbol}: {str(e)}")
+    if added or rebuild:
+        invalidate_price_caches()
+    return added
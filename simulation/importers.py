@@ -0,0 +1,413 @@
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Tuple
+import csv
+import io
+import logging
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+
+from .cache import invalidate_user_cache
+from .ledger import lock_portfolio, rebuild_positions
+from .models import Simulation, Category, RealAccountData, AnnualInflationRate, Portfolio, Stock, Transaction
+from .projections import validate_simulation_inputs, project_and_store
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = 2000
+
+# Number of row problems spelled out in the messages shown to the user
+MAX_REPORTED_ROWS = 20
+
+SIMULATION_CSV_FIELDS = (
+    'categorie', 'nom_compte', 'montant_initial', 'currency',
+    'taux_rentabilite', 'periode', 'annee_depart', 'montant_fixe_annuel'
+)
+SIMULATION_CSV_OPTIONAL_FIELDS = ('volatilite', 'nombre_trajectoires')
+
+# frais, notes, and nom and type_actif for the titres to create, are optional
+TRANSACTION_CSV_FIELDS = ('date', 'type', 'symbole', 'quantite', 'prix')
+TRANSACTION_TYPES = {'BUY': 'BUY', 'ACHAT': 'BUY', 'SELL': 'SELL', 'VENTE': 'SELL'}
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+
+@dataclass
+class RowError:
+    """A problem found on one line of an imported file."""
+    line: int
+    message: str
+    field: Optional[str] = None
+
+    def __str__(self):
+        if self.field:
+            return f"Ligne {self.line} ({self.field}): {self.message}"
+        return f"Ligne {self.line}: {self.message}"
+
+
+@dataclass
+class ImportReport:
+    """Outcome of a bulk import."""
+    rows: int = 0
+    imported: int = 0
+    errors: List[RowError] = field(default_factory=list)
+    warnings: List[RowError] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def format_row_errors(problems: List[RowError], limit: int = MAX_REPORTED_ROWS) -> List[str]:
+    """Render the first problems of a report, and how many were left out."""
+    lines = [str(problem) for problem in problems[:limit]]
+    if len(problems) > limit:
+        lines.append(f"... et {len(problems) - limit} autres lignes")
+    return lines
+
+
+def parse_decimal(value: str) -> Decimal:
+    """Parse a number written with either a decimal comma or a decimal point."""
+    try:
+        return Decimal(value.strip().replace(',', '.'))
+    except (InvalidOperation, AttributeError):
+        raise ValueError(f"nombre invalide: {value!r}")
+
+
+def parse_date(value: str) -> date:
+    """Parse a date written as YYYY-MM-DD or DD/MM/YYYY."""
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except (ValueError, AttributeError):
+            continue
+    raise ValueError(f"date invalide: {value!r}")
+
+
+def read_csv(content: str) -> csv.DictReader:
+    return csv.DictReader(io.StringIO(content), delimiter=';')
+
+
+def import_real_account_data(user, content: str) -> ImportReport:
+    """
+    Import real account data from a CSV file (nom_compte;annee;montant_reel
+    and an optional taux_inflation column).
+
+    The whole file is parsed first, account names are resolved with one
+    query, missing inflation rates come from one AnnualInflationRate lookup
+    and every row is upserted on (simulation, annee) with a single
+    bulk_create. Nothing is written if any line is malformed.
+    """
+    start = time.perf_counter()
+    report = ImportReport()
+    reader = read_csv(content)
+
+    missing_fields = {'nom_compte', 'annee', 'montant_reel'} - set(reader.fieldnames or [])
+    if missing_fields:
+        report.errors.append(RowError(1, f"Colonnes manquantes: {', '.join(sorted(missing_fields))}"))
+        return report
+
+    # Last line wins when the same account and year appear twice
+    parsed: Dict[Tuple[str, int], Tuple[int, Decimal, Optional[Decimal]]] = {}
+    for line, row in enumerate(reader, start=2):  # start=2 because row 1 is headers
+        report.rows += 1
+        try:
+            nom_compte = row['nom_compte'].strip()
+            annee = int(row['annee'])
+            montant_reel = parse_decimal(row['montant_reel'])
+            taux = row.get('taux_inflation')
+            taux_inflation = parse_decimal(taux) if taux and taux.strip() else None
+        except (ValueError, TypeError, AttributeError) as e:
+            report.errors.append(RowError(line, f"Erreur de format: {str(e)}"))
+            continue
+        parsed[(nom_compte, annee)] = (line, montant_reel, taux_inflation)
+
+    if report.errors:
+        report.seconds = time.perf_counter() - start
+        return report
+
+    simulation_ids: Dict[str, int] = {}
+    duplicates = set()
+    for nom_compte, simulation_id in Simulation.objects.filter(
+            user=user,
+            nom_compte__in={nom_compte for nom_compte, _ in parsed}
+    ).values_list('nom_compte', 'id'):
+        if nom_compte in simulation_ids:
+            duplicates.add(nom_compte)
+        simulation_ids[nom_compte] = simulation_id
+
+    inflation_rates = dict(AnnualInflationRate.objects.filter(
+        annee__in={annee for _, annee in parsed}
+    ).values_list('annee', 'taux_inflation'))
+
+    entries = []
+    for (nom_compte, annee), (line, montant_reel, taux_inflation) in parsed.items():
+        if nom_compte not in simulation_ids:
+            report.warnings.append(RowError(line, f"Compte non trouvé: {nom_compte}"))
+            continue
+        if nom_compte in duplicates:
+            report.warnings.append(RowError(line, f"Plusieurs comptes nommés {nom_compte}"))
+            continue
+
+        if taux_inflation is None:
+            taux_inflation = inflation_rates.get(annee, Decimal('0'))
+
+        entries.append(RealAccountData(
+            simulation_id=simulation_ids[nom_compte],
+            annee=annee,
+            montant_reel=montant_reel,
+            taux_inflation=taux_inflation,
+            # bulk_create bypasses RealAccountData.save(), which computes it
+            montant_reel_ajuste=montant_reel / (1 + taux_inflation / 100)
+        ))
+
+    with transaction.atomic():
+        RealAccountData.objects.bulk_create(
+            entries,
+            batch_size=IMPORT_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['simulation', 'annee'],
+            update_fields=['montant_reel', 'taux_inflation', 'montant_reel_ajuste', 'date_mise_a_jour']
+        )
+        invalidate_user_cache([user.id])
+
+    report.imported = len(entries)
+    report.seconds = time.perf_counter() - start
+    logger.info(
+        f"Imported {report.imported}/{report.rows} real data rows for user {user.id} "
+        f"in {report.seconds:.3f}s"
+    )
+    return report
+
+
+def _clean_column(name: str, values: List[str], report: ImportReport) -> List[Any]:
+    """
+    Clean one CSV column with the rules of the model field (type, choices,
+    max_digits...), so a file is validated like full_clean() would do
+    without touching the database.
+    """
+    model_field = Simulation._meta.get_field(name)
+    numeric = isinstance(model_field, (models.DecimalField, models.FloatField))
+
+    cleaned = []
+    for line, raw in enumerate(values, start=2):  # start=2 because row 1 is headers
+        raw = (raw or '').strip()
+        if numeric:
+            raw = raw.replace(',', '.')
+        if not raw and model_field.has_default():
+            cleaned.append(model_field.get_default())
+            continue
+        try:
+            cleaned.append(model_field.clean(raw, None))
+        except ValidationError as e:
+            report.errors.append(RowError(line, ' '.join(e.messages), name))
+            cleaned.append(None)
+    return cleaned
+
+
+def parse_simulation_csv(content: str) -> Tuple[List[Simulation], ImportReport]:
+    """
+    Validate a simulation CSV file and build the (unsaved) simulations.
+
+    Categories are resolved from a lookup table loaded once and each column
+    is checked in one pass, so the number of queries doesn't depend on the
+    size of the file. Every problem found is collected in the report; no
+    simulation is returned if there is any.
+    """
+    start = time.perf_counter()
+    report = ImportReport()
+    reader = read_csv(content)
+
+    missing_fields = set(SIMULATION_CSV_FIELDS) - set(reader.fieldnames or [])
+    if missing_fields:
+        report.errors.append(RowError(1, f"Colonnes manquantes: {', '.join(sorted(missing_fields))}"))
+        return [], report
+
+    rows = list(reader)
+    report.rows = len(rows)
+
+    categories = dict(Category.objects.values_list('category', 'id'))
+    category_ids = []
+    for line, row in enumerate(rows, start=2):
+        name = (row['categorie'] or '').strip()
+        if name not in categories:
+            report.errors.append(RowError(line, f"Catégorie invalide: {name}", 'categorie'))
+        category_ids.append(categories.get(name))
+
+    columns = {
+        name: _clean_column(name, [row.get(name) for row in rows], report)
+        for name in SIMULATION_CSV_FIELDS[1:] + SIMULATION_CSV_OPTIONAL_FIELDS
+    }
+
+    invalid_lines = {error.line for error in report.errors}
+    simulations = []
+    for index, category_id in enumerate(category_ids):
+        line = index + 2
+        if line in invalid_lines:
+            continue
+        simulation = Simulation(
+            categorie_id=category_id,
+            **{name: values[index] for name, values in columns.items()}
+        )
+        if not validate_simulation_inputs(simulation):
+            report.errors.append(RowError(line, "Paramètres de calcul invalides"))
+            continue
+        simulations.append(simulation)
+
+    report.errors.sort(key=lambda error: error.line)
+    report.seconds = time.perf_counter() - start
+    if report.errors:
+        return [], report
+    return simulations, report
+
+
+def create_simulations(user, simulations: List[Simulation]) -> List[Simulation]:
+    """Save parsed simulations for a user and compute their results, all or nothing."""
+    for simulation in simulations:
+        simulation.user = user
+
+    with transaction.atomic():
+        # Rows were validated against the model fields while parsing
+        Simulation.objects.bulk_create(simulations, batch_size=IMPORT_BATCH_SIZE)
+
+        # A failure rolls back the entire import
+        project_and_store(simulations)
+
+    return simulations
+
+
+class _ImportRejected(Exception):
+    """Rolls back an import whose rows are only found invalid once written."""
+
+
+def _clean_amount(name: str, raw: Optional[str]) -> Decimal:
+    """Parse a number and check it against the Transaction field (digits, decimal places)."""
+    value = Transaction._meta.get_field(name).clean(parse_decimal(raw or ''), None)
+    if value < 0:
+        raise ValueError(f"nombre négatif: {raw!r}")
+    return value
+
+
+def import_transactions(portfolio: Portfolio, content: str) -> ImportReport:
+    """
+    Import the transactions of a portfolio from a CSV file
+    (date;type;symbole;quantite;prix and optional frais and notes columns;
+    nom and type_actif describe the titres not known yet).
+
+    Symbols are resolved with one query and the missing stocks created with
+    one bulk_create, the transactions are inserted with bulk_create, then
+    the positions of the traded stocks are rebuilt by one ledger replay.
+    Nothing is written if any line is malformed or a sale exceeds the
+    quantity held at its date.
+    """
+    start = time.perf_counter()
+    report = ImportReport()
+    reader = read_csv(content)
+
+    missing_fields = set(TRANSACTION_CSV_FIELDS) - set(reader.fieldnames or [])
+    if missing_fields:
+        report.errors.append(RowError(1, f"Colonnes manquantes: {', '.join(sorted(missing_fields))}"))
+        return report
+
+    asset_types = {asset_type for asset_type, _ in Stock.ASSET_TYPES}
+    symbol_length = Stock._meta.get_field('symbol').max_length
+    parsed = []
+    candidates: Dict[str, Stock] = {}
+    first_lines: Dict[str, int] = {}
+    for line, row in enumerate(reader, start=2):  # start=2 because row 1 is headers
+        report.rows += 1
+        try:
+            day = parse_date(row['date'])
+            transaction_type = TRANSACTION_TYPES.get((row['type'] or '').strip().upper())
+            if transaction_type is None:
+                raise ValueError(f"type invalide: {row['type']!r} (Achat ou Vente)")
+            symbol = (row['symbole'] or '').strip()
+            if not symbol or len(symbol) > symbol_length:
+                raise ValueError(f"symbole invalide: {symbol!r}")
+            quantity = _clean_amount('quantity', row['quantite'])
+            price = _clean_amount('price', row['prix'])
+            fees = _clean_amount('fees', row.get('frais') or '0')
+            asset_type = (row.get('type_actif') or 'STOCK').strip().upper()
+            if asset_type not in asset_types:
+                raise ValueError(f"type d'actif invalide: {asset_type!r}")
+        except (ValueError, TypeError) as e:
+            report.errors.append(RowError(line, f"Erreur de format: {str(e)}"))
+            continue
+        except ValidationError as e:
+            report.errors.append(RowError(line, ' '.join(e.messages)))
+            continue
+
+        first_lines.setdefault(symbol, line)
+        candidates.setdefault(symbol, Stock(
+            symbol=symbol,
+            name=(row.get('nom') or '').strip() or symbol,
+            asset_type=asset_type
+        ))
+        parsed.append((line, symbol, Transaction(
+            portfolio=portfolio,
+            transaction_type=transaction_type,
+            quantity=quantity,
+            price=price,
+            fees=fees,
+            date=day,
+            notes=(row.get('notes') or '').strip()
+        )))
+
+    if report.errors:
+        report.seconds = time.perf_counter() - start
+        return report
+
+    try:
+        with transaction.atomic():
+            lock_portfolio(portfolio.id)
+
+            stock_ids = dict(Stock.objects.filter(symbol__in=list(candidates)).values_list('symbol', 'id'))
+            missing = [stock for symbol, stock in candidates.items() if symbol not in stock_ids]
+            if missing:
+                Stock.objects.bulk_create(missing, batch_size=IMPORT_BATCH_SIZE, ignore_conflicts=True)
+                # ignore_conflicts doesn't return the ids on every database
+                stock_ids.update(Stock.objects.filter(
+                    symbol__in=[stock.symbol for stock in missing]
+                ).values_list('symbol', 'id'))
+
+            sale_lines: Dict[Tuple[int, date], int] = {}
+            for line, symbol, transaction_obj in parsed:
+                transaction_obj.stock_id = stock_ids[symbol]
+                if transaction_obj.transaction_type == 'SELL':
+                    sale_lines.setdefault((transaction_obj.stock_id, transaction_obj.date), line)
+            Transaction.objects.bulk_create(
+                [transaction_obj for _, _, transaction_obj in parsed],
+                batch_size=IMPORT_BATCH_SIZE
+            )
+
+            replay = rebuild_positions(
+                Portfolio.objects.filter(pk=portfolio.pk),
+                stock_ids=set(stock_ids.values())
+            )
+            if replay.oversold:
+                symbols = {stock_id: symbol for symbol, stock_id in stock_ids.items()}
+                for (_, stock_id), day in replay.oversold.items():
+                    report.errors.append(RowError(
+                        sale_lines.get((stock_id, day), first_lines[symbols[stock_id]]),
+                        f"Vente de {symbols[stock_id]} du {day.strftime('%d/%m/%Y')} "
+                        f"supérieure à la position détenue",
+                        'quantite'
+                    ))
+                raise _ImportRejected()
+    except _ImportRejected:
+        report.errors.sort(key=lambda error: error.line)
+        report.seconds = time.perf_counter() - start
+        return report
+
+    for stock in missing:
+        report.warnings.append(RowError(first_lines[stock.symbol], f"Titre créé: {stock.symbol}"))
+    report.imported = len(parsed)
+    report.seconds = time.perf_counter() - start
+    logger.info(
+        f"Imported {report.imported} transactions into portfolio {portfolio.id} "
+        f"in {report.seconds:.3f}s ({report.rows_per_second:.0f} rows/s)"
+    )
+    return report
@@ -0,0 +1,233 @@
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .comparison import apply_inflation_rates
+from .importers import create_simulations, format_row_errors, import_real_account_data, import_transactions, \
+    parse_simulation_csv
+from .market import refresh_stocks
+from .models import Job, Portfolio, Simulation, Stock
+from .prices import sync_daily_prices
+from .tasks import update_all_stocks
+from .utils import PRIORITY_INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+# kind -> function(job) returning the JSON result of the job
+JOB_HANDLERS: Dict[str, Callable[[Job], Dict[str, Any]]] = {}
+
+
+class JobError(Exception):
+    """Raised by a handler to fail a job with a result (e.g. an import report)."""
+
+    def __init__(self, message: str, result: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.result = result or {}
+
+
+def job_handler(kind: str):
+    """Register the decorated function as the handler of a job kind."""
+    def register(handler: Callable[[Job], Dict[str, Any]]):
+        JOB_HANDLERS[kind] = handler
+        return handler
+    return register
+
+
+def background_jobs_enabled() -> bool:
+    return getattr(settings, 'BACKGROUND_JOBS', False)
+
+
+def enqueue(kind: str, user=None, priority: int = Job.PRIORITY_NORMAL, **payload) -> Job:
+    """Queue a job for the run_jobs worker."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = Job.objects.create(kind=kind, user=user, priority=priority, payload=payload)
+    logger.info(f"Enqueued job {job}")
+    return job
+
+
+def claim_jobs(limit: int) -> List[int]:
+    """
+    Mark up to limit pending jobs as running and return their ids, highest
+    priority then oldest first. Rows locked by another worker are skipped on PostgreSQL, and the
+    conditional update keeps a job from being claimed twice elsewhere.
+    """
+    claimed = []
+    with transaction.atomic():
+        candidates = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.STATUS_PENDING)
+            .order_by('-priority', 'created_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        for job_id in list(candidates):
+            if Job.objects.filter(id=job_id, status=Job.STATUS_PENDING).update(
+                    status=Job.STATUS_RUNNING,
+                    started_at=timezone.now()
+            ):
+                claimed.append(job_id)
+    return claimed
+
+
+def requeue_stale_jobs(timeout: Optional[timedelta] = None) -> int:
+    """
+    Queue again the jobs still marked running after timeout (JOB_STALE_TIMEOUT_MINUTES
+    by default), whose worker process died without recording their outcome.
+    Return the number of jobs requeued.
+    """
+    if timeout is None:
+        timeout = timedelta(minutes=getattr(settings, 'JOB_STALE_TIMEOUT_MINUTES', 60))
+    requeued = Job.objects.filter(
+        status=Job.STATUS_RUNNING,
+        started_at__lt=timezone.now() - timeout
+    ).update(status=Job.STATUS_PENDING, started_at=None, progress=0)
+    if requeued:
+        logger.warning(f"Requeued {requeued} stale running job(s)")
+    return requeued
+
+
+def report_progress(job: Job, progress: int, total: Optional[int] = None) -> None:
+    """Store the progress of a running job, for the polling endpoint."""
+    job.progress = progress
+    fields = {'progress': progress}
+    if total is not None:
+        job.total = fields['total'] = total
+    Job.objects.filter(id=job.id).update(**fields)
+
+
+def run_job(job_id: int) -> str:
+    """Run a claimed job and record its outcome. Return its final status."""
+    job = Job.objects.select_related('user').get(id=job_id)
+
+    try:
+        result = JOB_HANDLERS[job.kind](job)
+        job.status = Job.STATUS_DONE
+        job.result = result or {}
+    except JobError as e:
+        job.status = Job.STATUS_FAILED
+        job.error = str(e)
+        job.result = e.result
+    except Exception as e:
+        logger.error(f"Job {job.id} ({job.kind}) failed: {str(e)}", exc_info=True)
+        job.status = Job.STATUS_FAILED
+        job.error = str(e)
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'finished_at'])
+    logger.info(f"Finished job {job}")
+    return job.status
+
+
+def queue_quote_refresh(stocks: Iterable[Stock], user=None) -> Optional[Job]:
+    """
+    Queue an interactive refresh of the given stocks, leaving out the symbols
+    a pending or running refresh job already covers. Return the job, None if
+    nothing was queued.
+    """
+    queued = {
+        symbol
+        for payload in Job.objects.filter(
+            kind='refresh_quotes',
+            status__in=[Job.STATUS_PENDING, Job.STATUS_RUNNING]
+        ).values_list('payload', flat=True)
+        for symbol in payload.get('symbols', [])
+    }
+    symbols = list(dict.fromkeys(stock.symbol for stock in stocks if stock.symbol not in queued))
+    if not symbols:
+        return None
+    return enqueue('refresh_quotes', user=user, priority=Job.PRIORITY_INTERACTIVE, symbols=symbols)
+
+
+def fail_job(job_id: int, message: str) -> None:
+    """Fail a job that didn't get to record its own outcome (e.g. its worker died)."""
+    Job.objects.filter(id=job_id, status=Job.STATUS_RUNNING).update(
+        status=Job.STATUS_FAILED,
+        error=message,
+        finished_at=timezone.now()
+    )
+
+
+@job_handler('import_simulations')
+def _import_simulations(job: Job) -> Dict[str, Any]:
+    simulations, report = parse_simulation_csv(job.payload['content'])
+    report_progress(job, 0, report.rows)
+    if report.errors:
+        raise JobError(
+            "Le fichier contient des erreurs",
+            {'errors': format_row_errors(report.errors)}
+        )
+
+    create_simulations(job.user, simulations)
+    report_progress(job, report.rows)
+    return {'imported': len(simulations)}
+
+
+@job_handler('import_real_data')
+def _import_real_data(job: Job) -> Dict[str, Any]:
+    report = import_real_account_data(job.user, job.payload['content'])
+    result = {
+        'imported': report.imported,
+        'errors': format_row_errors(report.errors),
+        'warnings': format_row_errors(report.warnings),
+    }
+    if report.errors:
+        raise JobError("Le fichier contient des erreurs", result)
+    report_progress(job, report.rows, report.rows)
+    return result
+
+
+@job_handler('import_transactions')
+def _import_transactions(job: Job) -> Dict[str, Any]:
+    portfolio = Portfolio.objects.get(id=job.payload['portfolio_id'], user=job.user)
+    report = import_transactions(portfolio, job.payload['content'])
+    result = {
+        'imported': report.imported,
+        'errors': format_row_errors(report.errors),
+        'warnings': format_row_errors(report.warnings),
+        'rows_per_second': round(report.rows_per_second),
+    }
+    if report.errors:
+        raise JobError("Le fichier contient des erreurs", result)
+    report_progress(job, report.rows, report.rows)
+    return result
+
+
+@job_handler('recalculate_real_data')
+def _recalculate_real_data(job: Job) -> Dict[str, Any]:
+    simulation = Simulation.objects.get(id=job.payload['simulation_id'], user=job.user)
+    updated = apply_inflation_rates(simulation)
+    report_progress(job, updated, updated)
+    return {'updated': updated}
+
+
+@job_handler('refresh_stocks')
+def _refresh_stocks(job: Job) -> Dict[str, Any]:
+    updated = update_all_stocks(progress=lambda done, total: report_progress(job, done, total))
+    return {'updated': updated}
+
+
+@job_handler('refresh_quotes')
+def _refresh_quotes(job: Job) -> Dict[str, Any]:
+    updated = refresh_stocks(
+        Stock.objects.filter(symbol__in=job.payload['symbols']),
+        priority=PRIORITY_INTERACTIVE,
+        progress=lambda done, total: report_progress(job, done, total)
+    )
+    return {'updated': updated}
+
+
+@job_handler('sync_prices')
+def _sync_prices(job: Job) -> Dict[str, Any]:
+    stocks = Stock.objects.all()
+    if job.payload.get('symbols'):
+        stocks = stocks.filter(symbol__in=job.payload['symbols'])
+    added = sync_daily_prices(
+        stocks,
+        full=job.payload.get('full', False),
+        progress=lambda done, total: report_progress(job, done, total)
+    )
+    return {'added': added}
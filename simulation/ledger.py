@@ -0,0 +1,298 @@
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+from itertools import groupby
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import QuerySet
+
+from .cache import invalidate_portfolio_cache
+from .models import Portfolio, Position, Stock, Transaction
+
+logger = logging.getLogger(__name__)
+
+QUANTITY_STEP = Decimal('0.0001')
+COST_STEP = Decimal('0.0001')
+AMOUNT_STEP = Decimal('0.01')
+REPLAY_BATCH_SIZE = 2000
+
+LEDGER_FIELDS = ['quantity_after', 'cost_basis_after', 'lots_after', 'realized_gain']
+POSITION_FIELDS = ['quantity', 'average_price', 'purchase_date']
+TRANSACTION_FIELDS = ['id', 'portfolio_id', 'stock_id', 'transaction_type', 'quantity', 'price', 'fees', 'date']
+
+
+class OversoldError(ValidationError):
+    """A sale exceeds the quantity held at its date."""
+
+    def __init__(self, day: date):
+        super().__init__(f"Vente du {day.strftime('%d/%m/%Y')} : quantité de vente supérieure à la position détenue")
+        self.day = day
+
+
+@dataclass
+class RebuildReport:
+    transactions: int = 0
+    positions: int = 0
+    closed: int = 0
+    errors: List[str] = field(default_factory=list)
+    # (portfolio id, stock id) -> date of the first sale exceeding the holding
+    oversold: Dict[Tuple[int, int], date] = field(default_factory=dict)
+    seconds: float = 0.0
+
+
+class Ledger:
+    """
+    Open lots of one stock in a portfolio, oldest first, each as
+    [quantity, unit cost including fees, purchase date].
+
+    With the average cost method the lots are merged into one at every
+    purchase; with FIFO a sale consumes the oldest lots first.
+    """
+
+    def __init__(self, cost_method: str = Portfolio.COST_AVERAGE, lots: Iterable = ()):
+        self.cost_method = cost_method
+        self.lots = [[Decimal(quantity), Decimal(unit_cost), str(day)] for quantity, unit_cost, day in lots]
+
+    @property
+    def quantity(self) -> Decimal:
+        return sum((lot[0] for lot in self.lots), Decimal('0'))
+
+    @property
+    def cost_basis(self) -> Decimal:
+        return sum((lot[0] * lot[1] for lot in self.lots), Decimal('0'))
+
+    @property
+    def purchase_date(self) -> Optional[date]:
+        return date.fromisoformat(self.lots[0][2]) if self.lots else None
+
+    def buy(self, quantity: Decimal, price: Decimal, fees: Decimal, day: date) -> None:
+        cost = quantity * price + fees
+        if self.cost_method == Portfolio.COST_AVERAGE and self.lots:
+            total_quantity = self.quantity + quantity
+            self.lots = [[total_quantity, (self.cost_basis + cost) / total_quantity, self.lots[0][2]]]
+        else:
+            self.lots.append([quantity, cost / quantity, day.isoformat()])
+
+    def sell(self, quantity: Decimal, price: Decimal, fees: Decimal, day: date) -> Decimal:
+        """Remove quantity from the lots and return the realized gain, net of fees."""
+        if quantity > self.quantity:
+            raise OversoldError(day)
+        remaining = quantity
+        consumed_cost = Decimal('0')
+        while remaining > 0:
+            lot = self.lots[0]
+            taken = min(lot[0], remaining)
+            consumed_cost += taken * lot[1]
+            lot[0] -= taken
+            remaining -= taken
+            if not lot[0]:
+                self.lots.pop(0)
+        return quantity * price - fees - consumed_cost
+
+    def apply(self, transaction_obj: Transaction) -> None:
+        """Apply a transaction and store the resulting ledger state on it."""
+        realized_gain = None
+        if transaction_obj.transaction_type == 'SELL':
+            realized_gain = self.sell(
+                transaction_obj.quantity, transaction_obj.price, transaction_obj.fees, transaction_obj.date
+            ).quantize(AMOUNT_STEP)
+        else:
+            self.buy(transaction_obj.quantity, transaction_obj.price, transaction_obj.fees, transaction_obj.date)
+
+        transaction_obj.quantity_after = self.quantity.quantize(QUANTITY_STEP)
+        transaction_obj.cost_basis_after = self.cost_basis.quantize(COST_STEP)
+        transaction_obj.lots_after = [[str(quantity), str(unit_cost), day] for quantity, unit_cost, day in self.lots]
+        transaction_obj.realized_gain = realized_gain
+
+
+def _save_ledger(transactions: List[Transaction]) -> None:
+    """
+    Write the ledger fields of transactions with one prepared UPDATE run for
+    every row: bulk_update builds a CASE per row and field, which dominates
+    the time of a full replay.
+    """
+    if not transactions:
+        return
+    fields = [Transaction._meta.get_field(name) for name in LEDGER_FIELDS]
+    with connection.cursor() as cursor:
+        # The wrapper itself rather than the connection proxy, used once per value
+        db = cursor.db
+        quote = db.ops.quote_name
+        sql = (
+            f"UPDATE {quote(Transaction._meta.db_table)} "
+            f"SET {', '.join(f'{quote(field.column)} = %s' for field in fields)} "
+            f"WHERE {quote(Transaction._meta.pk.column)} = %s"
+        )
+        cursor.executemany(sql, [
+            [field.get_db_prep_save(getattr(transaction_obj, field.attname), db) for field in fields]
+            + [transaction_obj.pk]
+            for transaction_obj in transactions
+        ])
+
+
+def _position_values(ledger: Ledger) -> dict:
+    return {
+        'quantity': ledger.quantity.quantize(QUANTITY_STEP),
+        'average_price': (ledger.cost_basis / ledger.quantity).quantize(AMOUNT_STEP),
+        'purchase_date': ledger.purchase_date,
+    }
+
+
+def _store_position(portfolio: Portfolio, stock: Stock, ledger: Ledger) -> Optional[Position]:
+    if ledger.quantity <= 0:
+        Position.objects.filter(portfolio=portfolio, stock=stock).delete()
+        return None
+    position, _ = Position.objects.update_or_create(
+        portfolio=portfolio,
+        stock=stock,
+        defaults=_position_values(ledger)
+    )
+    return position
+
+
+def replay_positions(portfolio: Portfolio, stock: Stock, since: Optional[date] = None) -> Optional[Position]:
+    """
+    Replay the transactions of a stock in a portfolio dated since onwards,
+    from the ledger state stored on the transaction before them, and update
+    the position accordingly. Only the transactions from the changed date
+    are read and written. Transactions that were never replayed are
+    replayed from the first one.
+
+    Raises ValidationError, without saving anything, if a sale exceeds the
+    quantity held at its date. Must run in the transaction that changed
+    the portfolio, with the portfolio row locked (lock_portfolio).
+    """
+    transactions = Transaction.objects.filter(portfolio=portfolio, stock=stock).only(*TRANSACTION_FIELDS)
+
+    previous = None
+    if since is not None:
+        previous = (
+            transactions.filter(date__lt=since)
+            .only('quantity_after', 'lots_after')
+            .order_by('-date', '-id')
+            .first()
+        )
+        if previous is not None and previous.quantity_after is None:
+            previous, since = None, None
+
+    ledger = Ledger(portfolio.cost_method, previous.lots_after if previous else ())
+    if since is not None:
+        transactions = transactions.filter(date__gte=since)
+
+    replayed = list(transactions.order_by('date', 'id'))
+    for transaction_obj in replayed:
+        ledger.apply(transaction_obj)
+    _save_ledger(replayed)
+
+    invalidate_portfolio_cache([portfolio.id])
+    return _store_position(portfolio, stock, ledger)
+
+
+def lock_portfolio(portfolio_id: int) -> Portfolio:
+    """Lock a portfolio row until the end of the transaction, so its ledger is replayed by one request at a time."""
+    return Portfolio.objects.select_for_update().get(pk=portfolio_id)
+
+
+def rebuild_positions(
+        portfolios: Optional[QuerySet] = None,
+        stock_ids: Optional[Iterable[int]] = None,
+        progress: Optional[Callable[[int], None]] = None
+) -> RebuildReport:
+    """
+    Replay every transaction of the given portfolios (all by default), or
+    only of the given stocks, in one streaming pass ordered by portfolio,
+    stock and date, and rewrite their ledger state and positions in bulk.
+
+    A stock whose transactions sell more than held keeps its position and
+    the ledger state of all its transactions as is, and is reported in
+    errors. Positions without any transaction are left untouched. The
+    portfolios are locked for the whole rebuild.
+    """
+    start = time.perf_counter()
+    ledgers: Dict[Tuple[int, int], Ledger] = {}
+    report = RebuildReport()
+    replayed: List[Transaction] = []
+
+    with transaction.atomic():
+        # Locked like lock_portfolio does for a single replay, in id order so
+        # two rebuilds can't deadlock, and held until the positions are written
+        methods = dict(
+            (Portfolio.objects.all() if portfolios is None else portfolios)
+            .select_for_update()
+            .order_by('id')
+            .values_list('id', 'cost_method')
+        )
+
+        transactions = Transaction.objects.filter(portfolio_id__in=list(methods))
+        positions = Position.objects.filter(portfolio_id__in=list(methods))
+        if stock_ids is not None:
+            transactions = transactions.filter(stock_id__in=list(stock_ids))
+            positions = positions.filter(stock_id__in=list(stock_ids))
+
+        stream = (
+            transactions
+            .only(*TRANSACTION_FIELDS)
+            .order_by('portfolio_id', 'stock_id', 'date', 'id')
+            .iterator(chunk_size=REPLAY_BATCH_SIZE)
+        )
+
+        for key, group in groupby(stream, key=lambda t: (t.portfolio_id, t.stock_id)):
+            ledger = Ledger(methods[key[0]])
+            applied = []
+            try:
+                for transaction_obj in group:
+                    ledger.apply(transaction_obj)
+                    applied.append(transaction_obj)
+            except OversoldError as e:
+                # Nothing of the stock is saved, its stored ledger stays consistent
+                report.errors.append(f"Portfolio {key[0]}, titre {key[1]} : {' '.join(e.messages)}")
+                report.oversold[key] = e.day
+                continue
+            ledgers[key] = ledger
+            replayed.extend(applied)
+
+            if len(replayed) >= REPLAY_BATCH_SIZE:
+                _save_ledger(replayed)
+                report.transactions += len(replayed)
+                replayed = []
+                if progress:
+                    progress(report.transactions)
+        _save_ledger(replayed)
+        report.transactions += len(replayed)
+
+        existing = {
+            (position.portfolio_id, position.stock_id): position
+            for position in positions
+        }
+        to_create, to_update, to_delete = [], [], []
+        for (portfolio_id, stock_id), ledger in ledgers.items():
+            position = existing.get((portfolio_id, stock_id))
+            if ledger.quantity <= 0:
+                if position is not None:
+                    to_delete.append(position.id)
+                continue
+            values = _position_values(ledger)
+            if position is None:
+                to_create.append(Position(portfolio_id=portfolio_id, stock_id=stock_id, **values))
+            else:
+                for name, value in values.items():
+                    setattr(position, name, value)
+                to_update.append(position)
+
+        Position.objects.bulk_create(to_create, batch_size=REPLAY_BATCH_SIZE)
+        Position.objects.bulk_update(to_update, POSITION_FIELDS, batch_size=REPLAY_BATCH_SIZE)
+        Position.objects.filter(id__in=to_delete).delete()
+        invalidate_portfolio_cache(methods)
+
+    report.positions = len(to_create) + len(to_update)
+    report.closed = len(to_delete)
+    report.seconds = time.perf_counter() - start
+    logger.info(
+        f"Replayed {report.transactions} transactions of {len(methods)} portfolios "
+        f"in {report.seconds:.3f}s"
+    )
+    return report
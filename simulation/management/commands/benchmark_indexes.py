@@ -0,0 +1,180 @@
+from decimal import Decimal
+import statistics
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.db.models import Sum
+
+from ...models import Category, ConsolidatedResult, RealAccountData, Simulation
+
+BATCH_SIZE = 5000
+
+# Single column indexes of the foreign keys, as they were before the
+# composite ones replaced them
+FOREIGN_KEY_INDEXES = [
+    (ConsolidatedResult, models.Index(fields=['simulation'], name='bench_result_sim_idx')),
+    (RealAccountData, models.Index(fields=['simulation'], name='bench_realdata_sim_idx')),
+    (Simulation, models.Index(fields=['user'], name='bench_simulation_user_idx')),
+]
+COMPOSITE_INDEXES = [
+    (model, index) for model in (ConsolidatedResult, Simulation) for index in model._meta.indexes
+]
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a large dataset, then print the plans and timings of the hot queries on '
+        'simulations and results with the foreign key indexes only, then with the composite ones. '
+        'Everything is rolled back at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Users to create')
+        parser.add_argument('--simulations', type=int, default=25, help='Simulations per user')
+        parser.add_argument('--years', type=int, default=30, help='Years of results per simulation')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs of each query, the median is shown')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user, simulation, category = self._seed(options)
+                self._analyze()
+                queries = self._queries(user, simulation, category)
+
+                self._swap_indexes(drop=COMPOSITE_INDEXES, create=FOREIGN_KEY_INDEXES)
+                before = self._report('Before: foreign key indexes only', queries, options['repeat'])
+
+                self._swap_indexes(drop=FOREIGN_KEY_INDEXES, create=COMPOSITE_INDEXES)
+                after = self._report('After: composite indexes', queries, options['repeat'])
+
+                self.stdout.write('\nSummary (median ms, before -> after)')
+                for name in queries:
+                    self.stdout.write(f'  {name}: {before[name]:.2f} -> {after[name]:.2f}')
+                raise _Rollback()
+        except _Rollback:
+            self.stdout.write(self.style.SUCCESS('Benchmark finished, the seeded data was rolled back'))
+
+    def _seed(self, options):
+        start = time.perf_counter()
+        categories = list(Category.objects.all())
+        if not categories:
+            categories = Category.objects.bulk_create([Category(category=name) for name in Category.COMPTE_TYPE])
+
+        prefix = f'benchmark-{uuid.uuid4().hex[:8]}'
+        User = get_user_model()
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com')
+            for i in range(options['users'])
+        ], batch_size=BATCH_SIZE)
+
+        simulations = Simulation.objects.bulk_create([
+            Simulation(
+                user=user,
+                categorie=categories[i % len(categories)],
+                nom_compte=f'Compte {i}',
+                montant_initial=Decimal('1000'),
+                taux_rentabilite=3.0,
+                periode=options['years'],
+                annee_depart=2000,
+            )
+            for user in users
+            for i in range(options['simulations'])
+        ], batch_size=BATCH_SIZE)
+
+        results = [
+            ConsolidatedResult(
+                simulation=simulation,
+                annee=2000 + year,
+                montant=Decimal(1000 + year * 50),
+                nom_compte=simulation.nom_compte
+            )
+            for simulation in simulations
+            for year in range(options['years'])
+        ]
+        ConsolidatedResult.objects.bulk_create(results, batch_size=BATCH_SIZE)
+        RealAccountData.objects.bulk_create([
+            RealAccountData(
+                simulation=simulation,
+                annee=2000 + year,
+                montant_reel=Decimal(1000 + year * 40),
+                taux_inflation=Decimal('2'),
+                montant_reel_ajuste=Decimal(1000 + year * 40) / Decimal('1.02')
+            )
+            for simulation in simulations
+            for year in range(0, options['years'], 2)
+        ], batch_size=BATCH_SIZE)
+
+        self.stdout.write(
+            f'Seeded {len(users)} users, {len(simulations)} simulations and {len(results)} results '
+            f'in {time.perf_counter() - start:.1f}s'
+        )
+        user = users[len(users) // 2]
+        simulation = next(s for s in simulations if s.user_id == user.id)
+        return user, simulation, categories[0]
+
+    def _analyze(self):
+        """Refresh the planner statistics, the seeded tables changed a lot."""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                for model in (Simulation, ConsolidatedResult, RealAccountData):
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+            elif connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+
+    def _queries(self, user, simulation, category):
+        """The access paths of projections.py, comparison.py and the views."""
+        user_simulations = Simulation.objects.filter(user=user)
+        return {
+            'Results of a user': ConsolidatedResult.objects.filter(
+                simulation__in=user_simulations
+            ).order_by('simulation_id', 'annee').values_list('simulation_id', 'annee', 'montant'),
+            'Results of a simulation': ConsolidatedResult.objects.filter(
+                simulation=simulation
+            ).order_by('annee').values_list('annee', 'montant'),
+            'Yearly totals of a user': ConsolidatedResult.objects.filter(
+                simulation__in=user_simulations
+            ).values('annee').annotate(total=Sum('montant')).order_by('annee'),
+            'Simulation by account name': Simulation.objects.filter(user=user, nom_compte=simulation.nom_compte),
+            'Simulations of a category': Simulation.objects.filter(user=user, categorie=category),
+            'Real data of a user': RealAccountData.objects.filter(
+                simulation__user=user
+            ).values_list('simulation_id', 'annee', 'montant_reel', 'taux_inflation'),
+        }
+
+    def _swap_indexes(self, drop, create):
+        # Statements only: the SQLite schema editor can't be entered inside
+        # the transaction that holds the seeded data
+        editor = connection.schema_editor()
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            for model, index in drop:
+                cursor.execute(editor.sql_delete_index % {
+                    'table': quote(model._meta.db_table),
+                    'name': quote(index.name),
+                })
+            for model, index in create:
+                cursor.execute(str(index.create_sql(model, editor)))
+        self._analyze()
+
+    def _report(self, title, queries, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n{title}'))
+        medians = {}
+        for name, queryset in queries.items():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            medians[name] = statistics.median(timings)
+
+            self.stdout.write(f'\n{name}: {medians[name]:.2f} ms')
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f'    {line}')
+        return medians
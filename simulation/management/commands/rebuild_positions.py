@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from ...ledger import rebuild_positions
+from ...models import Portfolio
+
+
+class Command(BaseCommand):
+    help = 'Replay every transaction to rebuild the ledger and positions of the portfolios'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--portfolio',
+            type=int,
+            action='append',
+            dest='portfolios',
+            help='Only rebuild this portfolio id (can be repeated)'
+        )
+        parser.add_argument('--user', type=int, help='Only rebuild the portfolios of this user id')
+
+    def handle(self, *args, **options):
+        portfolios = Portfolio.objects.all()
+        if options['portfolios']:
+            portfolios = portfolios.filter(id__in=options['portfolios'])
+        if options['user']:
+            portfolios = portfolios.filter(user_id=options['user'])
+
+        report = rebuild_positions(portfolios)
+
+        for error in report.errors:
+            self.stdout.write(self.style.WARNING(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully replayed {report.transactions} transactions in {report.seconds:.2f}s: '
+            f'{report.positions} open positions, {report.closed} closed'
+        ))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from ...models import Simulation
+from ...projections import ProjectionStats, project_and_store, validate_simulation_inputs
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the stored results of all simulations in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Only recalculate the simulations of this user id')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Simulations projected per batch')
+
+    def handle(self, *args, **options):
+        simulations = Simulation.objects.order_by('id')
+        if options['user']:
+            simulations = simulations.filter(user_id=options['user'])
+
+        totals = ProjectionStats()
+        chunk = []
+        for simulation in simulations.iterator(chunk_size=options['chunk_size']):
+            if not validate_simulation_inputs(simulation):
+                self.stdout.write(self.style.WARNING(f'Skipping invalid simulation {simulation.id} ({simulation})'))
+                continue
+            chunk.append(simulation)
+            if len(chunk) == options['chunk_size']:
+                self._recalculate(chunk, totals)
+                chunk = []
+
+        if chunk:
+            self._recalculate(chunk, totals)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully recalculated {totals}'))
+
+    def _recalculate(self, chunk, totals):
+        stats = project_and_store(chunk)
+        totals.simulations += stats.simulations
+        totals.rows += stats.rows
+        totals.delete_seconds += stats.delete_seconds
+        totals.projection_seconds += stats.projection_seconds
+        totals.insert_seconds += stats.insert_seconds
+        self.stdout.write(str(stats))
@@ -0,0 +1,110 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import os
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from ...jobs import claim_jobs, fail_job, requeue_stale_jobs, run_job
+
+
+def _init_worker():
+    # Worker processes may be spawned rather than forked, and each one must
+    # open its own database connection
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (imports, recalculations, market refreshes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=getattr(settings, 'JOB_WORKERS', os.cpu_count() or 1),
+            help='Number of worker processes, 0 runs the jobs in this process'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between two polls of an empty queue'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is empty instead of polling forever'
+        )
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} job(s) left running by a stopped worker')
+
+        if options['workers'] <= 0:
+            self._run_inline(options)
+        else:
+            self._run_pool(options)
+
+    def _run_inline(self, options):
+        while True:
+            job_ids = claim_jobs(1)
+            if not job_ids:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+            self._report(job_ids[0], run_job(job_ids[0]))
+
+    def _run_pool(self, options):
+        while True:
+            # Connections must not be shared with the worker processes
+            connections.close_all()
+            in_flight = set()
+            try:
+                self._serve_pool(options, in_flight)
+                return
+            except BrokenProcessPool as e:
+                # A worker died abruptly (killed, out of memory...): the jobs it
+                # shared the pool with can't report back, and retrying them
+                # could kill the next pool the same way
+                for job_id in in_flight:
+                    fail_job(job_id, f'Worker process died: {str(e)}')
+                self.stderr.write(f'Worker pool broken, {len(in_flight)} job(s) failed, starting a new pool')
+
+    def _serve_pool(self, options, in_flight):
+        workers = options['workers']
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            running = {}
+            while True:
+                free = workers - len(running)
+                if free:
+                    job_ids = claim_jobs(free)
+                    in_flight.update(job_ids)
+                    for job_id in job_ids:
+                        running[pool.submit(run_job, job_id)] = job_id
+
+                if not running:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        self._report(job_id, future.result())
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:
+                        fail_job(job_id, str(e))
+                        self.stderr.write(f'Job {job_id} crashed its worker: {str(e)}')
+                    in_flight.discard(job_id)
+
+    def _report(self, job_id, status):
+        self.stdout.write(f'Job {job_id}: {status}')
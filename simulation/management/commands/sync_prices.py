@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from ...models import Stock
+from ...history import update_price_histories
+from ...prices import sync_daily_prices
+
+
+class Command(BaseCommand):
+    help = 'Store the daily price history of the stocks, incrementally'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--symbol',
+            action='append',
+            dest='symbols',
+            help='Only sync this symbol (can be repeated)'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Download the full history even where a recent one is stored'
+        )
+        parser.add_argument(
+            '--rebuild-history',
+            action='store_true',
+            help='Rewrite the price history files from the stored prices, without calling the API'
+        )
+
+    def handle(self, *args, **options):
+        stocks = Stock.objects.all()
+        if options['symbols']:
+            stocks = stocks.filter(symbol__in=options['symbols'])
+
+        if options['rebuild_history']:
+            days = update_price_histories(stocks, rebuild=True)
+            self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt {days} days of price history'))
+            return
+
+        added = sync_daily_prices(stocks, full=options['full'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully stored {added} daily prices')
+        )
@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional
+import logging
+import time
+
+from django.conf import settings
+
+from .models import Stock
+from .utils import get_api_client, PRIORITY_BATCH
+
+logger = logging.getLogger(__name__)
+
+MARKET_DATA_CONCURRENCY = getattr(settings, 'MARKET_DATA_CONCURRENCY', 8)
+UPDATE_BATCH_SIZE = 500
+
+
+def fetch_quotes(
+        symbols: Iterable[str],
+        concurrency: int = MARKET_DATA_CONCURRENCY,
+        progress: Optional[Callable[[int, int], None]] = None,
+        priority: str = PRIORITY_BATCH
+) -> Dict[str, Optional[dict]]:
+    """
+    Fetch the quotes of many symbols concurrently, at most concurrency
+    requests in flight and all of them within the shared API rate limit.
+    A symbol maps to None when its quote couldn't be fetched.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    api_client = get_api_client()
+    quotes: Dict[str, Optional[dict]] = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(api_client.get_stock_quote, symbol, priority): symbol for symbol in symbols}
+        for done, future in enumerate(as_completed(futures), start=1):
+            symbol = futures[future]
+            try:
+                quotes[symbol] = future.result()
+            except Exception as e:
+                logger.error(f"Error fetching quote for {symbol}: {str(e)}")
+                quotes[symbol] = None
+            if progress:
+                progress(done, len(symbols))
+
+    return quotes
+
+
+def refresh_stocks(
+        stocks: Optional[Iterable[Stock]] = None,
+        force: bool = False,
+        concurrency: int = MARKET_DATA_CONCURRENCY,
+        progress: Optional[Callable[[int, int], None]] = None,
+        priority: str = PRIORITY_BATCH
+) -> int:
+    """
+    Refresh the market data of the given stocks (all of them by default)
+    that are out of date, or all of them with force. Quotes are fetched
+    concurrently and the changed rows written back with one bulk_update.
+    Return the number of stocks updated.
+    """
+    stocks = list(Stock.objects.all() if stocks is None else stocks)
+    stale = [stock for stock in stocks if force or stock.needs_update()]
+    if not stale:
+        return 0
+
+    start = time.perf_counter()
+    quotes = fetch_quotes((stock.symbol for stock in stale), concurrency, progress, priority)
+
+    updated: List[Stock] = []
+    for stock in stale:
+        quote = quotes.get(stock.symbol)
+        if quote:
+            stock.apply_quote(quote)
+            updated.append(stock)
+        else:
+            logger.warning(f"Failed to update market data for {stock.symbol}")
+
+    Stock.objects.bulk_update(updated, Stock.QUOTE_FIELDS, batch_size=UPDATE_BATCH_SIZE)
+    logger.info(
+        f"Updated market data for {len(updated)}/{len(stale)} stocks "
+        f"in {time.perf_counter() - start:.3f}s"
+    )
+    return len(updated)
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-17 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simulation',
+            name='nombre_trajectoires',
+            field=models.IntegerField(default=0, help_text='Nombre de trajectoires Monte Carlo (0 = projection déterministe)'),
+        ),
+        migrations.AddField(
+            model_name='simulation',
+            name='volatilite',
+            field=models.FloatField(default=0, help_text='Volatilité annuelle du rendement en pourcentage'),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='category',
+            field=models.CharField(choices=[('Courant', 'Courant'), ('Epargne Financière', 'Ep.Financière'), ('Assurance Vie', 'Assurance Vie'), ('Epargne Entreprise', 'Epargne Entreprise'), ('Immobilier', 'Immobilier')], default='Courant', max_length=64),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-17 12:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0004_job_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('open', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('high', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('low', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('close', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('volume', models.BigIntegerField()),
+                ('stock', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_prices', to='simulation.stock')),
+            ],
+            options={
+                'verbose_name': 'Cours journalier',
+                'verbose_name_plural': 'Cours journaliers',
+                'unique_together': {('stock', 'date')},
+            },
+        ),
+    ]
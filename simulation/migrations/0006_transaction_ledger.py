@@ -0,0 +1,42 @@
+# Generated by Django 5.1.2 on 2026-10-17 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0005_dailyprice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portfolio',
+            name='cost_method',
+            field=models.CharField(choices=[('AVG', 'Coût moyen pondéré'), ('FIFO', 'Premier entré, premier sorti (FIFO)')], default='AVG', max_length=4, verbose_name='Méthode de calcul du prix de revient'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='cost_basis_after',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='lots_after',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='quantity_after',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='realized_gain',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['portfolio', 'stock', 'date'], name='simulation_tx_ledger_idx'),
+        ),
+    ]
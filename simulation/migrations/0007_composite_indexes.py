@@ -0,0 +1,43 @@
+# Generated by Django 5.1.2 on 2026-10-17 12:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0006_transaction_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consolidatedresult',
+            index=models.Index(fields=['simulation', 'annee'], include=('montant',), name='simulation_result_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='simulation',
+            index=models.Index(fields=['user', 'nom_compte'], name='simulation_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='simulation',
+            index=models.Index(fields=['user', 'categorie'], name='simulation_user_cat_idx'),
+        ),
+        migrations.AlterField(
+            model_name='consolidatedresult',
+            name='simulation',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='simulation.simulation'),
+        ),
+        migrations.AlterField(
+            model_name='realaccountdata',
+            name='simulation',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='simulation.simulation'),
+        ),
+        migrations.AlterField(
+            model_name='simulation',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='simulations', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.2 on 2026-10-17 13:08
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0007_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='simulation',
+            name='nombre_trajectoires',
+            field=models.IntegerField(default=0, help_text='Nombre de trajectoires Monte Carlo (0 = projection déterministe)', validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(10000)]),
+        ),
+        migrations.AlterField(
+            model_name='simulation',
+            name='volatilite',
+            field=models.FloatField(default=0, help_text='Volatilité annuelle du rendement en pourcentage', validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.2 on 2026-10-17 13:19
+
+import django.core.validators
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0008_simulation_monte_carlo_validators'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='quantity',
+            field=models.DecimalField(decimal_places=4, max_digits=10, validators=[django.core.validators.MinValueValidator(Decimal('0.0001'))]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-17 13:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0009_transaction_quantity_validator'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='realaccountdata',
+            name='simulation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='simulation.simulation'),
+        ),
+    ]
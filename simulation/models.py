@@ -1,4 +1,5 @@
 from decimal import Decimal
+from typing import Optional
 
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
@@ -25,10 +26,12 @@ class Category(models.Model):
 
 
 class Simulation(models.Model):
+    # The (user, nom_compte) and (user, categorie) indexes also serve the lookups by user
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
-        related_name='simulations'
+        related_name='simulations',
+        db_index=False
     )
     categorie = models.ForeignKey(Category, on_delete=models.CASCADE)
     CURRENCY_TYPE = {
@@ -41,13 +44,42 @@ class Simulation(models.Model):
     periode = models.IntegerField()
     annee_depart = models.IntegerField(default=2024)
     montant_fixe_annuel = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Paths of one Monte Carlo projection, kept low enough to be computed in the request
+    MAX_TRAJECTOIRES = 10000
+    volatilite = models.FloatField(
+        default=0,
+        validators=[
+            MinValueValidator(0),
+            MaxValueValidator(100)
+        ],
+        help_text="Volatilité annuelle du rendement en pourcentage"
+    )
+    nombre_trajectoires = models.IntegerField(
+        default=0,
+        validators=[
+            MinValueValidator(0),
+            MaxValueValidator(MAX_TRAJECTOIRES)
+        ],
+        help_text="Nombre de trajectoires Monte Carlo (0 = projection déterministe)"
+    )
 
     def __str__(self):
         return self.nom_compte
 
+    @property
+    def is_stochastic(self) -> bool:
+        return bool(self.volatilite and self.nombre_trajectoires)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'nom_compte'], name='simulation_user_name_idx'),
+            models.Index(fields=['user', 'categorie'], name='simulation_user_cat_idx'),
+        ]
+
 
 class ConsolidatedResult(models.Model):
-    simulation = models.ForeignKey(Simulation, on_delete=models.CASCADE)
+    # The (simulation, annee) index also serves the lookups by simulation
+    simulation = models.ForeignKey(Simulation, on_delete=models.CASCADE, db_index=False)
     annee = models.IntegerField()
     montant = models.DecimalField(max_digits=20, decimal_places=2)
     nom_compte = models.CharField(max_length=100)
@@ -55,6 +87,13 @@ class ConsolidatedResult(models.Model):
     def __str__(self):
        return str(self.nom_compte)
 
+    class Meta:
+        indexes = [
+            # Results are read per simulation in year order, and the yearly
+            # sums only need montant: PostgreSQL answers them from the index
+            models.Index(fields=['simulation', 'annee'], name='simulation_result_year_idx', include=['montant']),
+        ]
+
 
 class RealAccountData(models.Model):
     """Model to store real account data for comparison with simulations"""
@@ -135,25 +174,42 @@ class Stock(models.Model):
     volume = models.BigIntegerField(null=True, blank=True)
     last_update = models.DateTimeField(null=True, blank=True)
 
+    # Fields written by a quote refresh
+    QUOTE_FIELDS = ['current_price', 'price_change', 'price_change_percent', 'volume', 'last_update']
+
     def update_market_data(self):
         """Update stock market data from API."""
-        from .utils import StockAPIClient
+        from .utils import get_api_client, PRIORITY_INTERACTIVE
 
-        api_client = StockAPIClient()
-        quote_data = api_client.get_stock_quote(self.symbol)
+        # Called while a user waits on a page, ahead of the batch refreshes
+        quote_data = get_api_client().get_stock_quote(self.symbol, PRIORITY_INTERACTIVE)
 
         if quote_data:
-            self.current_price = quote_data["price"]
-            self.price_change = quote_data["change"]
-            self.price_change_percent = quote_data["change_percent"]
-            self.volume = quote_data["volume"]
-            self.last_update = timezone.now()
+            self.apply_quote(quote_data)
             self.save()
             return True
         return False
 
-    def needs_update(self, max_age_minutes: int = 15) -> bool:
-        """Check if market data needs update."""
+    def apply_quote(self, quote_data: dict) -> None:
+        """Copy a quote returned by StockAPIClient.get_stock_quote, without saving."""
+        self.current_price = quote_data["price"]
+        self.price_change = quote_data["change"]
+        self.price_change_percent = quote_data["change_percent"]
+        self.volume = quote_data["volume"]
+        # A cached quote is as old as its fetch, not as its copy
+        self.last_update = quote_data.get("fetched_at") or timezone.now()
+
+    @property
+    def quote_age_minutes(self) -> Optional[int]:
+        """Minutes since the price was last refreshed, None if it never was."""
+        if not self.last_update:
+            return None
+        return int((timezone.now() - self.last_update).total_seconds() // 60)
+
+    def needs_update(self, max_age_minutes: Optional[int] = None) -> bool:
+        """Check if market data needs update (older than QUOTE_MAX_AGE_MINUTES by default)."""
+        if max_age_minutes is None:
+            max_age_minutes = getattr(settings, 'QUOTE_MAX_AGE_MINUTES', 15)
         if not self.last_update:
             return True
 
@@ -194,6 +250,13 @@ class Stock(models.Model):
 
 class Portfolio(models.Model):
     """Model for user portfolios"""
+    COST_AVERAGE = 'AVG'
+    COST_FIFO = 'FIFO'
+    COST_METHODS = [
+        (COST_AVERAGE, 'Coût moyen pondéré'),
+        (COST_FIFO, 'Premier entré, premier sorti (FIFO)'),
+    ]
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -201,6 +264,12 @@ class Portfolio(models.Model):
     )
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
+    cost_method = models.CharField(
+        max_length=4,
+        choices=COST_METHODS,
+        default=COST_AVERAGE,
+        verbose_name="Méthode de calcul du prix de revient"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -267,12 +336,24 @@ class Transaction(models.Model):
     portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE)
     stock = models.ForeignKey(Stock, on_delete=models.PROTECT)
     transaction_type = models.CharField(max_length=4, choices=TRANSACTION_TYPES)
-    quantity = models.DecimalField(max_digits=10, decimal_places=4)
+    # A zero quantity can't give a unit cost, a negative one would turn the lots around
+    quantity = models.DecimalField(
+        max_digits=10,
+        decimal_places=4,
+        validators=[MinValueValidator(Decimal('0.0001'))]
+    )
     price = models.DecimalField(max_digits=10, decimal_places=2)
     date = models.DateField()
     fees = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     notes = models.TextField(blank=True)
 
+    # Ledger state of the position once this transaction is applied, written
+    # by ledger.replay_positions (None until the transaction is replayed)
+    quantity_after = models.DecimalField(max_digits=14, decimal_places=4, null=True, blank=True)
+    cost_basis_after = models.DecimalField(max_digits=16, decimal_places=4, null=True, blank=True)
+    lots_after = models.JSONField(default=list, blank=True)
+    realized_gain = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+
     def __str__(self):
         return f"{self.transaction_type} {self.stock.symbol} ({self.quantity})"
 
@@ -284,3 +365,79 @@ class Transaction(models.Model):
         verbose_name = "Transaction"
         verbose_name_plural = "Transactions"
         ordering = ['-date']
+        indexes = [
+            # Ledger replays read one stock of a portfolio from a date onwards
+            models.Index(fields=['portfolio', 'stock', 'date'], name='simulation_tx_ledger_idx'),
+        ]
+
+
+class Job(models.Model):
+    """Background work (imports, recalculations, market refreshes) run by the run_jobs worker"""
+    STATUS_PENDING = 'PENDING'
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_DONE = 'DONE'
+    STATUS_FAILED = 'FAILED'
+    STATUSES = [
+        (STATUS_PENDING, 'En attente'),
+        (STATUS_RUNNING, 'En cours'),
+        (STATUS_DONE, 'Terminé'),
+        (STATUS_FAILED, 'Échec'),
+    ]
+
+    # Jobs with a higher priority are claimed first
+    PRIORITY_NORMAL = 0
+    PRIORITY_INTERACTIVE = 10
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        null=True,
+        blank=True
+    )
+    kind = models.CharField(max_length=50)
+    status = models.CharField(max_length=10, choices=STATUSES, default=STATUS_PENDING)
+    priority = models.SmallIntegerField(default=PRIORITY_NORMAL)
+    payload = models.JSONField(default=dict, blank=True)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    result = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+    class Meta:
+        verbose_name = "Tâche"
+        verbose_name_plural = "Tâches"
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', '-priority', 'created_at'], name='simulation_job_queue_idx'),
+        ]
+
+
+class DailyPrice(models.Model):
+    """Daily price history of a stock, the local source for valuations and charts"""
+    # The (stock, date) unique index also serves the lookups by stock
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='daily_prices', db_index=False)
+    date = models.DateField()
+    open = models.DecimalField(max_digits=12, decimal_places=4)
+    high = models.DecimalField(max_digits=12, decimal_places=4)
+    low = models.DecimalField(max_digits=12, decimal_places=4)
+    close = models.DecimalField(max_digits=12, decimal_places=4)
+    volume = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.stock.symbol} {self.date}: {self.close}"
+
+    class Meta:
+        verbose_name = "Cours journalier"
+        verbose_name_plural = "Cours journaliers"
+        unique_together = ['stock', 'date']
@@ -0,0 +1,298 @@
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+import logging
+import time
+
+import numpy as np
+from django.db.models import Count, DecimalField, F, Q, QuerySet, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .cache import cached_portfolio_payload
+from .history import load_price_history
+from .models import Portfolio, Stock, Transaction, DailyPrice
+
+logger = logging.getLogger(__name__)
+
+IRR_MAX_ITERATIONS = 100
+IRR_TOLERANCE = 1e-10
+DAYS_PER_YEAR = 365.25
+
+
+@dataclass(frozen=True)
+class ValuationSeries:
+    """Daily market value of a portfolio, and the net amount invested in it."""
+    dates: np.ndarray
+    values: np.ndarray
+    invested: np.ndarray
+
+    def __len__(self):
+        return len(self.dates)
+
+    def chart_data(self) -> dict:
+        """Labels and datasets for Chart.js."""
+        return {
+            'labels': [str(day) for day in self.dates],
+            'datasets': [
+                {
+                    'label': 'Valeur du portfolio',
+                    'data': np.round(self.values, 2).tolist(),
+                    'borderColor': 'rgb(54, 162, 235)',
+                    'pointRadius': 0,
+                    'fill': False,
+                },
+                {
+                    'label': 'Montant investi',
+                    'data': np.round(self.invested, 2).tolist(),
+                    'borderColor': 'rgb(201, 203, 207)',
+                    'pointRadius': 0,
+                    'stepped': True,
+                    'fill': False,
+                },
+            ],
+        }
+
+
+EMPTY_SERIES = ValuationSeries(
+    np.array([], dtype='datetime64[D]'),
+    np.array([], dtype='float64'),
+    np.array([], dtype='float64')
+)
+
+
+def _stored_closes(stock_ids: List[int]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """Closes of stocks without a price history file, read from DailyPrice in one query."""
+    rows = list(
+        DailyPrice.objects.filter(stock_id__in=stock_ids)
+        .order_by('stock_id', 'date')
+        .values_list('stock_id', 'date', 'close')
+    )
+    if not rows:
+        return {}
+
+    ids, dates, closes = zip(*rows)
+    ids = np.array(ids)
+    dates = np.array(dates, dtype='datetime64[D]')
+    closes = np.array(closes, dtype='float64')
+    bounds = np.flatnonzero(np.diff(ids)) + 1
+    return {
+        int(chunk_ids[0]): (chunk_dates, chunk_closes)
+        for chunk_ids, chunk_dates, chunk_closes in zip(
+            np.split(ids, bounds), np.split(dates, bounds), np.split(closes, bounds)
+        )
+    }
+
+
+def _forward_fill(point_dates: np.ndarray, point_values: np.ndarray, dates: np.ndarray) -> np.ndarray:
+    """Value of the latest point on or before each date, NaN before the first one."""
+    index = np.searchsorted(point_dates, dates, side='right') - 1
+    filled = point_values[np.maximum(index, 0)] if len(point_values) else np.zeros(len(dates))
+    return np.where(index >= 0, filled, np.nan)
+
+
+def build_valuation_series(portfolio: Portfolio) -> ValuationSeries:
+    """
+    Replay the transactions of a portfolio against the stored daily prices.
+
+    The holdings are the cumulative sums of the traded quantities per stock,
+    multiplied by the matrix of closes aligned on every trading day since the
+    first transaction. A close is carried forward over days without price;
+    before its first stored close, or without any, a stock is valued at its
+    latest trade price.
+    """
+    start = time.perf_counter()
+    trades = list(
+        Transaction.objects.filter(portfolio=portfolio)
+        .order_by('date', 'id')
+        .values_list('stock_id', 'stock__symbol', 'transaction_type', 'quantity', 'price', 'fees', 'date')
+    )
+    if not trades:
+        return EMPTY_SERIES
+
+    stock_ids, symbols, types, quantities, prices, fees, trade_dates = zip(*trades)
+    stock_ids = np.array(stock_ids)
+    signs = np.where(np.array(types) == 'SELL', -1.0, 1.0)
+    quantities = np.array(quantities, dtype='float64') * signs
+    prices = np.array(prices, dtype='float64')
+    fees = np.array(fees, dtype='float64')
+    trade_dates = np.array(trade_dates, dtype='datetime64[D]')
+
+    columns, stock_index = np.unique(stock_ids, return_index=True)
+    symbols = [symbols[i] for i in stock_index]
+    trade_columns = np.searchsorted(columns, stock_ids)
+
+    histories = {}
+    for stock_id, symbol in zip(columns.tolist(), symbols):
+        history = load_price_history(symbol)
+        if history is not None and len(history):
+            histories[stock_id] = (history.dates, history.close)
+    missing = [stock_id for stock_id in columns.tolist() if stock_id not in histories]
+    if missing:
+        histories.update(_stored_closes(missing))
+
+    # Every trading day since the first transaction, and the days traded
+    first_day = trade_dates[0]
+    dates = np.unique(np.concatenate(
+        [trade_dates] + [history_dates[history_dates >= first_day] for history_dates, _ in histories.values()]
+    ))
+
+    rows = np.searchsorted(dates, trade_dates)
+    changes = np.zeros((len(dates), len(columns)))
+    np.add.at(changes, (rows, trade_columns), quantities)
+    holdings = np.cumsum(changes, axis=0)
+
+    closes = np.empty((len(dates), len(columns)))
+    for column, stock_id in enumerate(columns.tolist()):
+        mask = trade_columns == column
+        traded = _forward_fill(trade_dates[mask], prices[mask], dates)
+        if stock_id in histories:
+            stored = _forward_fill(*histories[stock_id], dates)
+            traded = np.where(np.isnan(stored), traded, stored)
+        closes[:, column] = traded
+
+    values = np.where(holdings != 0, holdings * np.nan_to_num(closes), 0.0).sum(axis=1)
+
+    # Buys add their cost and fees, sells withdraw their proceeds net of fees
+    flows = quantities * prices + fees
+    invested = np.cumsum(np.bincount(rows, weights=flows, minlength=len(dates)))
+
+    logger.debug(
+        f"Valued portfolio {portfolio.id} over {len(dates)} days and {len(columns)} stocks "
+        f"in {time.perf_counter() - start:.3f}s"
+    )
+    return ValuationSeries(dates, values, invested)
+
+
+def get_valuation_series(portfolio: Portfolio) -> ValuationSeries:
+    """Valuation series of a portfolio, cached until its transactions or the prices change."""
+    return cached_portfolio_payload(portfolio.id, 'valuation', lambda: build_valuation_series(portfolio))
+
+
+@dataclass(frozen=True)
+class PortfolioMetrics:
+    """
+    Performance of a portfolio up to the last stored price (as_of). Returns
+    are in percent; the annualized ones (TWR and IRR) are None below a year
+    of history.
+    """
+    realized_gain: float
+    fees: float
+    twr_percent: Optional[float]
+    twr_annualized_percent: Optional[float]
+    irr_percent: Optional[float]
+    as_of: Optional[date]
+
+
+def _percent(rate: Optional[float]) -> Optional[float]:
+    return None if rate is None or not np.isfinite(rate) else round(float(rate) * 100, 2)
+
+
+def time_weighted_return(series: ValuationSeries) -> Optional[float]:
+    """
+    Chained daily returns of the portfolio, each day's net investment
+    removed from its value so that deposits and withdrawals don't count as
+    performance. Days starting from an empty portfolio are skipped.
+    """
+    if len(series) < 2:
+        return None
+    flows = np.diff(series.invested, prepend=0.0)
+    previous = series.values[:-1]
+    invested = previous > 0
+    growth = np.ones(len(previous))
+    growth[invested] = (series.values[1:][invested] - flows[1:][invested]) / previous[invested]
+    return float(np.prod(growth) - 1)
+
+
+def internal_rate_of_return(days: np.ndarray, flows: np.ndarray) -> Optional[float]:
+    """
+    Annual rate discounting flows, received on days (datetime64), to a zero
+    net present value, by Newton's method. None if there is no sign change
+    in the flows or the method doesn't converge.
+    """
+    if not (flows > 0).any() or not (flows < 0).any():
+        return None
+
+    years = (days - days[0]).astype('float64') / DAYS_PER_YEAR
+    rate = 0.1
+    for _ in range(IRR_MAX_ITERATIONS):
+        discount = (1 + rate) ** -years
+        npv = flows @ discount
+        derivative = -(years * flows) @ (discount / (1 + rate))
+        if not derivative:
+            return None
+        step = npv / derivative
+        # Stay above -100%, where the discount factors are undefined
+        rate = rate - step if rate - step > -1 else (rate - 1) / 2
+        if abs(step) < IRR_TOLERANCE:
+            return rate
+    return None
+
+
+def build_portfolio_metrics(portfolio: Portfolio) -> PortfolioMetrics:
+    """
+    Realized gains and fees of the transactions, summed by the database, and
+    time-weighted and money-weighted (IRR) returns computed over the arrays
+    of the valuation series.
+    """
+    totals = Transaction.objects.filter(portfolio=portfolio).aggregate(
+        realized_gain=Sum('realized_gain'),
+        fees=Sum('fees')
+    )
+    series = get_valuation_series(portfolio)
+
+    twr = time_weighted_return(series)
+    twr_annualized = irr = None
+    if len(series):
+        years = (series.dates[-1] - series.dates[0]).astype('float64') / DAYS_PER_YEAR
+        if twr is not None and years >= 1:
+            twr_annualized = (1 + twr) ** (1 / years) - 1
+
+        # Purchases are paid out, sales received, the holdings are received at the end
+        flows = -np.diff(series.invested, prepend=0.0)
+        flows[-1] += series.values[-1]
+        traded = flows != 0
+        if years >= 1:
+            irr = internal_rate_of_return(series.dates[traded], flows[traded])
+
+    return PortfolioMetrics(
+        realized_gain=float(totals['realized_gain'] or 0),
+        fees=float(totals['fees'] or 0),
+        twr_percent=_percent(twr),
+        twr_annualized_percent=_percent(twr_annualized),
+        irr_percent=_percent(irr),
+        as_of=series.dates[-1].item() if len(series) else None,
+    )
+
+
+def get_portfolio_metrics(portfolio: Portfolio) -> PortfolioMetrics:
+    """Metrics of a portfolio, cached until its transactions or the prices change."""
+    return cached_portfolio_payload(portfolio.id, 'metrics', lambda: build_portfolio_metrics(portfolio))
+
+
+def _amount(expression) -> Coalesce:
+    return Coalesce(expression, Value(Decimal('0')), output_field=DecimalField(max_digits=20, decimal_places=6))
+
+
+def with_totals(portfolios: QuerySet) -> QuerySet:
+    """
+    Annotate portfolios with the market value, cost and gain/loss of their
+    positions, in total and per asset type (stock_market_value,
+    etf_cost...), computed by the database in the same query.
+    total_gain_loss is None when no position has a price.
+    """
+    market_value = F('position__quantity') * F('position__stock__current_price')
+    cost = F('position__quantity') * F('position__average_price')
+
+    annotations = {
+        'position_count': Count('position'),
+        'total_market_value': _amount(Sum(market_value)),
+        'total_cost': _amount(Sum(cost)),
+        'total_gain_loss': Sum(market_value) - Sum(cost),
+    }
+    for asset_type, _ in Stock.ASSET_TYPES:
+        of_type = Q(position__stock__asset_type=asset_type)
+        prefix = asset_type.lower()
+        annotations[f'{prefix}_market_value'] = _amount(Sum(market_value, filter=of_type))
+        annotations[f'{prefix}_cost'] = _amount(Sum(cost, filter=of_type))
+    return portfolios.annotate(**annotations)
@@ -0,0 +1,130 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+import logging
+import time
+
+from django.db.models import Max
+from django.utils import timezone
+
+from .cache import invalidate_price_caches
+from .history import update_price_histories
+from .market import MARKET_DATA_CONCURRENCY
+from .models import Stock, DailyPrice
+from .utils import get_api_client, PRIORITY_BATCH
+
+logger = logging.getLogger(__name__)
+
+# "compact" returns the last 100 trading days, about 140 calendar days: a
+# history whose latest price is more recent than that can be completed with it
+COMPACT_WINDOW = timedelta(days=140)
+INSERT_BATCH_SIZE = 5000
+
+
+def latest_price_dates(stocks: Iterable[Stock]) -> Dict[int, date]:
+    """Date of the latest stored price of each stock that has any, in one query."""
+    return dict(
+        DailyPrice.objects.filter(stock__in=list(stocks))
+        .values('stock')
+        .annotate(latest=Max('date'))
+        .values_list('stock', 'latest')
+    )
+
+
+def _output_size(latest: Optional[date], full: bool = False) -> str:
+    if full or latest is None or timezone.now().date() - latest > COMPACT_WINDOW:
+        return "full"
+    return "compact"
+
+
+def _new_prices(stock: Stock, prices: Dict[str, dict], latest: Optional[date]) -> List[DailyPrice]:
+    rows = []
+    for day, values in prices.items():
+        day = date.fromisoformat(day)
+        if latest is not None and day <= latest:
+            continue
+        rows.append(DailyPrice(stock=stock, date=day, **values))
+    return rows
+
+
+def sync_daily_prices(
+        stocks: Optional[Iterable[Stock]] = None,
+        full: bool = False,
+        concurrency: int = MARKET_DATA_CONCURRENCY,
+        progress: Optional[Callable[[int, int], None]] = None,
+        priority: str = PRIORITY_BATCH
+) -> int:
+    """
+    Bring the stored daily prices of the given stocks (all by default) up to
+    date. A stock without history, or with a gap larger than what "compact"
+    covers, downloads its "full" history; the others only the last 100
+    days. Histories are fetched concurrently, only dates after the latest
+    stored one are inserted and existing rows are skipped by the database,
+    then the price history files are extended with them.
+    Return the number of prices actually inserted.
+    """
+    stocks = list(Stock.objects.all() if stocks is None else stocks)
+    if not stocks:
+        return 0
+
+    start = time.perf_counter()
+    latest = latest_price_dates(stocks)
+    api_client = get_api_client()
+    rows: List[DailyPrice] = []
+    synced: Dict[int, Stock] = {}
+    added = 0
+
+    def flush():
+        nonlocal rows, added
+        if not rows:
+            return
+        # Rows skipped as conflicts (another sync stored them first) aren't counted
+        stored = DailyPrice.objects.filter(stock__in={row.stock_id for row in rows})
+        before = stored.count()
+        DailyPrice.objects.bulk_create(rows, batch_size=INSERT_BATCH_SIZE, ignore_conflicts=True)
+        added += stored.count() - before
+        rows = []
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(
+                api_client.get_daily_prices,
+                stock.symbol,
+                _output_size(latest.get(stock.id), full),
+                priority
+            ): stock
+            for stock in stocks
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            # Dropped once stored, so only the histories not inserted yet stay in memory
+            stock = futures.pop(future)
+            try:
+                prices = future.result()
+            except Exception as e:
+                logger.error(f"Error fetching daily prices for {stock.symbol}: {str(e)}")
+                prices = None
+
+            if prices is None:
+                logger.warning(f"Failed to fetch daily prices for {stock.symbol}")
+            else:
+                new_rows = _new_prices(stock, prices, latest.get(stock.id))
+                if new_rows:
+                    rows.extend(new_rows)
+                    synced[stock.id] = stock
+                if len(rows) >= INSERT_BATCH_SIZE:
+                    flush()
+            if progress:
+                progress(done, len(stocks))
+
+    flush()
+    try:
+        update_price_histories(synced.values())
+    finally:
+        # The stored prices changed even if a history file couldn't be extended
+        if added:
+            invalidate_price_caches()
+    logger.info(
+        f"Stored {added} daily prices for {len(stocks)} stocks "
+        f"in {time.perf_counter() - start:.3f}s"
+    )
+    return added
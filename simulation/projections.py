@@ -0,0 +1,417 @@
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import csv
+import io
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import F, QuerySet
+
+from .cache import invalidate_user_cache
+from .models import Simulation, ConsolidatedResult
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+# Float error of a projected amount, relative to its magnitude and per year
+# compounded. Results closer to a rounding tie than this bound can't be
+# trusted and their trajectories are recomputed with Decimal.
+_TIE_ERROR_FACTOR = 8 * np.finfo(np.float64).eps
+_FLOAT_EXACT_LIMIT = 1e13
+
+RESULTS_MATERIALIZED = 'materialized'
+RESULTS_COMPUTED = 'computed'
+
+BULK_BATCH_SIZE = 5000
+
+MAX_TRAJECTOIRES = Simulation.MAX_TRAJECTOIRES
+PERCENTILES = (5, 50, 95)
+
+
+def validate_simulation_inputs(simulation: Simulation) -> bool:
+
+    try:
+        # Ensure positive values
+        #if simulation.montant_initial < 0 or simulation.montant_fixe_annuel < 0:
+        #    return False
+
+        # Ensure reasonable rate range (-100% to +100%)
+        if not -100 <= simulation.taux_rentabilite <= 100:
+            return False
+
+        # Ensure reasonable period (e.g., 1-50 years)
+        if not 1 <= simulation.periode <= 50:
+            return False
+
+        # Ensure start year is reasonable (e.g., within last 5 years)
+        current_year = datetime.now().year
+        if not current_year - 5 <= simulation.annee_depart <= current_year + 1:
+            return False
+
+        # Ensure Monte Carlo parameters stay in a range we can compute quickly
+        if not 0 <= simulation.volatilite <= 100:
+            return False
+        if not 0 <= simulation.nombre_trajectoires <= MAX_TRAJECTOIRES:
+            return False
+
+        return True
+
+    except Exception as e:
+        logger.error(f"Error validating simulation inputs: {str(e)}")
+        return False
+
+
+def project_trajectory(simulation: Simulation) -> List[Decimal]:
+    """
+    Compute the yearly amounts of a simulation, from annee_depart to
+    annee_depart + periode included, with the closed-form annuity formula:
+
+        A(k) = P * (1 + r)^k + C * ((1 + r)^k - 1) / r
+
+    Amounts are rounded to the cent the same way PostgreSQL stores them.
+    """
+    montant_initial = Decimal(str(simulation.montant_initial))
+    taux = Decimal(str(simulation.taux_rentabilite)) / 100
+    montant_fixe = Decimal(str(simulation.montant_fixe_annuel))
+
+    amounts = []
+    croissance = Decimal('1')
+    for k in range(simulation.periode + 1):
+        if k:
+            croissance *= 1 + taux
+        if taux:
+            montant = montant_initial * croissance + montant_fixe * (croissance - 1) / taux
+        else:
+            montant = montant_initial + montant_fixe * k
+        amounts.append(montant.quantize(CENT, rounding=ROUND_HALF_UP))
+
+    return amounts
+
+
+def project_trajectories(simulations: Iterable[Simulation]) -> Dict[int, List[Decimal]]:
+    """
+    Vectorized version of project_trajectory for a batch of simulations.
+
+    All trajectories are computed at once as a (simulations x years) NumPy
+    matrix. Cells closer to a half-cent tie than their float error bound are
+    recomputed with Decimal so the output matches project_trajectory exactly.
+    """
+    simulations = list(simulations)
+    if not simulations:
+        return {}
+
+    periodes = np.array([s.periode for s in simulations], dtype=np.int64)
+    montants = np.array([float(s.montant_initial) for s in simulations])
+    taux = np.array([float(s.taux_rentabilite) for s in simulations]) / 100
+    fixes = np.array([float(s.montant_fixe_annuel) for s in simulations])
+
+    k = np.arange(periodes.max() + 1, dtype=np.float64)
+    croissance = np.power(1 + taux[:, None], k[None, :])
+    taux_safe = np.where(taux == 0, 1.0, taux)
+    annuite = np.where(taux[:, None] == 0, k[None, :], (croissance - 1) / taux_safe[:, None])
+    cents = (montants[:, None] * croissance + fixes[:, None] * annuite) * 100
+
+    # Round half away from zero, like numeric(20, 2) columns do
+    arrondis = np.sign(cents) * np.floor(np.abs(cents) + 0.5)
+    distance_tie = np.abs(np.abs(cents) - np.floor(np.abs(cents)) - 0.5)
+    erreur_max = np.abs(cents) * _TIE_ERROR_FACTOR * (k[None, :] + 2)
+    masque = k[None, :] <= periodes[:, None]
+    incertains = masque & (
+        (distance_tie <= erreur_max) | (np.abs(cents) > _FLOAT_EXACT_LIMIT) | ~np.isfinite(cents)
+    )
+    a_recalculer = incertains.any(axis=1)
+
+    trajectories = {}
+    for index, simulation in enumerate(simulations):
+        if a_recalculer[index]:
+            trajectories[simulation.pk] = project_trajectory(simulation)
+        else:
+            ligne = arrondis[index, :periodes[index] + 1].astype(np.int64).tolist()
+            trajectories[simulation.pk] = [Decimal(c).scaleb(-2) for c in ligne]
+
+    return trajectories
+
+
+def build_consolidated_results(simulation: Simulation, amounts: List[Decimal]) -> List[ConsolidatedResult]:
+    """Build (unsaved) ConsolidatedResult rows for a projected trajectory."""
+    return [
+        ConsolidatedResult(
+            simulation=simulation,
+            annee=simulation.annee_depart + k,
+            montant=montant,
+            nom_compte=simulation.nom_compte
+        )
+        for k, montant in enumerate(amounts)
+    ]
+
+
+class ProjectedResult:
+    """
+    In-memory stand-in for a ConsolidatedResult row, computed from the
+    simulation parameters instead of being read from the database.
+    """
+    __slots__ = ('simulation', 'annee', 'montant')
+
+    def __init__(self, simulation: Simulation, annee: int, montant: Decimal):
+        self.simulation = simulation
+        self.annee = annee
+        self.montant = montant
+
+    @property
+    def simulation_id(self) -> int:
+        return self.simulation.pk
+
+    @property
+    def nom_compte(self) -> str:
+        return self.simulation.nom_compte
+
+    def __str__(self):
+        return str(self.nom_compte)
+
+
+def results_are_materialized() -> bool:
+    """Tell whether ConsolidatedResult rows are written and read back."""
+    return getattr(settings, 'SIMULATION_RESULTS_MODE', RESULTS_MATERIALIZED) != RESULTS_COMPUTED
+
+
+def get_consolidated_results(
+        simulations: Union[QuerySet[Simulation], Iterable[Simulation]]
+) -> Union[QuerySet[ConsolidatedResult], List[ProjectedResult]]:
+    """
+    Return the yearly results of the given simulations, ordered by simulation
+    then year. Depending on SIMULATION_RESULTS_MODE they are either read from
+    ConsolidatedResult or projected on the fly from the simulation parameters.
+    """
+    if results_are_materialized():
+        return ConsolidatedResult.objects.filter(
+            simulation__in=simulations
+        ).select_related(
+            'simulation',
+            'simulation__categorie'
+        ).order_by('simulation_id', 'annee')
+
+    if isinstance(simulations, QuerySet):
+        simulations = simulations.select_related('categorie')
+    simulations = list(simulations)
+    trajectories = project_trajectories(simulations)
+
+    return [
+        ProjectedResult(simulation, simulation.annee_depart + k, montant)
+        for simulation in simulations
+        for k, montant in enumerate(trajectories[simulation.pk])
+    ]
+
+
+def get_result_values(simulations: Union[QuerySet[Simulation], Iterable[Simulation]]) -> List[Tuple[int, int, Decimal]]:
+    """
+    Return (simulation_id, annee, montant) tuples for the given simulations,
+    without instantiating ConsolidatedResult objects.
+    """
+    if results_are_materialized():
+        return list(ConsolidatedResult.objects.filter(
+            simulation__in=simulations
+        ).order_by('simulation_id', 'annee').values_list('simulation_id', 'annee', 'montant'))
+
+    simulations = list(simulations)
+    trajectories = project_trajectories(simulations)
+    return [
+        (simulation.pk, simulation.annee_depart + k, montant)
+        for simulation in simulations
+        for k, montant in enumerate(trajectories[simulation.pk])
+    ]
+
+
+def get_result_rows(simulations: Union[QuerySet[Simulation], Iterable[Simulation]]) -> List[Dict[str, object]]:
+    """
+    Return the yearly results of the given simulations as dicts with annee,
+    category, compte (account name) and montant, ordered by simulation then year, for
+    the result tables. Only the displayed columns are read.
+    """
+    if results_are_materialized():
+        return list(ConsolidatedResult.objects.filter(
+            simulation__in=simulations
+        ).order_by('simulation_id', 'annee').values(
+            'annee', 'montant', category=F('simulation__categorie__category'), compte=F('simulation__nom_compte')
+        ))
+
+    return [
+        {
+            'annee': result.annee,
+            'category': result.simulation.categorie.category,
+            'compte': result.nom_compte,
+            'montant': result.montant,
+        }
+        for result in get_consolidated_results(simulations)
+    ]
+
+
+@dataclass
+class ProjectionStats:
+    """Timings of a batch projection, in seconds."""
+    simulations: int = 0
+    rows: int = 0
+    delete_seconds: float = 0.0
+    projection_seconds: float = 0.0
+    insert_seconds: float = 0.0
+
+    @property
+    def total_seconds(self) -> float:
+        return self.delete_seconds + self.projection_seconds + self.insert_seconds
+
+    def __str__(self):
+        return (
+            f"{self.simulations} simulation(s), {self.rows} ligne(s) en {self.total_seconds:.3f}s "
+            f"(suppression {self.delete_seconds:.3f}s, projection {self.projection_seconds:.3f}s, "
+            f"insertion {self.insert_seconds:.3f}s)"
+        )
+
+
+def _copy_consolidated_results(results: List[ConsolidatedResult]) -> bool:
+    """Insert rows with COPY FROM STDIN. Return False if the driver can't do it."""
+    with connection.cursor() as cursor:
+        if not hasattr(cursor.cursor, 'copy_expert'):
+            return False
+
+        fields = [ConsolidatedResult._meta.get_field(name) for name in ('simulation', 'annee', 'montant', 'nom_compte')]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for result in results:
+            writer.writerow([result.simulation_id, result.annee, result.montant, result.nom_compte])
+        buffer.seek(0)
+
+        cursor.copy_expert(
+            'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                connection.ops.quote_name(ConsolidatedResult._meta.db_table),
+                ', '.join(connection.ops.quote_name(field.column) for field in fields)
+            ),
+            buffer
+        )
+    return True
+
+
+def project_and_store(simulations: Iterable[Simulation], batch_size: int = BULK_BATCH_SIZE) -> ProjectionStats:
+    """
+    Recalculate the ConsolidatedResult rows of many simulations at once:
+    one DELETE for all previous results, one vectorized projection and one
+    chunked bulk insert (COPY on PostgreSQL).
+    """
+    simulations = list(simulations)
+    stats = ProjectionStats(simulations=len(simulations))
+    if not simulations:
+        return stats
+
+    invalid = [s.nom_compte for s in simulations if not validate_simulation_inputs(s)]
+    if invalid:
+        raise ValidationError(f"Paramètres de calcul invalides pour: {', '.join(invalid)}")
+
+    # Bulk inserts send no post_save signal, the cached pages are dropped here
+    invalidate_user_cache({s.user_id for s in simulations})
+
+    # Results are projected on read, nothing to store
+    if not results_are_materialized():
+        return stats
+
+    with transaction.atomic():
+        start = time.perf_counter()
+        ConsolidatedResult.objects.filter(simulation__in=[s.pk for s in simulations]).delete()
+        stats.delete_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        trajectories = project_trajectories(simulations)
+        results = [
+            result
+            for simulation in simulations
+            for result in build_consolidated_results(simulation, trajectories[simulation.pk])
+        ]
+        stats.projection_seconds = time.perf_counter() - start
+        stats.rows = len(results)
+
+        start = time.perf_counter()
+        if connection.vendor != 'postgresql' or not _copy_consolidated_results(results):
+            ConsolidatedResult.objects.bulk_create(results, batch_size=batch_size)
+        stats.insert_seconds = time.perf_counter() - start
+
+    logger.info(f"Batch projection: {stats}")
+    return stats
+
+
+def _simulate_paths(simulation: Simulation, shocks: np.ndarray) -> np.ndarray:
+    """
+    Generate the (paths x periode + 1) amounts of a stochastic simulation.
+
+    Yearly growth factors are lognormal with mean 1 + taux_rentabilite and
+    standard deviation volatilite. With G(k) the cumulated growth, the
+    recursion A(k) = A(k - 1) * g(k) + C unrolls to
+    A(k) = G(k) * (P + C * sum(1 / G(j), j = 1..k)), which only needs
+    cumulative sums along the year axis.
+    """
+    taux = simulation.taux_rentabilite / 100
+    volatilite = simulation.volatilite / 100
+    sigma = np.sqrt(np.log1p((volatilite / (1 + taux)) ** 2))
+    drift = np.log1p(taux) - sigma ** 2 / 2
+
+    inverse_croissance = np.exp(-np.cumsum(drift + sigma * shocks, axis=1))
+
+    montant_initial = float(simulation.montant_initial)
+    amounts = np.empty((shocks.shape[0], shocks.shape[1] + 1))
+    amounts[:, 0] = montant_initial
+    amounts[:, 1:] = (
+        montant_initial + float(simulation.montant_fixe_annuel) * np.cumsum(inverse_croissance, axis=1)
+    ) / inverse_croissance
+    return amounts
+
+
+def simulate_percentile_bands(
+        simulations: Iterable[Simulation],
+        years: Sequence[int],
+        percentiles: Sequence[float] = PERCENTILES
+) -> Optional[np.ndarray]:
+    """
+    Return a (len(percentiles) x len(years)) array with the percentiles of the
+    total amount of the given simulations, or None if none is stochastic.
+
+    All simulations draw from the same (paths x years) matrix of market
+    shocks, so a calendar year is equally good or bad for every account.
+    Deterministic simulations add their projected trajectory to every path.
+    Years of a simulation that aren't in years are ignored.
+    """
+    simulations = list(simulations)
+    stochastic = [
+        s for s in simulations
+        if s.is_stochastic and s.taux_rentabilite > -100
+    ]
+    if not stochastic or not years:
+        return None
+
+    paths = min(max(s.nombre_trajectoires for s in stochastic), MAX_TRAJECTOIRES)
+    first_year = min(s.annee_depart for s in simulations)
+    last_year = max(s.annee_depart + s.periode for s in simulations)
+    column = {year: index for index, year in enumerate(years)}
+
+    # Seeded by the simulations so the bands don't move between page views
+    rng = np.random.default_rng(sorted(s.pk for s in simulations))
+    shocks = rng.standard_normal((paths, last_year - first_year))
+
+    totals = np.zeros((paths, len(years)))
+    for simulation in simulations:
+        # Years missing from the chart (e.g. results not stored) are left out
+        offsets = [k for k in range(simulation.periode + 1) if simulation.annee_depart + k in column]
+        if not offsets:
+            continue
+        columns = [column[simulation.annee_depart + k] for k in offsets]
+        if simulation in stochastic:
+            offset = simulation.annee_depart - first_year
+            amounts = _simulate_paths(simulation, shocks[:, offset:offset + simulation.periode])
+            totals[:, columns] += amounts[:, offsets]
+        else:
+            amounts = np.array([float(montant) for montant in project_trajectory(simulation)])
+            totals[:, columns] += amounts[offsets]
+
+    return np.percentile(totals, percentiles, axis=0)
@@ -0,0 +1,157 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+QUOTE_MAX_AGE_MINUTES = getattr(settings, 'QUOTE_MAX_AGE_MINUTES', 15)
+LOCAL_CACHE_SIZE = 1024
+
+# How long a process may hold the fetch lock of a symbol, and how long the
+# others wait for its quote before fetching it themselves
+FETCH_LOCK_TIMEOUT = 30
+FETCH_WAIT_STEP = 0.2
+
+
+class QuoteCache:
+    """
+    Two-tier cache of quotes: an LRU in the process in front of the shared
+    Django cache, both expiring after ttl seconds.
+
+    Fetches are single-flight: threads asking for the same symbol wait on
+    one lock, and processes on a cache.add() lock, so only one of them calls
+    the API while the others read its result.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = LOCAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        self._local_lock = threading.Lock()
+        # One lock per symbol, there are only as many as symbols followed
+        self._fetch_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def _key(symbol: str) -> str:
+        return f'quotes:quote:{symbol}'
+
+    @staticmethod
+    def _lock_key(symbol: str) -> str:
+        return f'quotes:lock:{symbol}'
+
+    def _get_local(self, symbol: str) -> Optional[Dict[str, Any]]:
+        with self._local_lock:
+            entry = self._local.get(symbol)
+            if entry is None:
+                return None
+            expires_at, quote = entry
+            if expires_at < time.monotonic():
+                del self._local[symbol]
+                return None
+            self._local.move_to_end(symbol)
+            return quote
+
+    def _set_local(self, symbol: str, quote: Dict[str, Any], ttl: float) -> None:
+        with self._local_lock:
+            self._local[symbol] = (time.monotonic() + ttl, quote)
+            self._local.move_to_end(symbol)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def _remaining_ttl(self, quote: Dict[str, Any]) -> float:
+        return self.ttl - (timezone.now() - quote['fetched_at']).total_seconds()
+
+    def _fetch_lock(self, symbol: str) -> threading.Lock:
+        with self._local_lock:
+            return self._fetch_locks.setdefault(symbol, threading.Lock())
+
+    def get(self, symbol: str) -> Optional[Dict[str, Any]]:
+        """Return the cached quote of a symbol, from the process then the shared cache."""
+        quote = self._get_local(symbol)
+        if quote is not None:
+            return quote
+
+        quote = cache.get(self._key(symbol))
+        if quote is not None:
+            # Expire locally when the shared entry does, not ttl from now
+            remaining = self._remaining_ttl(quote)
+            if remaining <= 0:
+                return None
+            self._set_local(symbol, quote, remaining)
+        return quote
+
+    def set(self, symbol: str, quote: Dict[str, Any]) -> Dict[str, Any]:
+        """Cache a quote, stamped with its fetch time unless it already is."""
+        quote = dict(quote)
+        quote.setdefault('fetched_at', timezone.now())
+        cache.set(self._key(symbol), quote, self.ttl)
+        self._set_local(symbol, quote, self.ttl)
+        return quote
+
+    def get_or_fetch(
+            self,
+            symbol: str,
+            fetch: Callable[[], Optional[Dict[str, Any]]],
+            max_wait: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached quote, or fetch it once for every concurrent caller.
+
+        With max_wait, a caller finding the symbol already being fetched,
+        possibly by a batch refresh queued on the rate limit, waits at most
+        that many seconds for it and gets None past them, so a page keeps
+        the stored price instead of hanging.
+        """
+        quote = self.get(symbol)
+        if quote is not None:
+            return quote
+
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        fetch_lock = self._fetch_lock(symbol)
+        if not fetch_lock.acquire(timeout=-1 if max_wait is None else max_wait):
+            return None
+
+        try:
+            # Another thread may have fetched it while this one waited
+            quote = self.get(symbol)
+            if quote is not None:
+                return quote
+
+            lock_key = self._lock_key(symbol)
+            owns_lock = cache.add(lock_key, True, FETCH_LOCK_TIMEOUT)
+            if not owns_lock:
+                quote = self._wait_for(symbol, deadline)
+                if quote is not None or (deadline is not None and time.monotonic() >= deadline):
+                    return quote
+
+            try:
+                quote = fetch()
+                if quote is not None:
+                    quote = self.set(symbol, quote)
+                return quote
+            finally:
+                if owns_lock:
+                    cache.delete(lock_key)
+        finally:
+            fetch_lock.release()
+
+    def _wait_for(self, symbol: str, deadline: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Wait for the quote another process is fetching, None if it doesn't come before deadline."""
+        end = time.monotonic() + FETCH_LOCK_TIMEOUT
+        if deadline is not None:
+            end = min(end, deadline)
+        while time.monotonic() < end:
+            time.sleep(max(0.0, min(FETCH_WAIT_STEP, end - time.monotonic())))
+            quote = self.get(symbol)
+            if quote is not None:
+                return quote
+            if cache.get(self._lock_key(symbol)) is None:
+                # The fetch failed or its process died, without a quote
+                return None
+        return None
+
+
+quote_cache = QuoteCache(ttl=QUOTE_MAX_AGE_MINUTES * 60)
@@ -0,0 +1,35 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .cache import invalidate_user_cache, invalidate_all_caches, invalidate_portfolio_cache
+from .models import Simulation, ConsolidatedResult, RealAccountData, AnnualInflationRate, Transaction
+
+
+def _simulation_user_id(simulation_id: int):
+    return Simulation.objects.filter(pk=simulation_id).values_list('user_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Simulation)
+def simulation_changed(sender, instance, **kwargs):
+    invalidate_user_cache([instance.user_id])
+
+
+# Only post_save: a post_delete receiver would disable the fast (single query)
+# deletes of ConsolidatedResult. Code deleting results invalidates explicitly.
+@receiver(post_save, sender=ConsolidatedResult)
+def consolidated_result_changed(sender, instance, **kwargs):
+    invalidate_user_cache([_simulation_user_id(instance.simulation_id)])
+
+
+@receiver([post_save, post_delete], sender=RealAccountData)
+def real_account_data_changed(sender, instance, **kwargs):
+    invalidate_user_cache([_simulation_user_id(instance.simulation_id)])
+
+
+@receiver([post_save, post_delete], sender=AnnualInflationRate)
+def inflation_rate_changed(sender, instance, **kwargs):
+    invalidate_all_caches()
+
+
+@receiver([post_save, post_delete], sender=Transaction)
+def transaction_changed(sender, instance, **kwargs):
+    invalidate_portfolio_cache([instance.portfolio_id])
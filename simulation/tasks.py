@@ -1,25 +1,8 @@
-from django.core.cache import cache
-from django.utils import timezone
-from .models import Stock
-import logging
+from typing import Callable, Optional
 
-logger = logging.getLogger(__name__)
+from .market import refresh_stocks
 
 
-def update_all_stocks():
-    """Update market data for all stocks."""
-    stocks = Stock.objects.all()
-    updated_count = 0
-
-    for stock in stocks:
-        try:
-            if stock.needs_update():
-                if stock.update_market_data():
-                    updated_count += 1
-                    logger.info(f"Updated market data for {stock.symbol}")
-                else:
-                    logger.warning(f"Failed to update market data for {stock.symbol}")
-        except Exception as e:
-            logger.error(f"Error updating {stock.symbol}: {str(e)}")
-
-    return updated_count
\ No newline at end of file
+def update_all_stocks(progress: Optional[Callable[[int, int], None]] = None):
+    """Update market data for all stocks, reporting (done, total) to progress."""
+    return refresh_stocks(progress=progress)
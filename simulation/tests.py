@@ -1,3 +1,1170 @@
-from django.test import TestCase
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import io
+import os
+import random
+import tempfile
+from pathlib import Path
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .comparison import build_real_data_comparison, build_summary_comparison
+from .forms import SimulationForm, TransactionForm
+from .market import refresh_stocks
+from .ledger import OversoldError, rebuild_positions, replay_positions
+from .jobs import claim_jobs, enqueue, fail_job, queue_quote_refresh, requeue_stale_jobs, run_job
+from .importers import create_simulations, import_real_account_data, import_transactions, parse_simulation_csv
+from .cache import get_portfolio_cache_version
+from .models import AnnualInflationRate, Category, ConsolidatedResult, DailyPrice, Job, Portfolio, Position, RealAccountData, Simulation, \
+    Stock, Transaction
+from .history import load_price_history, update_price_history
+from .portfolios import ValuationSeries, build_portfolio_metrics, build_valuation_series, internal_rate_of_return, \
+    time_weighted_return, with_totals
+from .prices import sync_daily_prices
+from .quotes import QuoteCache
+from .projections import get_consolidated_results, get_result_values, project_and_store, project_trajectories, \
+    project_trajectory, simulate_percentile_bands
+from .utils import PRIORITY_BATCH, PRIORITY_INTERACTIVE, StockAPIClient, TokenBucket, get_api_client
+from .views import prepare_chart_data_base, prepare_chart_data_from_database
+
+
+def make_simulation(pk=None, **fields) -> Simulation:
+    values = {
+        'montant_initial': Decimal('1000'),
+        'taux_rentabilite': 5.0,
+        'montant_fixe_annuel': Decimal('100'),
+        'periode': 2,
+        'annee_depart': datetime.now().year,
+        'nom_compte': 'Compte',
+    }
+    values.update(fields)
+    return Simulation(pk=pk, **values)
+
+
+class ProjectionTests(TestCase):
+
+    def test_trajectory_follows_the_annuity_formula(self):
+        amounts = project_trajectory(make_simulation())
+        self.assertEqual(amounts, [Decimal('1000.00'), Decimal('1150.00'), Decimal('1307.50')])
+
+    def test_trajectory_without_return(self):
+        amounts = project_trajectory(make_simulation(taux_rentabilite=0.0))
+        self.assertEqual(amounts, [Decimal('1000.00'), Decimal('1100.00'), Decimal('1200.00')])
+
+    def test_vectorized_projection_matches_decimal_loop(self):
+        rng = random.Random(7)
+        simulations = [
+            make_simulation(
+                pk=index,
+                montant_initial=Decimal(rng.randint(0, 10 ** 12)) / 100,
+                taux_rentabilite=rng.choice([0.0, round(rng.uniform(-20, 30), 2)]),
+                montant_fixe_annuel=Decimal(rng.randint(0, 10 ** 9)) / 100,
+                periode=rng.randint(1, 50),
+            )
+            for index in range(1, 3001)
+        ]
+
+        trajectories = project_trajectories(simulations)
+        for simulation in simulations:
+            self.assertEqual(trajectories[simulation.pk], project_trajectory(simulation), simulation.pk)
+
+
+class ResultsModeTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('results', 'results@example.com', 'pw12345678!')
+        self.category = Category.objects.create(category='Courant')
+
+    def test_computed_results_match_stored_ones(self):
+        simulation = make_simulation(user=self.user, categorie=self.category, periode=30, taux_rentabilite=3.7)
+        simulation.save()
+
+        project_and_store([simulation])
+        stored = list(ConsolidatedResult.objects.filter(simulation=simulation).values_list('annee', 'montant'))
+        with override_settings(SIMULATION_RESULTS_MODE='computed'):
+            computed = [(result.annee, result.montant) for result in get_consolidated_results([simulation])]
+            values = [(annee, montant) for _, annee, montant in get_result_values([simulation])]
+
+        self.assertEqual(len(stored), 31)
+        self.assertEqual(computed, stored)
+        self.assertEqual(values, stored)
+
+    @override_settings(SIMULATION_RESULTS_MODE='computed')
+    def test_computed_mode_stores_nothing(self):
+        simulation = make_simulation(user=self.user, categorie=self.category)
+        simulation.save()
+
+        project_and_store([simulation])
+
+        self.assertFalse(ConsolidatedResult.objects.exists())
+        self.assertEqual(len(get_consolidated_results(Simulation.objects.all())), 3)
+
+
+class BatchProjectionTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('batch', 'batch@example.com', 'pw12345678!')
+        self.category = Category.objects.create(category='Courant')
+        self.simulations = [
+            make_simulation(user=self.user, categorie=self.category, nom_compte=f'Compte {index}', periode=index)
+            for index in range(1, 4)
+        ]
+        Simulation.objects.bulk_create(self.simulations)
+
+    def test_results_are_replaced(self):
+        stats = project_and_store(self.simulations)
+        self.assertEqual(stats.rows, 2 + 3 + 4)
+
+        self.simulations[0].montant_initial = Decimal('2000')
+        project_and_store(self.simulations[:1])
+
+        self.assertEqual(ConsolidatedResult.objects.count(), 9)
+        self.assertEqual(
+            list(ConsolidatedResult.objects.filter(simulation=self.simulations[0]).values_list('montant', flat=True)),
+            project_trajectory(self.simulations[0])
+        )
+
+    def test_invalid_simulation_stores_nothing(self):
+        project_and_store(self.simulations)
+        self.simulations[1].periode = 0
+
+        with self.assertRaises(ValidationError):
+            project_and_store(self.simulations)
+        self.assertEqual(ConsolidatedResult.objects.count(), 9)
+
+    def test_recalculate_command(self):
+        call_command('recalculate_simulations', chunk_size=2, stdout=io.StringIO())
+        self.assertEqual(ConsolidatedResult.objects.count(), 9)
+
+
+class MonteCarloTests(TestCase):
+
+    def setUp(self):
+        self.simulations = [
+            make_simulation(pk=1, periode=20, volatilite=15.0, nombre_trajectoires=2000),
+            make_simulation(pk=2, periode=10),
+        ]
+        start = self.simulations[0].annee_depart
+        self.years = list(range(start, start + 21))
+
+    def test_percentile_bands_are_ordered_and_stable(self):
+        bands = simulate_percentile_bands(self.simulations, self.years)
+
+        self.assertEqual(bands.shape, (3, len(self.years)))
+        self.assertTrue((bands[0] <= bands[1]).all() and (bands[1] <= bands[2]).all())
+        np.testing.assert_array_equal(bands, simulate_percentile_bands(self.simulations, self.years))
+
+    def test_deterministic_simulations_have_no_bands(self):
+        self.assertIsNone(simulate_percentile_bands(self.simulations[1:], self.years))
+
+    def test_years_missing_from_the_chart_are_ignored(self):
+        bands = simulate_percentile_bands(self.simulations, self.years[:5])
+        self.assertEqual(bands.shape, (3, 5))
+
+    def form(self, **data):
+        category = Category.objects.create(category='Courant')
+        values = {
+            'categorie': category.pk, 'nom_compte': 'Compte', 'montant_initial': '1000', 'currency': '€',
+            'taux_rentabilite': '5', 'periode': '10', 'annee_depart': str(datetime.now().year),
+            'montant_fixe_annuel': '100',
+        }
+        values.update(data)
+        return SimulationForm(values)
+
+    def test_form_defaults_to_a_deterministic_projection(self):
+        form = self.form()
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual((form.cleaned_data['volatilite'], form.cleaned_data['nombre_trajectoires']), (0, 0))
+
+    def test_form_rejects_invalid_monte_carlo_parameters(self):
+        self.assertIn('nombre_trajectoires', self.form(volatilite='10', nombre_trajectoires='1000000').errors)
+        self.assertIn('volatilite', self.form(volatilite='-5', nombre_trajectoires='100').errors)
+
+
+class ChartAggregationTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('charts', 'charts@example.com', 'pw12345678!')
+        courant = Category.objects.create(category='Courant')
+        immobilier = Category.objects.create(category='Immobilier')
+        start = datetime.now().year
+        trajectories = [
+            (courant, 'Livret', start, [100, 200, 300]),
+            (courant, 'Compte', start + 1, [50, 0, -20, 10]),
+            (immobilier, 'Maison', start + 2, [1000, 1100]),
+            (immobilier, 'Dette', start, [-500, -400]),
+        ]
+        for category, name, annee_depart, amounts in trajectories:
+            simulation = Simulation.objects.create(
+                user=user, categorie=category, nom_compte=name, montant_initial=Decimal(amounts[0]),
+                taux_rentabilite=0, periode=len(amounts) - 1, annee_depart=annee_depart
+            )
+            ConsolidatedResult.objects.bulk_create([
+                ConsolidatedResult(simulation=simulation, annee=annee_depart + k, montant=Decimal(montant), nom_compte=name)
+                for k, montant in enumerate(amounts)
+            ])
+        self.simulations = Simulation.objects.filter(user=user)
+
+    def test_database_aggregation_matches_python(self):
+        for cumulative in (False, True):
+            for group_by_field in ('category', 'account'):
+                self.assertEqual(
+                    prepare_chart_data_from_database(self.simulations, cumulative, group_by_field),
+                    prepare_chart_data_base(get_consolidated_results(self.simulations), cumulative, group_by_field),
+                    (cumulative, group_by_field)
+                )
+
+
+@override_settings(SIMULATION_RESULTS_MODE='computed')
+class ComputedResultsCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user('cache', 'cache@example.com', 'pw12345678!')
+        self.courant = Category.objects.create(category='Courant')
+        self.immobilier = Category.objects.create(category='Immobilier')
+        self.client.force_login(self.user)
+
+    def results_page(self):
+        return self.client.get(reverse('results_list_by_cat'), {'categories': 'all'})
+
+    def test_import_refreshes_the_cached_pages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_simulation(user=self.user, categorie=self.courant).save()
+        self.assertEqual(self.results_page().context['categories'], ['Courant'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_simulations(self.user, [make_simulation(categorie=self.immobilier, nom_compte='Maison')])
+
+        response = self.results_page()
+        self.assertEqual(sorted(response.context['categories']), ['Courant', 'Immobilier'])
+        self.assertEqual(len(response.context['consolidated_results']), 6)
+
+    def test_edit_refreshes_the_cached_pages(self):
+        simulation = make_simulation(user=self.user, categorie=self.courant)
+        with self.captureOnCommitCallbacks(execute=True):
+            simulation.save()
+        self.results_page()
+
+        simulation.periode = 5
+        with self.captureOnCommitCallbacks(execute=True):
+            simulation.save()
+
+        self.assertEqual(len(self.results_page().context['consolidated_results']), 6)
+
+    def test_repeated_view_is_served_from_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_simulation(user=self.user, categorie=self.courant).save()
+        self.results_page()
+
+        # Only the session and the user are read
+        with self.assertNumQueries(2):
+            self.results_page()
+
+
+class RealDataComparisonTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('real', 'real@example.com', 'pw12345678!')
+        self.simulation = make_simulation(user=self.user, categorie=Category.objects.create(category='Courant'))
+        self.simulation.save()
+        project_and_store([self.simulation])
+        self.start = self.simulation.annee_depart
+        RealAccountData.objects.create(
+            simulation=self.simulation, annee=self.start + 1, montant_reel=Decimal('1224'), taux_inflation=Decimal('2')
+        )
+        RealAccountData.objects.create(
+            simulation=self.simulation, annee=self.start + 3, montant_reel=Decimal('1500'), taux_inflation=Decimal('0')
+        )
+
+    def test_series_are_aligned_on_the_years(self):
+        chart_data, real_data = build_real_data_comparison(self.simulation)
+
+        self.assertEqual(chart_data['labels'], [str(self.start + k) for k in range(4)])
+        simulated, real, adjusted = [dataset['data'] for dataset in chart_data['datasets']]
+        self.assertEqual(simulated, [1000.0, 1150.0, 1307.5, None])
+        self.assertEqual(real, [None, 1224.0, None, 1500.0])
+        self.assertEqual(adjusted, [None, 1200.0, None, 1500.0])
+        self.assertEqual([entry.annee for entry in real_data], [self.start + 1, self.start + 3])
+
+    def test_chart_endpoint(self):
+        url = reverse('compare_real_data_chart', args=[self.simulation.id])
+        self.client.force_login(self.user)
+
+        response = self.client.get(url, {'inflation': 'false'})
+        self.assertEqual(response.json(), build_real_data_comparison(self.simulation, show_inflation=False)[0])
+
+        self.client.force_login(get_user_model().objects.create_user('other', 'other@example.com', 'pw12345678!'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class SummaryComparisonTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('summary', 'summary@example.com', 'pw12345678!')
+        category = Category.objects.create(category='Courant')
+        self.livret = make_simulation(user=self.user, categorie=category, nom_compte='Livret')
+        self.compte = make_simulation(
+            user=self.user, categorie=category, nom_compte='Compte', montant_initial=Decimal('500'),
+            taux_rentabilite=0.0, montant_fixe_annuel=Decimal('0'), periode=1
+        )
+        for simulation in (self.livret, self.compte):
+            simulation.save()
+        project_and_store([self.livret, self.compte])
+        self.start = self.livret.annee_depart
+        RealAccountData.objects.create(
+            simulation=self.livret, annee=self.start + 1, montant_reel=Decimal('1224'), taux_inflation=Decimal('2')
+        )
+        RealAccountData.objects.create(
+            simulation=self.compte, annee=self.start + 1, montant_reel=Decimal('600'), taux_inflation=Decimal('0')
+        )
+
+    def test_yearly_totals(self):
+        context = build_summary_comparison(self.user)
+
+        self.assertEqual(context['years'], [self.start, self.start + 1, self.start + 2])
+        totals = context['yearly_totals'][str(self.start + 1)]
+        self.assertEqual(totals['simulated'], Decimal('1650'))
+        self.assertEqual(totals['real'], Decimal('1824'))
+        self.assertEqual(totals['real_adjusted'], Decimal('1800'))
+        self.assertEqual(totals['difference'], Decimal('174'))
+        self.assertAlmostEqual(totals['inflation_rate'], Decimal('2448') / Decimal('1824'))
+        self.assertEqual(context['yearly_totals'][str(self.start + 2)]['simulated'], Decimal('1307.50'))
+
+    def test_accounts(self):
+        summary = {row['account_name']: row['years'] for row in build_summary_comparison(self.user)['summary_data']}
+
+        self.assertFalse(summary['Compte'][str(self.start)]['has_real_data'])
+        self.assertEqual(summary['Compte'][str(self.start)]['simulated'], Decimal('500'))
+        self.assertEqual(summary['Compte'][str(self.start + 2)]['simulated'], Decimal('0'))
+        livret = summary['Livret'][str(self.start + 1)]
+        self.assertTrue(livret['has_real_data'])
+        self.assertEqual((livret['real'], livret['real_adjusted']), (Decimal('1224'), Decimal('1200')))
+        self.assertEqual(livret['difference_adjusted'], Decimal('50'))
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('export', 'export@example.com', 'pw12345678!')
+        self.courant = Category.objects.create(category='Courant')
+        self.immobilier = Category.objects.create(category='Immobilier')
+        make_simulation(user=self.user, categorie=self.courant, nom_compte='Livret', taux_rentabilite=2.5).save()
+        make_simulation(user=self.user, categorie=self.immobilier, nom_compte='Maison').save()
+        self.client.force_login(self.user)
+
+    def download(self, url_name, **params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_can_be_imported_back(self):
+        content = self.download('export_results_by_cat', category='all')
+
+        simulations, report = parse_simulation_csv(content)
+        self.assertEqual(report.errors, [])
+        self.assertEqual(
+            sorted((s.nom_compte, s.categorie_id, s.taux_rentabilite, s.montant_initial) for s in simulations),
+            [('Livret', self.courant.id, 2.5, Decimal('1000')), ('Maison', self.immobilier.id, 5.0, Decimal('1000'))]
+        )
+
+    def test_export_of_one_account(self):
+        lines = self.download('export_results_by_name', account_name='Maison').splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('Immobilier;Maison;1000,00;'))
+
+    def test_real_data_export(self):
+        simulation = Simulation.objects.get(nom_compte='Livret')
+        RealAccountData.objects.create(simulation=simulation, annee=2024, montant_reel=Decimal('1224.5'), taux_inflation=Decimal('2'))
+
+        lines = self.download('export_real_data').splitlines()
+        self.assertEqual(lines, ['nom_compte;annee;montant_reel;taux_inflation', 'Livret;2024;1224,50;2,00'])
+
+
+class RealDataImportTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('import', 'import@example.com', 'pw12345678!')
+        self.category = Category.objects.create(category='Courant')
+        self.livret = make_simulation(user=self.user, categorie=self.category, nom_compte='Livret')
+        self.livret.save()
+        AnnualInflationRate.objects.create(annee=2023, taux_inflation=Decimal('4'))
+
+    def test_rows_are_upserted(self):
+        RealAccountData.objects.create(simulation=self.livret, annee=2022, montant_reel=Decimal('1'), taux_inflation=Decimal('0'))
+        content = (
+            "nom_compte;annee;montant_reel;taux_inflation\n"
+            "Livret;2022;1020,00;2\n"
+            "Livret;2023;1040\n"
+            "Inconnu;2023;10;0\n"
+        )
+
+        report = import_real_account_data(self.user, content)
+
+        self.assertEqual((report.rows, report.imported, report.errors), (3, 2, []))
+        self.assertEqual([warning.line for warning in report.warnings], [4])
+        self.assertEqual(
+            list(RealAccountData.objects.order_by('annee').values_list('annee', 'montant_reel', 'taux_inflation', 'montant_reel_ajuste')),
+            [(2022, Decimal('1020'), Decimal('2'), Decimal('1000')), (2023, Decimal('1040'), Decimal('4'), Decimal('1000'))]
+        )
+
+    def test_malformed_file_imports_nothing(self):
+        content = "nom_compte;annee;montant_reel\nLivret;2022;1000\nLivret;deux mille;1000\n"
+
+        report = import_real_account_data(self.user, content)
+
+        self.assertEqual([error.line for error in report.errors], [3])
+        self.assertFalse(RealAccountData.objects.exists())
+
+    def test_missing_columns(self):
+        report = import_real_account_data(self.user, "nom_compte;montant_reel\nLivret;1000\n")
+        self.assertIn('annee', report.errors[0].message)
+
+
+class SimulationImportTests(TestCase):
+    HEADER = 'categorie;nom_compte;montant_initial;currency;taux_rentabilite;periode;annee_depart;montant_fixe_annuel;volatilite\n'
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('csv', 'csv@example.com', 'pw12345678!')
+        self.courant = Category.objects.create(category='Courant')
+
+    def test_valid_file_is_created_with_results(self):
+        content = self.HEADER + 'Courant;Livret;1000,50;€;2,5;3;2024;100;\nCourant;PEA;500;€;7;2;2024;0;15\n'
+
+        simulations, report = parse_simulation_csv(content)
+        self.assertEqual((report.rows, report.errors), (2, []))
+        create_simulations(self.user, simulations)
+
+        livret = Simulation.objects.get(user=self.user, nom_compte='Livret')
+        self.assertEqual((livret.montant_initial, livret.taux_rentabilite, livret.volatilite), (Decimal('1000.50'), 2.5, 0))
+        self.assertEqual(Simulation.objects.get(nom_compte='PEA').volatilite, 15)
+        self.assertEqual(ConsolidatedResult.objects.filter(simulation__user=self.user).count(), 7)
+
+    def test_every_error_is_reported_and_nothing_is_returned(self):
+        content = self.HEADER + (
+            'Courant;Livret;1000;€;2;3;2024;100;\n'
+            'Inconnue;PEA;500;€;7;2;2024;0;\n'
+            'Courant;Assurance;mille;€;3;2;2024;0;\n'
+            'Courant;Crypto;500;€;7;2;2024;0;-5\n'
+        )
+
+        simulations, report = parse_simulation_csv(content)
+
+        self.assertEqual(simulations, [])
+        self.assertEqual([(error.line, error.field) for error in report.errors],
+                         [(3, 'categorie'), (4, 'montant_initial'), (5, 'volatilite')])
+
+    def test_missing_columns(self):
+        simulations, report = parse_simulation_csv('categorie;nom_compte\nCourant;Livret\n')
+        self.assertEqual(simulations, [])
+        self.assertEqual(report.errors[0].line, 1)
+
+
+class FakePool:
+    """Runs the jobs in the test process; the first pool created is already broken."""
+    created = 0
+
+    def __init__(self, *args, **kwargs):
+        FakePool.created += 1
+        self.broken = FakePool.created == 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, function, *args):
+        future = Future()
+        if self.broken:
+            if self.broken == 'reported':
+                raise BrokenProcessPool('killed')
+            self.broken = 'reported'
+            future.set_exception(BrokenProcessPool('killed'))
+        else:
+            future.set_result(function(*args))
+        return future
+
+
+class JobTests(TestCase):
+    REAL_DATA = "nom_compte;annee;montant_reel\nLivret;2024;1000\n"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('jobs', 'jobs@example.com', 'pw12345678!')
+        make_simulation(user=self.user, categorie=Category.objects.create(category='Courant'), nom_compte='Livret').save()
+
+    def test_claim_order_and_no_double_claim(self):
+        first = enqueue('import_real_data', user=self.user, content=self.REAL_DATA)
+        second = enqueue('import_real_data', user=self.user, content=self.REAL_DATA)
+        urgent = enqueue('refresh_quotes', priority=Job.PRIORITY_INTERACTIVE, symbols=[])
+
+        self.assertEqual(claim_jobs(2), [urgent.id, first.id])
+        self.assertEqual(claim_jobs(5), [second.id])
+        self.assertEqual(claim_jobs(5), [])
+        self.assertEqual(Job.objects.filter(status=Job.STATUS_RUNNING).count(), 3)
+
+    def test_run_job_records_the_outcome(self):
+        done = enqueue('import_real_data', user=self.user, content=self.REAL_DATA)
+        rejected = enqueue('import_real_data', user=self.user, content="nom_compte;annee;montant_reel\nLivret;x;1\n")
+        crashed = enqueue('import_transactions', user=self.user, portfolio_id=0, content='')
+        claim_jobs(3)
+
+        self.assertEqual(run_job(done.id), Job.STATUS_DONE)
+        self.assertEqual(run_job(rejected.id), Job.STATUS_FAILED)
+        self.assertEqual(run_job(crashed.id), Job.STATUS_FAILED)
+
+        done.refresh_from_db()
+        rejected.refresh_from_db()
+        self.assertEqual(done.result['imported'], 1)
+        self.assertEqual(len(rejected.result['errors']), 1)
+        self.assertEqual(rejected.error, "Le fichier contient des erreurs")
+        self.assertTrue(RealAccountData.objects.filter(annee=2024).exists())
+
+    def test_fail_job_only_touches_running_jobs(self):
+        job = enqueue('import_real_data', user=self.user, content=self.REAL_DATA)
+        fail_job(job.id, 'boom')
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.STATUS_PENDING)
+
+        claim_jobs(1)
+        run_job(job.id)
+        fail_job(job.id, 'boom')
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.STATUS_DONE)
+
+    def test_stale_running_jobs_are_requeued(self):
+        stale = enqueue('import_real_data', user=self.user, content=self.REAL_DATA)
+        recent = enqueue('import_real_data', user=self.user, content=self.REAL_DATA)
+        claim_jobs(2)
+        Job.objects.filter(id=stale.id).update(started_at=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(requeue_stale_jobs(timedelta(hours=1)), 1)
+        self.assertEqual(Job.objects.get(id=stale.id).status, Job.STATUS_PENDING)
+        self.assertEqual(Job.objects.get(id=recent.id).status, Job.STATUS_RUNNING)
+
+    def test_quote_refresh_skips_the_queued_symbols(self):
+        apple, total = Stock.objects.create(symbol='AAPL', name='Apple', asset_type='STOCK'), \
+            Stock.objects.create(symbol='TTE', name='TotalEnergies', asset_type='STOCK')
+
+        first = queue_quote_refresh([apple])
+        second = queue_quote_refresh([apple, total])
+
+        self.assertEqual(first.payload['symbols'], ['AAPL'])
+        self.assertEqual(second.payload['symbols'], ['TTE'])
+        self.assertIsNone(queue_quote_refresh([apple, total]))
+
+        Job.objects.filter(id=first.id).update(status=Job.STATUS_DONE)
+        self.assertEqual(queue_quote_refresh([apple, total]).payload['symbols'], ['AAPL'])
+
+    def test_broken_pool_fails_its_jobs_and_is_replaced(self):
+        lost = enqueue('import_real_data', user=self.user, content=self.REAL_DATA)
+        later = enqueue('import_real_data', user=self.user, content=self.REAL_DATA)
+        FakePool.created = 0
+
+        with mock.patch('simulation.management.commands.run_jobs.ProcessPoolExecutor', FakePool):
+            call_command('run_jobs', workers=1, once=True, stdout=io.StringIO(), stderr=io.StringIO())
+
+        self.assertEqual(FakePool.created, 2)
+        self.assertEqual(Job.objects.get(id=lost.id).status, Job.STATUS_FAILED)
+        self.assertEqual(Job.objects.get(id=later.id).status, Job.STATUS_DONE)
+
+
+class FakeQuoteClient:
+    """Stands in for StockAPIClient; every symbol waits on the barrier, so fetches must overlap."""
+
+    def __init__(self, prices, parties):
+        self.prices = prices
+        self.barrier = threading.Barrier(parties, timeout=5)
+        self.fetched = []
+
+    def get_stock_quote(self, symbol, priority=None):
+        self.fetched.append(symbol)
+        self.barrier.wait()
+        if symbol not in self.prices:
+            return None
+        return {'price': self.prices[symbol], 'change': Decimal('1'), 'change_percent': Decimal('0.5'), 'volume': 100}
+
+
+class MarketRefreshTests(TestCase):
+
+    def test_stale_stocks_are_fetched_concurrently_and_saved(self):
+        fresh = Stock.objects.create(symbol='FRESH', name='Fresh', asset_type='STOCK', current_price=Decimal('5'),
+                                     last_update=timezone.now())
+        for symbol in ('AAPL', 'MSFT', 'TTE', 'GONE'):
+            Stock.objects.create(symbol=symbol, name=symbol, asset_type='STOCK')
+        client = FakeQuoteClient({'AAPL': Decimal('190'), 'MSFT': Decimal('410'), 'TTE': Decimal('60')}, parties=4)
+
+        with mock.patch('simulation.market.get_api_client', return_value=client):
+            updated = refresh_stocks(concurrency=4)
+
+        self.assertEqual(updated, 3)
+        self.assertEqual(sorted(client.fetched), ['AAPL', 'GONE', 'MSFT', 'TTE'])
+        self.assertEqual(
+            dict(Stock.objects.filter(last_update__isnull=False).values_list('symbol', 'current_price')),
+            {'FRESH': fresh.current_price, 'AAPL': Decimal('190'), 'MSFT': Decimal('410'), 'TTE': Decimal('60')}
+        )
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data or {}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class RateLimitTests(TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def test_batch_callers_leave_the_reserve_to_interactive_ones(self):
+        bucket = TokenBucket(self.path, rate_per_minute=2, reserve=1)
+
+        self.assertTrue(bucket.acquire(PRIORITY_BATCH, timeout=0))
+        self.assertFalse(bucket.acquire(PRIORITY_BATCH, timeout=0))
+        self.assertTrue(bucket.acquire(PRIORITY_INTERACTIVE, timeout=0))
+        self.assertFalse(bucket.acquire(PRIORITY_INTERACTIVE, timeout=0))
+
+    def test_buckets_on_the_same_file_share_the_quota(self):
+        TokenBucket(self.path, rate_per_minute=1).acquire(timeout=0)
+        self.assertFalse(TokenBucket(self.path, rate_per_minute=1).acquire(timeout=0))
+
+    def test_throttled_answers_are_retried(self):
+        client = StockAPIClient()
+        client.session = mock.Mock()
+        client.session.get.side_effect = [
+            FakeResponse(429),
+            FakeResponse(200, {'Note': 'Thank you for using Alpha Vantage!'}),
+            FakeResponse(200, {'Global Quote': {}}),
+        ]
+
+        with mock.patch('simulation.utils.get_rate_limiter', return_value=TokenBucket(self.path, 60)), \
+                mock.patch('simulation.utils.time.sleep'):
+            self.assertEqual(client._get({'symbol': 'AAPL'}), {'Global Quote': {}})
+        self.assertEqual(client.session.get.call_count, 3)
+
+
+class APIClientTests(TestCase):
+
+    def test_client_and_its_connections_are_reused_within_a_process(self):
+        client = get_api_client()
+        self.assertIs(get_api_client(), client)
+        self.assertIs(client.session.get_adapter('https://www.alphavantage.co'), client.session.get_adapter('https://x'))
+
+        with mock.patch('simulation.utils.os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(get_api_client(), client)
+
+
+class PortfolioQuotesTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('quotes', 'quotes@example.com', 'pw12345678!')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='PEA')
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        for symbol, last_update in (('AAPL', an_hour_ago), ('MSFT', None), ('TTE', an_hour_ago)):
+            stock = Stock.objects.create(symbol=symbol, name=symbol, asset_type='STOCK', current_price=Decimal('10'),
+                                         last_update=last_update)
+            Position.objects.create(portfolio=self.portfolio, stock=stock, quantity=Decimal('2'),
+                                    average_price=Decimal('8'), purchase_date=an_hour_ago.date())
+        self.client.force_login(self.user)
+
+    def poll(self):
+        return self.client.get(reverse('portfolio_quotes', args=[self.portfolio.id])).json()
+
+    @override_settings(BACKGROUND_JOBS=False)
+    def test_each_poll_refreshes_one_symbol_without_a_worker(self):
+        refreshed = []
+
+        def refresh(stocks, priority=None):
+            for stock in stocks:
+                refreshed.append(stock.symbol)
+                stock.last_update = timezone.now()
+                stock.save()
+            return len(stocks)
+
+        with mock.patch('simulation.views.refresh_stocks', side_effect=refresh):
+            first = self.poll()
+            second = self.poll()
+
+        self.assertEqual(refreshed, ['MSFT', 'AAPL'])
+        self.assertEqual(first['stale'], ['AAPL', 'TTE'])
+        self.assertEqual(second['stale'], ['TTE'])
+        self.assertEqual(len(first['positions']), 3)
+        self.assertEqual(Decimal(first['total_market_value']), Decimal('60'))
+
+    @override_settings(BACKGROUND_JOBS=True)
+    def test_polls_queue_the_refresh_with_a_worker(self):
+        with mock.patch('simulation.views.refresh_stocks') as refresh:
+            self.assertEqual(sorted(self.poll()['stale']), ['AAPL', 'MSFT', 'TTE'])
+        refresh.assert_not_called()
+        self.assertEqual(sorted(Job.objects.get(kind='refresh_quotes').payload['symbols']), ['AAPL', 'MSFT', 'TTE'])
+
+
+class QuoteCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.quotes = QuoteCache(ttl=60)
+        self.calls = 0
+
+    def slow_fetch(self):
+        self.calls += 1
+        time.sleep(0.3)
+        return {'price': Decimal('190')}
+
+    def run_threads(self, *targets):
+        threads = [threading.Thread(target=target) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_concurrent_callers_share_one_fetch(self):
+        results = []
+
+        def fetch():
+            results.append(self.quotes.get_or_fetch('AAPL', self.slow_fetch))
+
+        self.run_threads(*[fetch] * 5)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([quote['price'] for quote in results], [Decimal('190')] * 5)
+        self.assertEqual(QuoteCache(ttl=60).get('AAPL')['price'], Decimal('190'))
+
+    def test_bounded_wait_on_a_fetch_in_this_process(self):
+        results = {}
+
+        def waiting():
+            time.sleep(0.05)
+            results['waiting'] = self.quotes.get_or_fetch('AAPL', self.slow_fetch, max_wait=0.1)
+
+        self.run_threads(lambda: self.quotes.get_or_fetch('AAPL', self.slow_fetch), waiting)
+
+        self.assertIsNone(results['waiting'])
+        self.assertEqual(self.calls, 1)
+
+    def test_bounded_wait_on_a_fetch_in_another_process(self):
+        cache.add(QuoteCache._lock_key('AAPL'), True)
+
+        started = time.monotonic()
+        self.assertIsNone(self.quotes.get_or_fetch('AAPL', self.slow_fetch, max_wait=0.3))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(self.calls, 0)
+
+    def test_fetches_itself_when_the_other_process_gives_up(self):
+        cache.add(QuoteCache._lock_key('AAPL'), True)
+        threading.Timer(0.3, cache.delete, [QuoteCache._lock_key('AAPL')]).start()
+
+        self.assertEqual(self.quotes.get_or_fetch('AAPL', self.slow_fetch, max_wait=5)['price'], Decimal('190'))
+        self.assertEqual(self.calls, 1)
+
+
+def daily_values(close, volume=1000):
+    close = Decimal(close)
+    return {'open': close, 'high': close, 'low': close, 'close': close, 'volume': volume}
+
+
+class FakeHistoryClient:
+    """Stands in for StockAPIClient.get_daily_prices, serving the same days whatever the output size."""
+
+    def __init__(self, histories):
+        self.histories = histories
+        self.sizes = {}
+
+    def get_daily_prices(self, symbol, outputsize='compact', priority=None):
+        self.sizes[symbol] = outputsize
+        return self.histories.get(symbol)
+
+
+class PriceHistoryTestCase(TestCase):
+    """Keeps the price history files of a test in a temporary directory."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.history_dir = Path(directory.name)
+        patcher = mock.patch('simulation.history.PRICE_HISTORY_DIR', self.history_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class DailyPriceSyncTests(PriceHistoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.now().date()
+        self.known = Stock.objects.create(symbol='AAPL', name='Apple', asset_type='STOCK')
+        self.new = Stock.objects.create(symbol='TTE', name='TotalEnergies', asset_type='STOCK')
+        DailyPrice.objects.create(stock=self.known, date=self.today - timedelta(days=3), **daily_values('100'))
+        days = [str(self.today - timedelta(days=offset)) for offset in (3, 2, 1)]
+        self.client = FakeHistoryClient({
+            'AAPL': {day: daily_values(close) for day, close in zip(days, ('100', '101', '102'))},
+            'TTE': {day: daily_values(close) for day, close in zip(days, ('60', '61', '62'))},
+        })
+
+    def sync(self, **options):
+        with mock.patch('simulation.prices.get_api_client', return_value=self.client):
+            return sync_daily_prices(concurrency=2, **options)
+
+    def test_compact_sync_only_adds_the_missing_days(self):
+        self.assertEqual(self.sync(), 5)
+
+        self.assertEqual(self.client.sizes, {'AAPL': 'compact', 'TTE': 'full'})
+        self.assertEqual(
+            list(DailyPrice.objects.filter(stock=self.known).order_by('date').values_list('close', flat=True)),
+            [Decimal('100'), Decimal('101'), Decimal('102')]
+        )
+        self.assertEqual(DailyPrice.objects.filter(stock=self.new).count(), 3)
+        self.assertEqual(self.sync(), 0)
+
+    def test_full_sync_and_old_histories_download_everything(self):
+        DailyPrice.objects.filter(stock=self.known).update(date=self.today - timedelta(days=400))
+
+        self.assertEqual(self.sync(full=False), 6)
+        self.assertEqual(self.client.sizes, {'AAPL': 'full', 'TTE': 'full'})
+        self.sync(full=True)
+        self.assertEqual(self.client.sizes, {'AAPL': 'full', 'TTE': 'full'})
+
+    def test_rows_stored_by_another_sync_are_not_counted(self):
+        def store_first_row(done, total):
+            if done == 1:
+                DailyPrice.objects.create(stock=self.new, date=self.today - timedelta(days=1), **daily_values('62'))
+
+        self.assertEqual(self.sync(stocks=[self.new], progress=store_first_row), 2)
+
+    def test_price_caches_are_invalidated_when_the_history_write_fails(self):
+        version = get_portfolio_cache_version(0)
+
+        with mock.patch('simulation.prices.update_price_histories', side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                self.sync()
+
+        self.assertNotEqual(get_portfolio_cache_version(0), version)
+
+
+class PriceHistoryFileTests(PriceHistoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.stock = Stock.objects.create(symbol='AIR.PA', name='Airbus', asset_type='STOCK')
+        for day, close in ((2, '100'), (3, '110')):
+            DailyPrice.objects.create(stock=self.stock, date=date(2024, 1, day), **daily_values(close))
+
+    def test_history_is_extended_with_the_new_prices(self):
+        self.assertEqual(update_price_history(self.stock), 2)
+        DailyPrice.objects.create(stock=self.stock, date=date(2024, 1, 4), **daily_values('99'))
+
+        self.assertEqual(update_price_history(self.stock), 1)
+        self.assertEqual(update_price_history(self.stock), 0)
+        history = load_price_history('AIR.PA')
+        self.assertEqual(history.close.tolist(), [100, 110, 99])
+        self.assertEqual(str(history.dates[-1]), '2024-01-04')
+
+    def test_readers_keep_their_map_when_the_file_is_replaced(self):
+        update_price_history(self.stock)
+        before = load_price_history('AIR.PA')
+        DailyPrice.objects.create(stock=self.stock, date=date(2024, 1, 4), **daily_values('99'))
+
+        update_price_history(self.stock)
+
+        self.assertEqual(before.close.tolist(), [100, 110])
+        self.assertEqual(len(load_price_history('AIR.PA')), 3)
+
+    def test_failed_write_leaves_the_previous_file(self):
+        update_price_history(self.stock)
+        DailyPrice.objects.create(stock=self.stock, date=date(2024, 1, 4), **daily_values('99'))
+
+        with mock.patch('simulation.history.np.save', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                update_price_history(self.stock)
+
+        self.assertEqual(len(load_price_history('AIR.PA')), 2)
+        self.assertEqual([path.name for path in self.history_dir.iterdir()], ['AIR.PA.npy'])
+
+
+class ValuationSeriesTests(PriceHistoryTestCase):
+
+    def test_holdings_are_valued_at_the_latest_close_or_trade_price(self):
+        portfolio = Portfolio.objects.create(user=get_user_model().objects.create_user('valuation'), name='PEA')
+        apple = Stock.objects.create(symbol='AAPL', name='Apple', asset_type='STOCK')
+        etf = Stock.objects.create(symbol='CW8', name='MSCI World', asset_type='ETF')
+        for day, close in ((2, '100'), (3, '110')):
+            DailyPrice.objects.create(stock=apple, date=date(2024, 1, day), **daily_values(close))
+        for stock, transaction_type, quantity, price, fees, day in (
+                (apple, 'BUY', 10, 100, 0, 2),
+                (etf, 'BUY', 2, 50, 0, 3),
+                (apple, 'SELL', 5, 120, 2, 4)):
+            Transaction.objects.create(portfolio=portfolio, stock=stock, transaction_type=transaction_type,
+                                       quantity=quantity, price=price, fees=fees, date=date(2024, 1, day))
+
+        series = build_valuation_series(portfolio)
+
+        self.assertEqual([str(day) for day in series.dates], ['2024-01-02', '2024-01-03', '2024-01-04'])
+        self.assertEqual(series.values.tolist(), [1000, 1200, 650])
+        self.assertEqual(series.invested.tolist(), [1000, 1100, 502])
+
+
+def python_totals(positions):
+    """The totals portfolio_detail computed in Python before with_totals."""
+    total_market_value = sum(
+        position.quantity * position.stock.current_price
+        for position in positions
+        if position.stock.current_price is not None
+    )
+    total_cost = sum(position.total_cost for position in positions)
+    total_gain_loss = total_market_value - total_cost if total_market_value else None
+    return total_market_value, total_cost, total_gain_loss
+
+
+class PortfolioTotalsTests(TestCase):
+
+    def test_database_totals_match_the_python_ones(self):
+        user = get_user_model().objects.create_user('totals')
+        priced = Stock.objects.create(symbol='AAPL', name='Apple', asset_type='STOCK', current_price=Decimal('190.25'))
+        etf = Stock.objects.create(symbol='CW8', name='MSCI World', asset_type='ETF', current_price=Decimal('480'))
+        unpriced = Stock.objects.create(symbol='NEW', name='Nouveau', asset_type='STOCK')
+        holdings = {
+            'Complet': [(priced, '3.5', '150.10'), (etf, '2', '500')],
+            'Partiel': [(priced, '1', '200'), (unpriced, '4', '10')],
+            'Sans cours': [(unpriced, '2', '12.5')],
+            'Vide': [],
+        }
+        for name, positions in holdings.items():
+            portfolio = Portfolio.objects.create(user=user, name=name)
+            for stock, quantity, average_price in positions:
+                Position.objects.create(portfolio=portfolio, stock=stock, quantity=Decimal(quantity),
+                                        average_price=Decimal(average_price), purchase_date=date(2024, 1, 2))
+
+        with self.assertNumQueries(1):
+            portfolios = list(with_totals(Portfolio.objects.filter(user=user)).order_by('name'))
+
+        for portfolio in portfolios:
+            positions = list(Position.objects.filter(portfolio=portfolio).select_related('stock'))
+            self.assertEqual(
+                (portfolio.total_market_value, portfolio.total_cost, portfolio.total_gain_loss),
+                python_totals(positions),
+                portfolio.name
+            )
+            for asset_type, _ in Stock.ASSET_TYPES:
+                of_type = [position for position in positions if position.stock.asset_type == asset_type]
+                self.assertEqual(
+                    (getattr(portfolio, f'{asset_type.lower()}_market_value'), getattr(portfolio, f'{asset_type.lower()}_cost')),
+                    python_totals(of_type)[:2]
+                )
+
+
+class LedgerTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('ledger', 'ledger@example.com', 'pw12345678!')
+        self.stock = Stock.objects.create(symbol='AAA', name='AAA', asset_type='STOCK')
+
+    def trade(self, portfolio, transaction_type, quantity, price, day, fees='0'):
+        transaction_obj = Transaction.objects.create(
+            portfolio=portfolio,
+            stock=self.stock,
+            transaction_type=transaction_type,
+            quantity=Decimal(quantity),
+            price=Decimal(price),
+            fees=Decimal(fees),
+            date=day
+        )
+        replay_positions(portfolio, self.stock, since=day)
+        return transaction_obj
+
+    def portfolio_with_trades(self, cost_method):
+        portfolio = Portfolio.objects.create(user=self.user, name=cost_method, cost_method=cost_method)
+        self.trade(portfolio, 'BUY', '10', '100', date(2024, 1, 1), fees='10')
+        self.trade(portfolio, 'BUY', '10', '200', date(2024, 2, 1))
+        sale = self.trade(portfolio, 'SELL', '15', '300', date(2024, 3, 1), fees='5')
+        sale.refresh_from_db()
+        return portfolio, sale
+
+    def test_average_cost(self):
+        portfolio, sale = self.portfolio_with_trades(Portfolio.COST_AVERAGE)
+        position = Position.objects.get(portfolio=portfolio)
+
+        self.assertEqual(sale.realized_gain, Decimal('2237.50'))
+        self.assertEqual(position.quantity, Decimal('5'))
+        self.assertEqual(position.average_price, Decimal('150.50'))
+        self.assertEqual(position.purchase_date, date(2024, 1, 1))
+
+    def test_fifo(self):
+        portfolio, sale = self.portfolio_with_trades(Portfolio.COST_FIFO)
+        position = Position.objects.get(portfolio=portfolio)
+
+        self.assertEqual(sale.realized_gain, Decimal('2485.00'))
+        self.assertEqual(position.quantity, Decimal('5'))
+        self.assertEqual(position.average_price, Decimal('200.00'))
+        self.assertEqual(position.purchase_date, date(2024, 2, 1))
+
+    def test_back_dated_trade_replays_like_a_rebuild(self):
+        portfolio, sale = self.portfolio_with_trades(Portfolio.COST_FIFO)
+        self.trade(portfolio, 'BUY', '5', '50', date(2024, 1, 15))
+        incremental = list(Transaction.objects.order_by('id').values_list('quantity_after', 'lots_after', 'realized_gain'))
+        position = Position.objects.values_list('quantity', 'average_price').get(portfolio=portfolio)
+
+        Transaction.objects.update(quantity_after=None, lots_after=[], realized_gain=None)
+        rebuild_positions(Portfolio.objects.filter(pk=portfolio.pk))
+
+        self.assertEqual(
+            list(Transaction.objects.order_by('id').values_list('quantity_after', 'lots_after', 'realized_gain')),
+            incremental
+        )
+        self.assertEqual(Position.objects.values_list('quantity', 'average_price').get(portfolio=portfolio), position)
+
+    def test_oversell_is_rejected(self):
+        portfolio, _ = self.portfolio_with_trades(Portfolio.COST_AVERAGE)
+        Transaction.objects.create(
+            portfolio=portfolio, stock=self.stock, transaction_type='SELL',
+            quantity=Decimal('6'), price=Decimal('300'), date=date(2024, 4, 1)
+        )
+
+        with self.assertRaises(OversoldError) as raised:
+            replay_positions(portfolio, self.stock, since=date(2024, 4, 1))
+        self.assertEqual(raised.exception.day, date(2024, 4, 1))
+
+    def test_oversold_rebuild_keeps_the_stored_ledger(self):
+        portfolio, _ = self.portfolio_with_trades(Portfolio.COST_AVERAGE)
+        stored = list(Transaction.objects.order_by('id').values_list('quantity_after', 'lots_after', 'realized_gain'))
+        Transaction.objects.create(
+            portfolio=portfolio, stock=self.stock, transaction_type='SELL',
+            quantity=Decimal('6'), price=Decimal('300'), date=date(2024, 4, 1)
+        )
+
+        report = rebuild_positions(Portfolio.objects.filter(pk=portfolio.pk))
+
+        self.assertEqual(report.oversold, {(portfolio.id, self.stock.id): date(2024, 4, 1)})
+        self.assertEqual(report.transactions, 0)
+        self.assertEqual(
+            list(Transaction.objects.order_by('id').values_list('quantity_after', 'lots_after', 'realized_gain'))[:3],
+            stored
+        )
+        self.assertEqual(Position.objects.get(portfolio=portfolio).quantity, Decimal('5'))
+
+    def test_quantity_must_be_positive(self):
+        for quantity in ('0', '-1'):
+            form = TransactionForm(data={
+                'stock': self.stock.id, 'transaction_type': 'BUY', 'quantity': quantity,
+                'price': '100', 'date': '2024-01-01', 'fees': '0',
+            })
+            self.assertIn('quantity', form.errors)
+
+
+class PerformanceTests(PriceHistoryTestCase):
+
+    def test_time_weighted_return_ignores_deposits(self):
+        series = ValuationSeries(
+            np.array(['2024-01-01', '2024-01-02', '2024-01-03'], dtype='datetime64[D]'),
+            np.array([100.0, 110.0, 220.0]),
+            np.array([100.0, 100.0, 200.0])
+        )
+        self.assertAlmostEqual(time_weighted_return(series), 0.2)
+
+    def test_internal_rate_of_return(self):
+        days = np.array(['2020-01-01', '2021-01-01'], dtype='datetime64[D]')
+        rate = internal_rate_of_return(days, np.array([-100.0, 110.0]))
+        self.assertAlmostEqual(rate, 1.1 ** (365.25 / 366) - 1)
+        self.assertIsNone(internal_rate_of_return(days, np.array([100.0, 110.0])))
+
+    def test_metrics_sum_the_realized_gains_and_fees(self):
+        portfolio = Portfolio.objects.create(user=get_user_model().objects.create_user('metrics'), name='PEA')
+        stock = Stock.objects.create(symbol='AAA', name='AAA', asset_type='STOCK')
+        for transaction_type, price, fees, day in (('BUY', '100', '10', 1), ('SELL', '150', '5', 2)):
+            Transaction.objects.create(portfolio=portfolio, stock=stock, transaction_type=transaction_type,
+                                       quantity=Decimal('10'), price=Decimal(price), fees=Decimal(fees),
+                                       date=date(2024, 1, day))
+        replay_positions(portfolio, stock)
+
+        metrics = build_portfolio_metrics(portfolio)
+
+        self.assertEqual((metrics.realized_gain, metrics.fees), (485.0, 15.0))
+        self.assertIsNone(metrics.irr_percent)
+        self.assertEqual(metrics.as_of, date(2024, 1, 2))
+
+
+
+class TransactionImportTests(TestCase):
+
+    def setUp(self):
+        self.portfolio = Portfolio.objects.create(user=get_user_model().objects.create_user('trades'), name='PEA')
+        self.known = Stock.objects.create(symbol='AAA', name='AAA', asset_type='STOCK')
+
+    def test_transactions_and_positions_are_created(self):
+        content = (
+            "date;type;symbole;quantite;prix;frais;nom;type_actif\n"
+            "2024-01-01;Achat;AAA;10;100;10;;\n"
+            "01/02/2024;BUY;CW8;4;450,5;0;MSCI World;ETF\n"
+            "2024-03-01;Vente;AAA;4;150;2;;\n"
+        )
+
+        report = import_transactions(self.portfolio, content)
+
+        self.assertEqual((report.imported, report.errors), (3, []))
+        self.assertEqual([(warning.line, warning.message) for warning in report.warnings], [(3, 'Titre créé: CW8')])
+        self.assertEqual(Stock.objects.get(symbol='CW8').asset_type, 'ETF')
+        self.assertEqual(
+            dict(Position.objects.filter(portfolio=self.portfolio).values_list('stock__symbol', 'quantity')),
+            {'AAA': Decimal('6'), 'CW8': Decimal('4')}
+        )
+        self.assertEqual(Transaction.objects.get(transaction_type='SELL').realized_gain, Decimal('194.00'))
+
+    def test_malformed_lines_are_all_reported(self):
+        content = (
+            "date;type;symbole;quantite;prix\n"
+            "2024-01-01;Achat;AAA;10;100\n"
+            "2024-13-01;Achat;AAA;10;100\n"
+            "2024-01-02;Don;AAA;10;100\n"
+            "2024-01-03;Achat;AAA;0;100\n"
+        )
+
+        report = import_transactions(self.portfolio, content)
+
+        self.assertEqual([error.line for error in report.errors], [3, 4, 5])
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_oversold_import_writes_nothing(self):
+        content = (
+            "date;type;symbole;quantite;prix\n"
+            "2024-01-01;Achat;BBB;10;100\n"
+            "2024-02-01;Vente;BBB;11;120\n"
+        )
+
+        report = import_transactions(self.portfolio, content)
+
+        self.assertEqual([(error.line, error.field) for error in report.errors], [(3, 'quantite')])
+        self.assertFalse(Transaction.objects.filter(portfolio=self.portfolio).exists())
+        self.assertFalse(Stock.objects.filter(symbol='BBB').exists())
+
+
+class IndexTests(TestCase):
+
+    def indexed_columns(self, model):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+        return {tuple(constraint['columns']) for constraint in constraints.values() if constraint['index']}
+
+    def test_hot_lookups_are_indexed(self):
+        self.assertIn(('simulation_id', 'annee'), self.indexed_columns(ConsolidatedResult))
+        self.assertLessEqual({('simulation_id',), ('simulation_id', 'annee')}, self.indexed_columns(RealAccountData))
+        self.assertLessEqual({('user_id', 'nom_compte'), ('user_id', 'categorie_id')}, self.indexed_columns(Simulation))
@@ -14,6 +14,7 @@ urlpatterns = [
     path('export-results-by-name/', views.export_results_by_name, name='export_results_by_name'),
     path('import-simulations/', views.import_simulations, name='import_simulations'),
     path('compare-real-data/', views.compare_real_data, name='compare_real_data'),
+    path('compare-real-data/<int:simulation_id>/chart/', views.compare_real_data_chart, name='compare_real_data_chart'),
     path('compare-real-data/delete/<int:data_id>/', views.delete_real_data, name='delete_real_data'),
     path('export-real-data/', views.export_real_data_to_csv, name='export_real_data'),
     path('import-real-data/', views.import_real_data, name='import_real_data'),
@@ -23,9 +24,13 @@ urlpatterns = [
     path('summary-comparison/', views.summary_comparison, name='summary_comparison'),
     path('portfolios/', views.portfolio_list, name='portfolio_list'),
     path('portfolio/<int:portfolio_id>/', views.portfolio_detail, name='portfolio_detail'),
+    path('portfolio/<int:portfolio_id>/quotes/', views.portfolio_quotes, name='portfolio_quotes'),
     path('portfolio/<int:portfolio_id>/add-transaction/', views.add_transaction, name='add_transaction'),
+    path('portfolio/<int:portfolio_id>/import-transactions/', views.import_portfolio_transactions, name='import_transactions'),
     path('stocks/', views.stock_list, name='stock_list'),
+    path('stocks/update/', views.update_stocks, name='update_stocks'),
     path('portfolio/<int:portfolio_id>/delete/', views.delete_portfolio, name='delete_portfolio'),
     path('stocks/stock/<int:stock_id>/delete/', views.delete_stock, name='delete_stock'),
     path('transaction/<int:transaction_id>/delete/', views.delete_transaction, name='delete_transaction'),
+    path('jobs/<int:job_id>/', views.job_status, name='job_status'),
 ]
@@ -1,20 +1,198 @@
 import requests
+from requests.adapters import HTTPAdapter
 from decimal import Decimal
 from datetime import datetime
+import json
 import logging
+import os
+import random
+import tempfile
+import threading
+import time
 from typing import Optional, Dict, Any
 from django.conf import settings
+from django.utils import timezone
+
+from .quotes import quote_cache
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX: the bucket is only shared between threads
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
+# Interactive requests (a user waiting on a page) go ahead of batch refreshes
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BATCH = 'batch'
+
+RATE_PER_MINUTE = getattr(settings, 'MARKET_DATA_RATE_PER_MINUTE', 5)
+INTERACTIVE_RESERVE = getattr(settings, 'MARKET_DATA_INTERACTIVE_RESERVE', 1)
+REQUEST_TIMEOUT = getattr(settings, 'MARKET_DATA_TIMEOUT', 10)
+MAX_RETRIES = getattr(settings, 'MARKET_DATA_MAX_RETRIES', 4)
+RATE_LIMIT_FILE = getattr(
+    settings,
+    'MARKET_DATA_RATE_FILE',
+    os.path.join(tempfile.gettempdir(), 'eicheesel_market_data_bucket')
+)
+
+# Connections kept open to the API, one per concurrent refresh request
+POOL_SIZE = getattr(settings, 'MARKET_DATA_CONCURRENCY', 8)
+
+# An interactive request gives up instead of keeping a page waiting longer
+INTERACTIVE_MAX_WAIT = 15
+BACKOFF_BASE = 2
+BACKOFF_CAP = 60
+
+
+class APIThrottled(requests.exceptions.RequestException):
+    """The provider kept refusing the request because of its quota."""
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate_per_minute, stored in a file locked with
+    flock so every thread and process of the host draws from the same quota.
+
+    Batch callers leave reserve tokens in the bucket, which only interactive
+    callers may take, so a page never queues behind a whole batch refresh.
+    """
+
+    def __init__(self, path: str, rate_per_minute: float, reserve: int = 0):
+        self.path = path
+        self.rate = rate_per_minute / 60
+        self.capacity = max(rate_per_minute, reserve + 1)
+        self.reserve = reserve
+        self._lock = threading.Lock()
+
+    def _take(self, needed: float) -> float:
+        """Take a token if needed are available; else return the seconds to wait."""
+        with self._lock, open(self.path, 'a+') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state = json.loads(f.read())
+                state['tokens'], state['updated']
+            except (ValueError, KeyError, TypeError):
+                state = {'tokens': self.capacity, 'updated': time.time()}
+
+            now = time.time()
+            tokens = min(self.capacity, state['tokens'] + max(0.0, now - state['updated']) * self.rate)
+            wait = 0.0
+            if tokens >= needed:
+                tokens -= 1
+            else:
+                wait = (needed - tokens) / self.rate
+
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps({'tokens': tokens, 'updated': now}))
+            return wait
+
+    def acquire(self, priority: str = PRIORITY_BATCH, timeout: Optional[float] = None) -> bool:
+        """Block until a token is taken, or return False once timeout seconds have passed."""
+        needed = 1 if priority == PRIORITY_INTERACTIVE else 1 + self.reserve
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take(needed)
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            # Jitter keeps waiting callers from all waking up on the same token
+            time.sleep(wait + random.uniform(0, 0.1))
+
+
+_rate_limiter: Optional[TokenBucket] = None
+
+
+def get_rate_limiter() -> TokenBucket:
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = TokenBucket(RATE_LIMIT_FILE, RATE_PER_MINUTE, INTERACTIVE_RESERVE)
+    return _rate_limiter
+
+
+def _build_session() -> requests.Session:
+    """
+    HTTP session keeping its connections alive between requests, with a pool
+    large enough for the concurrent refreshes. Retries are handled by
+    StockAPIClient, within the rate limit.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=POOL_SIZE,
+        max_retries=0,
+        pool_block=True
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
 
 class StockAPIClient:
     def __init__(self):
         self.api_key = settings.ALPHA_VANTAGE_API_KEY
         self.base_url = "https://www.alphavantage.co/query"
+        self.session = _build_session()
+
+    def _get(self, params: Dict[str, str], priority: str = PRIORITY_BATCH) -> Dict[str, Any]:
+        """
+        Query the API within the shared rate limit. Throttled answers (429,
+        "Note" or "Information" payloads), server errors and network errors
+        are retried with exponential backoff.
+        """
+        timeout = INTERACTIVE_MAX_WAIT if priority == PRIORITY_INTERACTIVE else None
+        retries = 1 if priority == PRIORITY_INTERACTIVE else MAX_RETRIES
+        symbol = params.get("symbol")
+
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(_backoff(attempt))
+            if not get_rate_limiter().acquire(priority, timeout):
+                raise APIThrottled(f"Rate limit reached, no request slot for {symbol}")
+
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=REQUEST_TIMEOUT)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == retries:
+                    raise
+                logger.warning(f"API request failed for symbol {symbol}, retrying: {str(e)}")
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                logger.warning(f"API answered {response.status_code} for symbol {symbol}, retrying")
+                continue
+            response.raise_for_status()
+
+            data = response.json()
+            if "Note" in data or "Information" in data:
+                logger.warning(f"API throttled symbol {symbol}, retrying")
+                continue
+            return data
 
-    def get_stock_quote(self, symbol: str) -> Optional[Dict[str, Any]]:
-        """Get real-time quote for a stock."""
+        raise APIThrottled(f"API still throttled after {retries + 1} attempts for {symbol}")
+
+    def get_stock_quote(self, symbol: str, priority: str = PRIORITY_BATCH) -> Optional[Dict[str, Any]]:
+        """
+        Get real-time quote for a stock, from the quote cache while it is
+        younger than QUOTE_MAX_AGE_MINUTES.
+        """
+        return quote_cache.get_or_fetch(
+            symbol,
+            lambda: self._fetch_stock_quote(symbol, priority),
+            # A page doesn't wait on a batch refresh of the same symbol longer than on the rate limit
+            max_wait=INTERACTIVE_MAX_WAIT if priority == PRIORITY_INTERACTIVE else None
+        )
+
+    def _fetch_stock_quote(self, symbol: str, priority: str) -> Optional[Dict[str, Any]]:
         try:
             params = {
                 "function": "GLOBAL_QUOTE",
@@ -22,9 +200,7 @@ class StockAPIClient:
                 "apikey": self.api_key
             }
 
-            response = requests.get(self.base_url, params=params)
-            response.raise_for_status()
-            data = response.json()
+            data = self._get(params, priority)
 
             if "Global Quote" in data and data["Global Quote"]:
                 quote = data["Global Quote"]
@@ -34,6 +210,7 @@ class StockAPIClient:
                     "change_percent": Decimal(quote["10. change percent"].strip('%')),
                     "volume": int(quote["06. volume"]),
                     "latest_trading_day": datetime.strptime(quote["07. latest trading day"], "%Y-%m-%d").date(),
+                    "fetched_at": timezone.now(),
                 }
             return None
 
@@ -44,7 +221,12 @@ class StockAPIClient:
             logger.error(f"Error parsing API response for symbol {symbol}: {str(e)}")
             return None
 
-    def get_daily_prices(self, symbol: str, outputsize: str = "compact") -> Optional[Dict[str, Dict[str, Decimal]]]:
+    def get_daily_prices(
+            self,
+            symbol: str,
+            outputsize: str = "compact",
+            priority: str = PRIORITY_BATCH
+    ) -> Optional[Dict[str, Dict[str, Decimal]]]:
         """Get daily price history for a stock."""
         try:
             params = {
@@ -54,9 +236,7 @@ class StockAPIClient:
                 "apikey": self.api_key
             }
 
-            response = requests.get(self.base_url, params=params)
-            response.raise_for_status()
-            data = response.json()
+            data = self._get(params, priority)
 
             if "Time Series (Daily)" in data:
                 daily_prices = {}
@@ -76,4 +256,22 @@ class StockAPIClient:
             return None
         except (KeyError, ValueError, TypeError) as e:
             logger.error(f"Error parsing API response for symbol {symbol}: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+_api_client: Optional[StockAPIClient] = None
+_api_client_pid: Optional[int] = None
+_api_client_lock = threading.Lock()
+
+
+def get_api_client() -> StockAPIClient:
+    """
+    Return the StockAPIClient of this process, so every caller reuses the
+    same pooled connections. A forked process builds its own, sockets can't
+    be shared with the parent.
+    """
+    global _api_client, _api_client_pid
+    with _api_client_lock:
+        if _api_client is None or _api_client_pid != os.getpid():
+            _api_client = StockAPIClient()
+            _api_client_pid = os.getpid()
+        return _api_client
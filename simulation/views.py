@@ -1,23 +1,36 @@
 from datetime import datetime
 from decimal import Decimal
-from typing import Tuple, List, TypedDict, Optional
+from itertools import groupby
+from operator import itemgetter
+from typing import Tuple, List, TypedDict, Optional, Iterable
 import json
 import logging
 import csv
-import io
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 #from django.core.checks import messages
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpRequest, HttpResponse, JsonResponse
-from django.db.models import  QuerySet
+from django.urls import reverse
+from django.http import HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db.models import  QuerySet, Sum, F
 from django.core.exceptions import ValidationError, PermissionDenied
 from django.views.decorators.http import require_http_methods
 from django.db import transaction
 from .forms import SimulationForm, RealDataForm, PortfolioForm, PositionForm, TransactionForm, StockForm, \
     AnnualInflationRateForm, SimulationCSVImportForm
 from .models import Simulation, Category, ConsolidatedResult, RealAccountData, Portfolio, Position, Transaction, Stock, \
-    AnnualInflationRate
+    AnnualInflationRate, Job
+from .cache import cached_user_payload, invalidate_user_cache
+from .comparison import build_real_data_comparison, build_summary_comparison, apply_inflation_rates
+from .importers import ImportReport, format_row_errors, import_real_account_data, import_transactions
+from .jobs import background_jobs_enabled, enqueue, queue_quote_refresh
+from .ledger import lock_portfolio, replay_positions
+from .market import refresh_stocks
+from .portfolios import get_portfolio_metrics, get_valuation_series, with_totals
+from .projections import validate_simulation_inputs, project_trajectory, build_consolidated_results, \
+    results_are_materialized, get_consolidated_results, get_result_rows, simulate_percentile_bands
+from .tasks import update_all_stocks
+from .utils import PRIORITY_INTERACTIVE
 
 from django.utils.text import slugify
 
@@ -71,45 +84,21 @@ def calculate_simulation_results(simulation_instance: Simulation) -> None:
         if not validate_simulation_inputs(simulation_instance):
             raise ValidationError("Invalid calculation parameters")
 
-        montant_actuel = Decimal(str(simulation_instance.montant_initial))
-        taux = Decimal(str(simulation_instance.taux_rentabilite)) / 100
-        montant_fixe = Decimal(str(simulation_instance.montant_fixe_annuel))
+        # Results are projected on read, nothing to store
+        if not results_are_materialized():
+            return
+
+        amounts = project_trajectory(simulation_instance)
 
         with transaction.atomic():
             # Delete existing results for this simulation to avoid duplicates
             ConsolidatedResult.objects.filter(simulation=simulation_instance).delete()
 
-            # Create first year's result with initial amount
-            results_to_create = [
-                ConsolidatedResult(
-                    simulation=simulation_instance,
-                    annee=simulation_instance.annee_depart,
-                    montant=montant_actuel,
-                    nom_compte=simulation_instance.nom_compte
-                )
-            ]
-
-            # Calculate subsequent years
-            for annee in range(
-                    simulation_instance.annee_depart + 1,
-                    simulation_instance.annee_depart + simulation_instance.periode + 1
-            ):
-                # First apply return rate to current amount
-                montant_actuel = montant_actuel * (1 + taux)
-                # Then add the fixed annual contribution
-                montant_actuel += montant_fixe
-
-                results_to_create.append(
-                    ConsolidatedResult(
-                        simulation=simulation_instance,
-                        annee=annee,
-                        montant=montant_actuel,
-                        nom_compte=simulation_instance.nom_compte
-                    )
-                )
-
             # Bulk create for better performance
-            ConsolidatedResult.objects.bulk_create(results_to_create)
+            ConsolidatedResult.objects.bulk_create(
+                build_consolidated_results(simulation_instance, amounts)
+            )
+            invalidate_user_cache([simulation_instance.user_id])
 
     except (ValueError, TypeError, ValidationError) as e:
         logger.error(f"Error calculating simulation results: {str(e)}")
@@ -129,25 +118,53 @@ class ChartData(TypedDict):
     datasets: List[ChartDataPoint]
 
 
+# Chart.js default colors
+CHART_COLORS = [
+    {'backgroundColor': 'rgba(54, 162, 235, 0.2)', 'borderColor': 'rgb(54, 162, 235)'},  # blue
+    {'backgroundColor': 'rgba(255, 99, 132, 0.2)', 'borderColor': 'rgb(255, 99, 132)'},  # red
+    {'backgroundColor': 'rgba(255, 206, 86, 0.2)', 'borderColor': 'rgb(255, 206, 86)'},  # yellow
+    {'backgroundColor': 'rgba(75, 192, 192, 0.2)', 'borderColor': 'rgb(75, 192, 192)'},  # green
+    {'backgroundColor': 'rgba(153, 102, 255, 0.2)', 'borderColor': 'rgb(153, 102, 255)'},  # purple
+    {'backgroundColor': 'rgba(255, 159, 64, 0.2)', 'borderColor': 'rgb(255, 159, 64)'},  # orange
+]
+
+
+def _cumulative_dataset(years: List[int], yearly_totals: dict, group_by_field: str) -> List[ChartDataPoint]:
+    # Create single dataset for cumulative view
+    label = 'Total tous comptes' if group_by_field == 'account' else 'Total toutes catégories'
+    return [{
+        'label': label,
+        'data': [yearly_totals[str(year)] for year in years],
+        **CHART_COLORS[0],
+        'borderWidth': 2,
+        'fill': True
+    }]
+
+
+def _group_datasets(years: List[int], data_by_group: dict) -> List[ChartDataPoint]:
+    # Create datasets for detailed view
+    chart_data = []
+    for idx, (group_key, values) in enumerate(sorted(data_by_group.items())):
+        color_idx = idx % len(CHART_COLORS)
+        dataset = {
+            'label': group_key,
+            'data': [values[str(year)] for year in years],
+            **CHART_COLORS[color_idx],
+            'borderWidth': 2
+        }
+        chart_data.append(dataset)
+    return chart_data
+
+
 def prepare_chart_data_base(
-        consolidated_results: QuerySet[ConsolidatedResult],
+        consolidated_results: Iterable[ConsolidatedResult],
         cumulative: bool = False,
         group_by_field: str = 'category'
 ) -> Tuple[List[str], List[ChartDataPoint]]:
 
-    if not consolidated_results.exists():
+    if not consolidated_results:
         return [], []
 
-    # Chart.js default colors
-    colors = [
-        {'backgroundColor': 'rgba(54, 162, 235, 0.2)', 'borderColor': 'rgb(54, 162, 235)'},  # blue
-        {'backgroundColor': 'rgba(255, 99, 132, 0.2)', 'borderColor': 'rgb(255, 99, 132)'},  # red
-        {'backgroundColor': 'rgba(255, 206, 86, 0.2)', 'borderColor': 'rgb(255, 206, 86)'},  # yellow
-        {'backgroundColor': 'rgba(75, 192, 192, 0.2)', 'borderColor': 'rgb(75, 192, 192)'},  # green
-        {'backgroundColor': 'rgba(153, 102, 255, 0.2)', 'borderColor': 'rgb(153, 102, 255)'},  # purple
-        {'backgroundColor': 'rgba(255, 159, 64, 0.2)', 'borderColor': 'rgb(255, 159, 64)'},  # orange
-    ]
-
     # Get all unique years across all simulations
     years = sorted(set(result.annee for result in consolidated_results))
     chart_labels = [str(year) for year in years]
@@ -192,15 +209,7 @@ def prepare_chart_data_base(
                 # Add to yearly totals
                 yearly_totals[year_str] += sim_data['values'][year_str]
 
-        # Create single dataset for cumulative view
-        label = 'Total tous comptes' if group_by_field == 'account' else 'Total toutes catégories'
-        chart_data = [{
-            'label': label,
-            'data': [yearly_totals[str(year)] for year in years],
-            **colors[0],
-            'borderWidth': 2,
-            'fill': True
-        }]
+        chart_data = _cumulative_dataset(years, yearly_totals, group_by_field)
 
     else:
         # Non-cumulative view - show individual lines
@@ -219,35 +228,138 @@ def prepare_chart_data_base(
             year_str = str(result.annee)
             data_by_group[group_key][year_str] += float(result.montant)
 
-        # Create datasets for detailed view
-        chart_data = []
-        for idx, (group_key, values) in enumerate(sorted(data_by_group.items())):
-            color_idx = idx % len(colors)
-            dataset = {
-                'label': group_key,
-                'data': [values[str(year)] for year in years],
-                **colors[color_idx],
-                'borderWidth': 2
-            }
-            chart_data.append(dataset)
+        chart_data = _group_datasets(years, data_by_group)
 
     return chart_labels, chart_data
 
 
+def prepare_chart_data_from_database(
+        simulations: QuerySet[Simulation],
+        cumulative: bool = False,
+        group_by_field: str = 'category'
+) -> Tuple[List[str], List[ChartDataPoint]]:
+    """
+    Same output as prepare_chart_data_base, but the GROUP BY (group, year) and
+    the SUM run in the database: only the aggregated series reach Python.
+    In cumulative mode, the few simulations with a zero or negative amount,
+    which carry their last positive one instead, are read row by row.
+    """
+    results = ConsolidatedResult.objects.filter(simulation__in=simulations)
+
+    if cumulative:
+        irregular = results.filter(montant__lte=0).values('simulation_id')
+        regular = results.exclude(simulation_id__in=irregular)
+
+        yearly_sums = {
+            row['annee']: float(row['total'])
+            for row in regular.values('annee').annotate(total=Sum('montant')).order_by('annee')
+        }
+        # Last value of each simulation, carried over the years after it ends
+        final_sums = {
+            row['annee']: float(row['total'])
+            for row in regular.filter(
+                annee=F('simulation__annee_depart') + F('simulation__periode')
+            ).values('annee').annotate(total=Sum('montant'))
+        }
+        irregular_rows = list(
+            results.filter(simulation_id__in=irregular)
+            .order_by('simulation_id', 'annee')
+            .values_list('simulation_id', 'annee', 'montant')
+        )
+
+        years = sorted(set(yearly_sums) | {annee for _, annee, _ in irregular_rows})
+        if not years:
+            return [], []
+
+        yearly_totals = {}
+        carried = 0
+        for year in years:
+            yearly_totals[str(year)] = yearly_sums.get(year, 0) + carried
+            carried += final_sums.get(year, 0)
+
+        for _, rows in groupby(irregular_rows, key=itemgetter(0)):
+            amounts = {annee: float(montant) for _, annee, montant in rows}
+            running_total = 0
+            for year in years:
+                if amounts.get(year, 0) > 0:
+                    running_total = amounts[year]
+                yearly_totals[str(year)] += running_total
+
+        return [str(year) for year in years], _cumulative_dataset(years, yearly_totals, group_by_field)
+
+    group_field = 'simulation__categorie__category' if group_by_field == 'category' else 'simulation__nom_compte'
+    rows = list(results.values(group_field, 'annee').annotate(total=Sum('montant')))
+    if not rows:
+        return [], []
+
+    years = sorted(set(row['annee'] for row in rows))
+    data_by_group = {}
+    for row in rows:
+        values = data_by_group.setdefault(row[group_field], {str(year): 0 for year in years})
+        values[str(row['annee'])] = float(row['total'])
+
+    return [str(year) for year in years], _group_datasets(years, data_by_group)
+
+
+def prepare_chart_data(
+        simulations: QuerySet[Simulation],
+        consolidated_results: Iterable[ConsolidatedResult],
+        cumulative: bool = False,
+        group_by_field: str = 'category'
+) -> Tuple[List[str], List[ChartDataPoint]]:
+    """Aggregate in the database when results are stored, in Python otherwise."""
+    if results_are_materialized():
+        return prepare_chart_data_from_database(simulations, cumulative, group_by_field)
+    return prepare_chart_data_base(consolidated_results, cumulative, group_by_field)
+
+
+def prepare_band_datasets(
+        simulations: Iterable[Simulation],
+        chart_labels: List[str]
+) -> List[dict]:
+    """Build P5/P50/P95 line datasets for the stochastic simulations of a chart."""
+    bands = simulate_percentile_bands(simulations, [int(year) for year in chart_labels])
+    if bands is None:
+        return []
+
+    styles = [
+        ('Percentile 5', False, [4, 4]),
+        ('Médiane (P50)', False, []),
+        ('Percentile 95', '-2', [4, 4]),  # Fill down to the P5 line
+    ]
+    return [
+        {
+            'label': label,
+            'type': 'line',
+            'band': True,
+            'data': [round(float(value), 2) for value in values],
+            'borderColor': 'rgb(153, 102, 255)',
+            'backgroundColor': 'rgba(153, 102, 255, 0.15)',
+            'borderWidth': 1,
+            'borderDash': border_dash,
+            'pointRadius': 0,
+            'fill': fill,
+        }
+        for (label, fill, border_dash), values in zip(styles, bands)
+    ]
+
+
 def prepare_chart_data_by_category(
-        consolidated_results: QuerySet[ConsolidatedResult],
+        simulations: QuerySet[Simulation],
+        consolidated_results: Iterable[ConsolidatedResult],
         cumulative: bool = False
 ) -> Tuple[List[str], List[ChartDataPoint]]:
 
-    return prepare_chart_data_base(consolidated_results, cumulative, 'category')
+    return prepare_chart_data(simulations, consolidated_results, cumulative, 'category')
 
 
 def prepare_chart_data_by_account(
-        consolidated_results: QuerySet[ConsolidatedResult],
+        simulations: QuerySet[Simulation],
+        consolidated_results: Iterable[ConsolidatedResult],
         cumulative: bool = False
 ) -> Tuple[List[str], List[ChartDataPoint]]:
 
-    return prepare_chart_data_base(consolidated_results, cumulative, 'account')
+    return prepare_chart_data(simulations, consolidated_results, cumulative, 'account')
 
 @login_required
 def simulation(request: HttpRequest) -> HttpResponse:
@@ -280,12 +392,11 @@ def simulation(request: HttpRequest) -> HttpResponse:
                 calculate_simulation_results(simulation_instance)
 
                 # Fetch results for display
-                consolidated_results = ConsolidatedResult.objects.filter(
-                    simulation=simulation_instance
-                ).order_by('annee')
+                consolidated_results = get_consolidated_results([simulation_instance])
 
                 # Prepare chart data
                 chart_labels, chart_data = prepare_chart_data_base(consolidated_results)
+                chart_data += prepare_band_datasets([simulation_instance], chart_labels)
 
                 # Show success message
                 messages.success(request, "Simulation créée avec succès")
@@ -314,65 +425,60 @@ def simulation(request: HttpRequest) -> HttpResponse:
     #return render(request, 'simulation.html', {'form': form})
 
 
-def validate_simulation_inputs(simulation: Simulation) -> bool:
-
-    try:
-        # Ensure positive values
-        #if simulation.montant_initial < 0 or simulation.montant_fixe_annuel < 0:
-        #    return False
-
-        # Ensure reasonable rate range (-100% to +100%)
-        if not -100 <= simulation.taux_rentabilite <= 100:
-            return False
-
-        # Ensure reasonable period (e.g., 1-50 years)
-        if not 1 <= simulation.periode <= 50:
-            return False
-
-        # Ensure start year is reasonable (e.g., within last 5 years)
-        current_year = datetime.now().year
-        if not current_year - 5 <= simulation.annee_depart <= current_year + 1:
-            return False
-
-        return True
+def cached_results_chart(
+        request: HttpRequest,
+        simulations: QuerySet[Simulation],
+        selection: str,
+        cumulative: bool,
+        group_by_field: str
+) -> Tuple[str, str]:
+    """Return the JSON chart labels and datasets of a results view, cached per user."""
+
+    def build_chart() -> Tuple[str, str]:
+        # Stored results are aggregated by the database, projected ones in Python
+        consolidated_results = [] if results_are_materialized() else get_consolidated_results(simulations)
+        chart_labels, chart_data = prepare_chart_data(simulations, consolidated_results, cumulative, group_by_field)
+        if not cumulative:
+            chart_data += prepare_band_datasets(simulations, chart_labels)
+        return json.dumps(chart_labels), json.dumps(chart_data)
+
+    return cached_user_payload(
+        request.user.id,
+        f'results_by_{group_by_field}',
+        (selection, cumulative),
+        build_chart
+    )
 
-    except Exception as e:
-        logger.error(f"Error validating simulation inputs: {str(e)}")
-        return False
 
 @login_required
 def results_list_by_cat(request: HttpRequest) -> HttpResponse:
 
-    categories: QuerySet[str] = Category.objects.filter(
-        simulation__user=request.user
-    ).values_list('category', flat=True).distinct()
+    categories: List[str] = cached_user_payload(
+        request.user.id, 'categories', (),
+        lambda: list(Category.objects.filter(
+            simulation__user=request.user
+        ).values_list('category', flat=True).distinct())
+    )
 
     selected_category: Optional[str] = request.GET.get('categories')
     cumulative: bool = request.GET.get('cumulative') == 'true'
-    chart_data: List[ChartDataPoint] = []
-    chart_labels: List[str] = []
-    consolidated_results: QuerySet[ConsolidatedResult] = ConsolidatedResult.objects.none()
+    chart_data: str = json.dumps([])
+    chart_labels: str = json.dumps([])
+    consolidated_results: List[dict] = []
 
     try:
-        if selected_category == "all":
+        if selected_category:
             simulations = Simulation.objects.filter(user=request.user)
-            consolidated_results = ConsolidatedResult.objects.filter(
-                simulation__in=simulations
-            ).select_related('simulation', 'simulation__categorie')
+            if selected_category != "all":
+                simulations = simulations.filter(categorie__category=selected_category)
 
-            chart_labels, chart_data = prepare_chart_data_by_category(consolidated_results, cumulative)
-
-        elif selected_category:
-            simulations = Simulation.objects.filter(
-                categorie__category=selected_category,
-                user=request.user
+            consolidated_results = cached_user_payload(
+                request.user.id, 'results_table_by_category', (selected_category,),
+                lambda: get_result_rows(simulations)
+            )
+            chart_labels, chart_data = cached_results_chart(
+                request, simulations, selected_category, cumulative, 'category'
             )
-            if simulations.exists():
-                consolidated_results = ConsolidatedResult.objects.filter(
-                    simulation__in=simulations
-                ).select_related('simulation')
-
-                chart_labels, chart_data = prepare_chart_data_by_category(consolidated_results, cumulative)
 
     except Exception as e:
         logger.error(f"Error in results_list_by_cat for user {request.user.id}: {str(e)}", exc_info=True)
@@ -381,8 +487,8 @@ def results_list_by_cat(request: HttpRequest) -> HttpResponse:
     context = {
         'categories': categories,
         'consolidated_results': consolidated_results,
-        'chart_data': json.dumps(chart_data),
-        'chart_labels': json.dumps(chart_labels),
+        'chart_data': chart_data,
+        'chart_labels': chart_labels,
         'selected_category': selected_category,
         'cumulative': cumulative,
     }
@@ -392,36 +498,32 @@ def results_list_by_cat(request: HttpRequest) -> HttpResponse:
 @login_required
 def results_list_by_name(request: HttpRequest) -> HttpResponse:
 
-    account_names: QuerySet[str] = Simulation.objects.filter(
-        user=request.user
-    ).values_list('nom_compte', flat=True).distinct()
+    account_names: List[str] = cached_user_payload(
+        request.user.id, 'account_names', (),
+        lambda: list(Simulation.objects.filter(
+            user=request.user
+        ).values_list('nom_compte', flat=True).distinct())
+    )
 
     selected_name: Optional[str] = request.GET.get('account_name')
     cumulative: bool = request.GET.get('cumulative') == 'true'
-    chart_data: List[ChartDataPoint] = []
-    chart_labels: List[str] = []
-    consolidated_results: QuerySet[ConsolidatedResult] = ConsolidatedResult.objects.none()
+    chart_data: str = json.dumps([])
+    chart_labels: str = json.dumps([])
+    consolidated_results: List[dict] = []
 
     try:
-        if selected_name == "all":
+        if selected_name:
             simulations = Simulation.objects.filter(user=request.user)
-            consolidated_results = ConsolidatedResult.objects.filter(
-                simulation__in=simulations
-            ).select_related('simulation')
+            if selected_name != "all":
+                simulations = simulations.filter(nom_compte=selected_name)
 
-            chart_labels, chart_data = prepare_chart_data_by_account(consolidated_results, cumulative)
-
-        elif selected_name:
-            simulations = Simulation.objects.filter(
-                nom_compte=selected_name,
-                user=request.user
+            consolidated_results = cached_user_payload(
+                request.user.id, 'results_table_by_account', (selected_name,),
+                lambda: get_result_rows(simulations)
+            )
+            chart_labels, chart_data = cached_results_chart(
+                request, simulations, selected_name, cumulative, 'account'
             )
-            if simulations.exists():
-                consolidated_results = ConsolidatedResult.objects.filter(
-                    simulation__in=simulations
-                ).select_related('simulation')
-
-                chart_labels, chart_data = prepare_chart_data_by_account(consolidated_results, cumulative)
 
     except Exception as e:
         logger.error(f"Error in results_list_by_name for user {request.user.id}: {str(e)}", exc_info=True)
@@ -430,8 +532,8 @@ def results_list_by_name(request: HttpRequest) -> HttpResponse:
     context = {
         'account_names': account_names,
         'consolidated_results': consolidated_results,
-        'chart_data': json.dumps(chart_data),
-        'chart_labels': json.dumps(chart_labels),
+        'chart_data': chart_data,
+        'chart_labels': chart_labels,
         'selected_name': selected_name,
         'cumulative': cumulative,
     }
@@ -576,56 +678,73 @@ def delete_category(request: HttpRequest, category_name: str) -> HttpResponse:
         }, status=500)
 
 
-def export_results_to_csv(results: QuerySet[ConsolidatedResult], filename_prefix: str) -> HttpResponse:
-    """Export results to CSV file in a format compatible with import."""
-    response = HttpResponse(content_type='text/csv')
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    response['Content-Disposition'] = f'attachment; filename="{filename_prefix}_{timestamp}.csv"'
-
-    writer = csv.writer(response, delimiter=';')
-
-    # Write headers matching import format
-    writer.writerow([
-        'categorie', 'nom_compte', 'montant_initial', 'currency',
-        'taux_rentabilite', 'periode', 'annee_depart', 'montant_fixe_annuel'
-    ])
-
-    # Group results by simulation to avoid duplicates
-    processed_simulations = set()
-
-    for result in results:
-        simulation = result.simulation
-        if simulation.id not in processed_simulations:
-            writer.writerow([
-                simulation.categorie.category,
-                simulation.nom_compte,
-                str(simulation.montant_initial).replace('.', ','),
-                simulation.currency,
-                str(simulation.taux_rentabilite).replace('.', ','),
-                simulation.periode,
-                simulation.annee_depart,
-                str(simulation.montant_fixe_annuel).replace('.', ',')
-            ])
-            processed_simulations.add(simulation.id)
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """Pseudo-buffer for csv.writer: write() returns the line instead of storing it."""
+
+    def write(self, value: str) -> str:
+        return value
+
 
+def streaming_csv_response(rows: Iterable[list], filename: str) -> StreamingHttpResponse:
+    """Stream CSV rows to the client one line at a time."""
+    writer = csv.writer(Echo(), delimiter=';')
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in rows),
+        content_type='text/csv'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
     return response
 
+
+def export_results_to_csv(simulations: QuerySet[Simulation], filename_prefix: str) -> StreamingHttpResponse:
+    """Export simulations to CSV file in a format compatible with import."""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    def rows():
+        # Write headers matching import format
+        yield [
+            'categorie', 'nom_compte', 'montant_initial', 'currency',
+            'taux_rentabilite', 'periode', 'annee_depart', 'montant_fixe_annuel'
+        ]
+
+        for (category, nom_compte, montant_initial, currency,
+             taux_rentabilite, periode, annee_depart, montant_fixe_annuel) in simulations.values_list(
+                'categorie__category', 'nom_compte', 'montant_initial', 'currency',
+                'taux_rentabilite', 'periode', 'annee_depart', 'montant_fixe_annuel'
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield [
+                category,
+                nom_compte,
+                str(montant_initial).replace('.', ','),
+                currency,
+                str(taux_rentabilite).replace('.', ','),
+                periode,
+                annee_depart,
+                str(montant_fixe_annuel).replace('.', ',')
+            ]
+
+    return streaming_csv_response(rows(), f"{filename_prefix}_{timestamp}.csv")
+
 @login_required
 def import_simulations(request: HttpRequest) -> HttpResponse:
+    if request.method == 'POST' and background_jobs_enabled():
+        content = read_csv_upload(request)
+        if content is None:
+            return redirect('import_simulations')
+        job = enqueue('import_simulations', user=request.user, content=content)
+        messages.info(request, "Import des simulations lancé en arrière-plan")
+        return redirect_to_job('simulation', job)
+
     if request.method == 'POST':
         form = SimulationCSVImportForm(request.POST, request.FILES, user=request.user)
         if form.is_valid():
             try:
-                with transaction.atomic():
-                    simulations = form.save()
-
-                    # Calculate results for each imported simulation
-                    for simulation in simulations:
-                        try:
-                            calculate_simulation_results(simulation)
-                        except ValidationError as calc_error:
-                            # If calculation fails, rollback entire transaction
-                            raise ValidationError(f"Erreur de calcul pour {simulation.nom_compte}: {str(calc_error)}")
+                # Results of all imported simulations are calculated at
+                # once, a failure rolls back the entire import
+                simulations = form.save()
 
                 messages.success(request, f"{len(simulations)} simulation(s) importée(s) et calculée(s) avec succès")
                 return redirect('simulation')
@@ -658,14 +777,10 @@ def export_results_by_cat(request: HttpRequest) -> HttpResponse:
             )
             filename_prefix = f"categorie_{slugify(selected_category)}"
 
-        results = ConsolidatedResult.objects.filter(
-            simulation__in=simulations
-        ).select_related(
-            'simulation',
-            'simulation__categorie'
-        ).order_by('annee', 'simulation__categorie__category', 'simulation__nom_compte')
-
-        return export_results_to_csv(results, filename_prefix)
+        return export_results_to_csv(
+            simulations.order_by('categorie__category', 'nom_compte'),
+            filename_prefix
+        )
 
     except Exception as e:
         logger.error(f"Error exporting category results: {str(e)}", exc_info=True)
@@ -689,14 +804,7 @@ def export_results_by_name(request: HttpRequest) -> HttpResponse:
             )
             filename_prefix = f"compte_{slugify(selected_name)}"
 
-        results = ConsolidatedResult.objects.filter(
-            simulation__in=simulations
-        ).select_related(
-            'simulation',
-            'simulation__categorie'
-        ).order_by('annee', 'simulation__nom_compte')
-
-        return export_results_to_csv(results, filename_prefix)
+        return export_results_to_csv(simulations.order_by('nom_compte'), filename_prefix)
 
     except Exception as e:
         logger.error(f"Error exporting account results: {str(e)}", exc_info=True)
@@ -710,9 +818,6 @@ def compare_real_data(request: HttpRequest) -> HttpResponse:
     accounts = Simulation.objects.filter(user=request.user).order_by('nom_compte')
     selected_account = request.GET.get('account')
     show_inflation = request.GET.get('inflation', 'true') == 'true'
-    simulation_data = None
-    real_data = None
-    real_data_form = None
 
     if selected_account:
         try:
@@ -749,79 +854,14 @@ def compare_real_data(request: HttpRequest) -> HttpResponse:
                         logger.error(f"Error saving real data: {str(e)}")
                         messages.error(request, "Une erreur est survenue lors de la sauvegarde des données")
 
-                    return redirect(f'{request.path}?account={selected_account}&inflation={show_inflation}')
-
-            # Get simulation data
-            simulation_data = ConsolidatedResult.objects.filter(
-                simulation=simulation
-            ).order_by('annee')
+                    return redirect(f'{request.path}?account={selected_account}&inflation={str(show_inflation).lower()}')
 
-            # Get real data
-            real_data = RealAccountData.objects.filter(
-                simulation=simulation
-            ).order_by('annee')
+            chart_data, real_data = build_real_data_comparison(simulation, show_inflation)
 
             # Get available inflation rates for information
-            available_inflation_rates = {
-                rate.annee: rate.taux_inflation
-                for rate in AnnualInflationRate.objects.all()
-            }
-
-            # Prepare comparison data for chart
-            years = sorted(set(
-                list(simulation_data.values_list('annee', flat=True)) +
-                list(real_data.values_list('annee', flat=True))
-            ))
-
-            base_datasets = [
-                {
-                    'label': 'Simulation',
-                    'data': [next(
-                        (float(r.montant) for r in simulation_data if r.annee == year),
-                        None
-                    ) for year in years],
-                    'borderColor': 'rgb(54, 162, 235)',
-                    'backgroundColor': 'rgba(54, 162, 235, 0.2)',
-                    'borderWidth': 2
-                },
-                {
-                    'label': 'Données réelles nominales',
-                    'data': [next(
-                        (float(r.montant_reel) for r in real_data if r.annee == year),
-                        None
-                    ) for year in years],
-                    'borderColor': 'rgb(255, 99, 132)',
-                    'backgroundColor': 'rgba(255, 99, 132, 0.2)',
-                    'borderWidth': 2
-                }
-            ]
-
-            if show_inflation:
-                # Ajout des données ajustées avec gestion des None
-                inflation_data = []
-                for year in years:
-                    value = next(
-                        (r for r in real_data if r.annee == year),
-                        None
-                    )
-                    if value and value.montant_reel_ajuste is not None:
-                        inflation_data.append(float(value.montant_reel_ajuste))
-                    else:
-                        inflation_data.append(None)
-
-                base_datasets.append({
-                    'label': 'Données réelles (ajustées inflation)',
-                    'data': inflation_data,
-                    'borderColor': 'rgb(75, 192, 192)',
-                    'backgroundColor': 'rgba(75, 192, 192, 0.2)',
-                    'borderWidth': 2,
-                    'borderDash': [5, 5]
-                })
-
-            chart_data = {
-                'labels': [str(year) for year in years],
-                'datasets': base_datasets
-            }
+            available_inflation_rates = dict(
+                AnnualInflationRate.objects.values_list('annee', 'taux_inflation')
+            )
 
             # Prepare form for new data entry
             real_data_form = RealDataForm(initial={
@@ -831,7 +871,6 @@ def compare_real_data(request: HttpRequest) -> HttpResponse:
             return render(request, 'compare_real_data.html', {
                 'accounts': accounts,
                 'selected_account': simulation,
-                'simulation_data': simulation_data,
                 'real_data': real_data,
                 'real_data_form': real_data_form,
                 'chart_data': json.dumps(chart_data),
@@ -851,6 +890,16 @@ def compare_real_data(request: HttpRequest) -> HttpResponse:
     })
 
 
+@login_required
+def compare_real_data_chart(request: HttpRequest, simulation_id: int) -> JsonResponse:
+    """JSON chart data of compare_real_data, to refresh the chart without reloading the page."""
+    simulation = get_object_or_404(Simulation, id=simulation_id, user=request.user)
+    show_inflation = request.GET.get('inflation', 'true') == 'true'
+
+    chart_data, _ = build_real_data_comparison(simulation, show_inflation)
+    return JsonResponse(chart_data)
+
+
 @login_required
 def delete_real_data(request: HttpRequest, data_id: int) -> HttpResponse:
     """Delete a real data entry"""
@@ -869,265 +918,104 @@ def delete_real_data(request: HttpRequest, data_id: int) -> HttpResponse:
 
 
 @login_required
-def export_real_data_to_csv(request: HttpRequest) -> HttpResponse:
+def export_real_data_to_csv(request: HttpRequest) -> StreamingHttpResponse:
     """Export real data and inflation rates to CSV."""
-    response = HttpResponse(content_type='text/csv')
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    response['Content-Disposition'] = f'attachment; filename="real_data_{timestamp}.csv"'
-
-    writer = csv.writer(response, delimiter=';')
-    writer.writerow(['nom_compte', 'annee', 'montant_reel', 'taux_inflation'])
 
     real_data = RealAccountData.objects.filter(
         simulation__user=request.user
-    ).select_related('simulation').order_by('simulation__nom_compte', 'annee')
+    ).order_by('simulation__nom_compte', 'annee').values_list(
+        'simulation__nom_compte', 'annee', 'montant_reel', 'taux_inflation'
+    )
 
-    for entry in real_data:
-        writer.writerow([
-            entry.simulation.nom_compte,
-            entry.annee,
-            str(entry.montant_reel).replace('.', ','),
-            str(entry.taux_inflation).replace('.', ',')
-        ])
+    def rows():
+        yield ['nom_compte', 'annee', 'montant_reel', 'taux_inflation']
 
-    return response
+        for nom_compte, annee, montant_reel, taux_inflation in real_data.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield [
+                nom_compte,
+                annee,
+                str(montant_reel).replace('.', ','),
+                str(taux_inflation).replace('.', ',')
+            ]
+
+    return streaming_csv_response(rows(), f"real_data_{timestamp}.csv")
 
 
 @login_required
 def import_real_data(request: HttpRequest) -> HttpResponse:
     if request.method == 'POST':
         try:
-            csv_file = request.FILES['csv_file']
-            if not csv_file.name.endswith('.csv'):
-                messages.error(request, "Le fichier doit être au format CSV")
+            content = read_csv_upload(request)
+            if content is None:
                 return redirect('compare_real_data')
 
-            decoded_file = csv_file.read().decode('utf-8')
-            reader = csv.DictReader(io.StringIO(decoded_file), delimiter=';')
+            if background_jobs_enabled():
+                job = enqueue('import_real_data', user=request.user, content=content)
+                messages.info(request, "Import des données réelles lancé en arrière-plan")
+                return redirect_to_job('compare_real_data', job)
 
-            with transaction.atomic():
-                for row in reader:
-                    try:
-                        simulation = Simulation.objects.get(
-                            nom_compte=row['nom_compte'],
-                            user=request.user
-                        )
-
-                        RealAccountData.objects.update_or_create(
-                            simulation=simulation,
-                            annee=int(row['annee']),
-                            defaults={
-                                'montant_reel': Decimal(row['montant_reel'].replace(',', '.')),
-                                'taux_inflation': Decimal(row['taux_inflation'].replace(',', '.'))
-                            }
-                        )
-                    except Simulation.DoesNotExist:
-                        messages.warning(
-                            request,
-                            f"Compte non trouvé: {row['nom_compte']}"
-                        )
-                    except (ValueError, KeyError) as e:
-                        messages.error(request, f"Erreur de format dans le fichier: {str(e)}")
-                        raise
-
-            messages.success(request, "Données réelles importées avec succès")
+            report = import_real_account_data(request.user, content)
+            report_import_messages(request, report)
+
+            if not report.errors:
+                messages.success(
+                    request,
+                    f"{report.imported} lignes de données réelles importées avec succès"
+                )
 
         except Exception as e:
             messages.error(request, f"Erreur lors de l'import: {str(e)}")
 
     return redirect('compare_real_data')
 
-@login_required
-def summary_comparison(request: HttpRequest) -> HttpResponse:
-    """View to display yearly totals comparison across all accounts with inflation"""
-    try:
-        show_inflation = request.GET.get('inflation', 'true') == 'true'
-
-        # Get all user's simulations
-        simulations = Simulation.objects.filter(user=request.user).select_related('categorie')
-
-        # Get all simulation results in one query
-        all_simulation_results = ConsolidatedResult.objects.filter(
-            simulation__user=request.user
-        ).select_related('simulation')
-
-        # Get all real data in one query
-        all_real_data = RealAccountData.objects.filter(
-            simulation__user=request.user
-        ).select_related('simulation')
 
-        # Get unique years from both datasets
-        simulation_years = set(all_simulation_results.values_list('annee', flat=True))
-        real_data_years = set(all_real_data.values_list('annee', flat=True))
-        all_years = sorted(simulation_years.union(real_data_years))
-
-        if not all_years:
-            messages.error(request, "Aucune donnée disponible pour la comparaison")
-            return render(request, 'summary_comparison.html', {
-                'summary_data': [],
-                'years': [],
-                'yearly_totals': {},
-                'chart_data': json.dumps({'labels': [], 'datasets': []}),
-                'show_inflation': show_inflation
-            })
-
-        # Initialize yearly_totals
-        yearly_totals = {str(year): {
-            'simulated': Decimal('0'),
-            'real': Decimal('0'),
-            'real_adjusted': Decimal('0'),
-            'difference': Decimal('0'),
-            'difference_adjusted': Decimal('0'),
-            'difference_percent': Decimal('0'),
-            'difference_percent_adjusted': Decimal('0'),
-            'inflation_rate': Decimal('0')
-        } for year in all_years}
-
-        # Process yearly totals
-        for year in all_years:
-            year_sim_results = [r for r in all_simulation_results if r.annee == year]
-            year_real_results = [r for r in all_real_data if r.annee == year]
-
-            # Calculate simulated total
-            simulated_amount = sum(r.montant for r in year_sim_results)
-
-            # Calculate real totals and inflation
-            if year_real_results:
-                real_amount = sum(r.montant_reel for r in year_real_results)
-                # Calculate weighted average inflation rate
-                total_real = sum(r.montant_reel for r in year_real_results)
-                avg_inflation = sum(
-                    r.taux_inflation * r.montant_reel for r in year_real_results
-                ) / total_real if total_real else Decimal('0')
-
-                # Calculate inflation-adjusted amount
-                real_adjusted = sum(
-                    r.montant_reel / (1 + r.taux_inflation / 100)
-                    for r in year_real_results
-                )
-            else:
-                real_amount = Decimal('0')
-                real_adjusted = Decimal('0')
-                avg_inflation = Decimal('0')
-
-            str_year = str(year)
-            yearly_totals[str_year].update({
-                'simulated': simulated_amount,
-                'real': real_amount,
-                'real_adjusted': real_adjusted,
-                'inflation_rate': avg_inflation,
-                'difference': real_amount - simulated_amount,
-                'difference_adjusted': real_adjusted - simulated_amount,
-            })
-
-            if simulated_amount:
-                yearly_totals[str_year].update({
-                    'difference_percent': (real_amount - simulated_amount) / simulated_amount * 100,
-                    'difference_percent_adjusted': (real_adjusted - simulated_amount) / simulated_amount * 100
-                })
-
-        # Prepare summary data for each account
-        summary_data = []
-        for simulation in simulations:
-            account_data = {
-                'account_name': simulation.nom_compte,
-                'category': simulation.categorie.category,
-                'years': {}
-            }
-
-            sim_results = {
-                str(r.annee): r.montant
-                for r in all_simulation_results
-                if r.simulation_id == simulation.id
-            }
-
-            real_results = {
-                str(r.annee): r
-                for r in all_real_data
-                if r.simulation_id == simulation.id
-            }
-
-            for year in all_years:
-                str_year = str(year)
-                simulated = sim_results.get(str_year, Decimal('0'))
-                real_data = real_results.get(str_year)
-
-                year_data = {
-                    'simulated': simulated,
-                    'has_real_data': bool(real_data),
-                    'real': Decimal('0'),
-                    'real_adjusted': Decimal('0'),
-                    'inflation_rate': Decimal('0'),
-                    'difference': Decimal('0'),
-                    'difference_adjusted': Decimal('0'),
-                    'difference_percent': Decimal('0'),
-                    'difference_percent_adjusted': Decimal('0')
-                }
+def read_csv_upload(request: HttpRequest) -> Optional[str]:
+    """Return the content of the uploaded CSV file, or None after flagging the problem."""
+    csv_file = request.FILES.get('csv_file')
+    if csv_file is None:
+        messages.error(request, "Aucun fichier sélectionné")
+        return None
+    if not csv_file.name.endswith('.csv'):
+        messages.error(request, "Le fichier doit être au format CSV")
+        return None
+    try:
+        return csv_file.read().decode('utf-8')
+    except UnicodeDecodeError:
+        messages.error(request, "Le fichier n'est pas encodé en UTF-8")
+        return None
 
-                if real_data:
-                    real = real_data.montant_reel
-                    inflation_rate = real_data.taux_inflation
-                    real_adjusted = real / (1 + inflation_rate / 100)
 
-                    year_data.update({
-                        'real': real,
-                        'real_adjusted': real_adjusted,
-                        'inflation_rate': inflation_rate,
-                        'difference': real - simulated,
-                        'difference_adjusted': real_adjusted - simulated,
-                    })
+def redirect_to_job(view_name: str, job: Job, **kwargs) -> HttpResponse:
+    """Redirect to a page that follows the progress of a background job."""
+    return redirect(f"{reverse(view_name, kwargs=kwargs)}?job={job.id}")
 
-                    if simulated:
-                        year_data.update({
-                            'difference_percent': (real - simulated) / simulated * 100,
-                            'difference_percent_adjusted': (real_adjusted - simulated) / simulated * 100
-                        })
 
-                account_data['years'][str_year] = year_data
+def report_import_messages(request: HttpRequest, report: ImportReport) -> None:
+    """Surface the errors and warnings of an import report as messages."""
+    for message in format_row_errors(report.errors):
+        messages.error(request, message)
+    for message in format_row_errors(report.warnings):
+        messages.warning(request, message)
 
-            summary_data.append(account_data)
 
-        # Prepare chart data with inflation adjustment
-        labels = [str(year) for year in all_years]
-        datasets = [
-            {
-                'label': 'Total Simulé',
-                'data': [float(yearly_totals[year]['simulated']) for year in labels],
-                'borderColor': 'rgb(54, 162, 235)',
-                'backgroundColor': 'rgba(54, 162, 235, 0.2)',
-                'borderWidth': 2
-            },
-            {
-                'label': 'Total Réel Nominal',
-                'data': [float(yearly_totals[year]['real']) for year in labels],
-                'borderColor': 'rgb(255, 99, 132)',
-                'backgroundColor': 'rgba(255, 99, 132, 0.2)',
-                'borderWidth': 2
-            }
-        ]
+@login_required
+def summary_comparison(request: HttpRequest) -> HttpResponse:
+    """View to display yearly totals comparison across all accounts with inflation"""
+    try:
+        show_inflation = request.GET.get('inflation', 'true') == 'true'
 
-        if show_inflation:
-            datasets.append({
-                'label': 'Total Réel (Ajusté Inflation)',
-                'data': [float(yearly_totals[year]['real_adjusted']) for year in labels],
-                'borderColor': 'rgb(75, 192, 192)',
-                'backgroundColor': 'rgba(75, 192, 192, 0.2)',
-                'borderWidth': 2,
-                'borderDash': [5, 5]
-            })
+        context = cached_user_payload(
+            request.user.id,
+            'summary_comparison',
+            (show_inflation,),
+            lambda: build_summary_comparison(request.user, show_inflation)
+        )
 
-        chart_data = {
-            'labels': labels,
-            'datasets': datasets
-        }
+        if not context['years']:
+            messages.error(request, "Aucune donnée disponible pour la comparaison")
 
-        return render(request, 'summary_comparison.html', {
-            'summary_data': summary_data,
-            'yearly_totals': yearly_totals,
-            'years': all_years,
-            'chart_data': json.dumps(chart_data),
-            'show_inflation': show_inflation
-        })
+        return render(request, 'summary_comparison.html', context)
 
     except Exception as e:
         logger.error(f"Error in summary comparison view: {str(e)}", exc_info=True)
@@ -1204,24 +1092,14 @@ def recalculate_real_data(request: HttpRequest, simulation_id: int) -> HttpRespo
     try:
         simulation = get_object_or_404(Simulation, id=simulation_id, user=request.user)
 
-        with transaction.atomic():
-            # Get all real data entries for this simulation
-            real_data_entries = RealAccountData.objects.filter(simulation=simulation)
-
-            # Update each entry with current inflation rates
-            for entry in real_data_entries:
-                # Get current inflation rate for the year
-                inflation_rate = AnnualInflationRate.objects.filter(
-                    annee=entry.annee
-                ).first()
-
-                # Update with new inflation rate or default to 0
-                new_taux_inflation = inflation_rate.taux_inflation if inflation_rate else Decimal('0')
+        if background_jobs_enabled():
+            job = enqueue('recalculate_real_data', user=request.user, simulation_id=simulation.id)
+            return JsonResponse({
+                "status": "queued",
+                "job_url": reverse('job_status', args=[job.id])
+            })
 
-                # Update the entry
-                entry.taux_inflation = new_taux_inflation
-                entry.montant_reel_ajuste = entry.montant_reel / (1 + new_taux_inflation / 100)
-                entry.save()
+        apply_inflation_rates(simulation)
 
         messages.success(request, "Calculs mis à jour avec succès")
         return JsonResponse({"status": "success"})
@@ -1237,7 +1115,7 @@ def recalculate_real_data(request: HttpRequest, simulation_id: int) -> HttpRespo
 @login_required
 def portfolio_list(request: HttpRequest) -> HttpResponse:
     """View to display user's portfolios."""
-    portfolios = Portfolio.objects.filter(user=request.user)
+    portfolios = with_totals(Portfolio.objects.filter(user=request.user)).order_by('name')
 
     if request.method == 'POST':
         form = PortfolioForm(request.POST)
@@ -1262,44 +1140,76 @@ def portfolio_list(request: HttpRequest) -> HttpResponse:
 @login_required
 def portfolio_detail(request: HttpRequest, portfolio_id: int) -> HttpResponse:
     """View to display portfolio details and positions."""
-    portfolio = get_object_or_404(Portfolio, id=portfolio_id, user=request.user)
-    positions = Position.objects.filter(portfolio=portfolio).select_related('stock')
+    portfolio = get_object_or_404(with_totals(Portfolio.objects.filter(user=request.user)), id=portfolio_id)
+    positions = list(Position.objects.filter(portfolio=portfolio).select_related('stock'))
     transactions = Transaction.objects.filter(portfolio=portfolio).select_related('stock')
 
-    # Mettre à jour les données de marché si nécessaire
-    for position in positions:
-        if position.stock.needs_update():
-            position.stock.update_market_data()
-
-    # Calculer la valeur actuelle du portfolio
-    total_market_value = sum(
-        position.quantity * position.stock.current_price
-        for position in positions
-        if position.stock.current_price is not None
-    )
+    # Les cours sont affichés tels quels, ceux trop anciens sont rafraîchis
+    # en arrière-plan et la page les récupère via portfolio_quotes
+    stale = [position.stock for position in positions if position.stock.needs_update()]
+    if stale and background_jobs_enabled():
+        queue_quote_refresh(stale, request.user)
 
-    total_cost = sum(position.total_cost for position in positions)
-    total_gain_loss = total_market_value - total_cost if total_market_value else None
+    valuation = get_valuation_series(portfolio)
 
     # Grouper les positions par type d'actif
-    positions_by_type = {
-        'STOCK': positions.filter(stock__asset_type='STOCK'),
-        'ETF': positions.filter(stock__asset_type='ETF')
-    }
+    positions_by_type = {asset_type: [] for asset_type, _ in Stock.ASSET_TYPES}
+    for position in positions:
+        positions_by_type.setdefault(position.stock.asset_type, []).append(position)
 
     context = {
         'portfolio': portfolio,
         'positions': positions,
         'transactions': transactions,
-        'total_market_value': total_market_value,
-        'total_cost': total_cost,
-        'total_gain_loss': total_gain_loss,
+        'total_market_value': portfolio.total_market_value,
+        'total_cost': portfolio.total_cost,
+        'total_gain_loss': portfolio.total_gain_loss,
         'positions_by_type': positions_by_type,
+        'stale_symbols': [stock.symbol for stock in stale],
+        'valuation_chart': json.dumps(valuation.chart_data()) if len(valuation) else None,
+        'metrics': get_portfolio_metrics(portfolio),
     }
 
     return render(request, 'portfolio_detail.html', context)
 
 
+@login_required
+def portfolio_quotes(request: HttpRequest, portfolio_id: int) -> JsonResponse:
+    """Current prices of the positions of a portfolio, polled by its page."""
+    portfolio = get_object_or_404(Portfolio, id=portfolio_id, user=request.user)
+    positions = list(Position.objects.filter(portfolio=portfolio).select_related('stock'))
+
+    stale = [position.stock for position in positions if position.stock.needs_update()]
+    if stale:
+        if background_jobs_enabled():
+            queue_quote_refresh(stale, request.user)
+        else:
+            # Without a worker, each poll refreshes only the oldest stale
+            # symbol, so it answers after one API call at most and the
+            # others are picked up by the next polls
+            oldest = min(stale, key=lambda stock: (stock.last_update is not None, stock.last_update or 0))
+            refresh_stocks([oldest], priority=PRIORITY_INTERACTIVE)
+            stale = [stock for stock in stale if stock.needs_update()]
+
+    totals = with_totals(Portfolio.objects.filter(pk=portfolio.pk)).get()
+
+    return JsonResponse({
+        'stale': [stock.symbol for stock in stale],
+        'positions': [
+            {
+                'id': position.id,
+                'symbol': position.stock.symbol,
+                'price': position.stock.current_price,
+                'age_minutes': position.stock.quote_age_minutes,
+                'gain_loss': position.gain_loss if position.stock.current_price else None,
+            }
+            for position in positions
+        ],
+        'total_market_value': totals.total_market_value,
+        'total_gain_loss': totals.total_gain_loss,
+    })
+
+
 @login_required
 @login_required
 def add_transaction(request: HttpRequest, portfolio_id: int) -> HttpResponse:
@@ -1311,44 +1221,21 @@ def add_transaction(request: HttpRequest, portfolio_id: int) -> HttpResponse:
         if form.is_valid():
             try:
                 with transaction.atomic():  # Utilisez django.db.transaction.atomic()
+                    portfolio = lock_portfolio(portfolio.id)
+
                     # Créer la transaction
                     new_transaction = form.save(commit=False)
                     new_transaction.portfolio = portfolio
                     new_transaction.save()
 
-                    # Update or create position
-                    position, created = Position.objects.get_or_create(
-                        portfolio=portfolio,
-                        stock=new_transaction.stock,
-                        defaults={
-                            'quantity': 0,
-                            'average_price': 0,
-                            'purchase_date': new_transaction.date
-                        }
-                    )
-
-                    if new_transaction.transaction_type == 'BUY':
-                        # Calculate new average price and quantity for buy
-                        total_cost = (position.quantity * position.average_price) + (
-                                    new_transaction.quantity * new_transaction.price)
-                        new_quantity = position.quantity + new_transaction.quantity
-                        position.average_price = total_cost / new_quantity if new_quantity > 0 else 0
-                        position.quantity = new_quantity
-                    else:  # SELL
-                        if new_transaction.quantity > position.quantity:
-                            raise ValidationError("Quantité de vente supérieure à la position détenue")
-                        position.quantity -= new_transaction.quantity
-
-                    if position.quantity > 0:
-                        position.save()
-                    else:
-                        position.delete()
+                    # Rejouer le registre de la position à partir de sa date
+                    replay_positions(portfolio, new_transaction.stock, since=new_transaction.date)
 
                     messages.success(request, "Transaction enregistrée avec succès")
                     return redirect('portfolio_detail', portfolio_id=portfolio_id)
 
             except ValidationError as e:
-                messages.error(request, str(e))
+                messages.error(request, ' '.join(e.messages))
             except Exception as e:
                 logger.error(f"Error processing transaction: {str(e)}", exc_info=True)
                 messages.error(request, "Une erreur est survenue lors du traitement de la transaction")
@@ -1361,6 +1248,42 @@ def add_transaction(request: HttpRequest, portfolio_id: int) -> HttpResponse:
     })
 
 
+@login_required
+def import_portfolio_transactions(request: HttpRequest, portfolio_id: int) -> HttpResponse:
+    """View to import the transactions of a portfolio from a CSV file."""
+    portfolio = get_object_or_404(Portfolio, id=portfolio_id, user=request.user)
+
+    if request.method == 'POST':
+        content = read_csv_upload(request)
+        if content is None:
+            return redirect('import_transactions', portfolio_id=portfolio.id)
+
+        if background_jobs_enabled():
+            job = enqueue('import_transactions', user=request.user, portfolio_id=portfolio.id, content=content)
+            messages.info(request, "Import des transactions lancé en arrière-plan")
+            return redirect_to_job('portfolio_detail', job, portfolio_id=portfolio.id)
+
+        try:
+            report = import_transactions(portfolio, content)
+        except Exception as e:
+            logger.error(f"Error importing transactions: {str(e)}", exc_info=True)
+            messages.error(request, f"Erreur lors de l'import: {str(e)}")
+            return redirect('import_transactions', portfolio_id=portfolio.id)
+
+        report_import_messages(request, report)
+        if report.errors:
+            return redirect('import_transactions', portfolio_id=portfolio.id)
+
+        messages.success(
+            request,
+            f"{report.imported} transactions importées en {report.seconds:.1f}s "
+            f"({report.rows_per_second:.0f} lignes/s)"
+        )
+        return redirect('portfolio_detail', portfolio_id=portfolio.id)
+
+    return render(request, 'import_transactions.html', {'portfolio': portfolio})
+
+
 @login_required
 def stock_list(request: HttpRequest) -> HttpResponse:
     """View to manage stocks and ETFs."""
@@ -1381,6 +1304,36 @@ def stock_list(request: HttpRequest) -> HttpResponse:
     })
 
 
+@login_required
+@require_http_methods(["POST"])
+def update_stocks(request: HttpRequest) -> HttpResponse:
+    """Refresh the market data of every stock, in the background when enabled."""
+    if background_jobs_enabled():
+        job = enqueue('refresh_stocks', user=request.user)
+        messages.info(request, "Mise à jour des cours lancée en arrière-plan")
+        return redirect_to_job('stock_list', job)
+
+    updated_count = update_all_stocks()
+    messages.success(request, f"{updated_count} titre(s) mis à jour")
+    return redirect('stock_list')
+
+
+@login_required
+def job_status(request: HttpRequest, job_id: int) -> JsonResponse:
+    """Progress of a background job, polled by the pages that queued it."""
+    job = get_object_or_404(Job, id=job_id, user=request.user)
+    return JsonResponse({
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'finished': job.is_finished,
+        'progress': job.progress,
+        'total': job.total,
+        'result': job.result,
+        'error': job.error,
+    })
+
+
 @login_required
 @require_http_methods(["POST"])
 def delete_portfolio(request: HttpRequest, portfolio_id: int) -> HttpResponse:
@@ -1434,7 +1387,7 @@ def delete_stock(request: HttpRequest, stock_id: int) -> HttpResponse:
 @login_required
 @require_http_methods(["POST"])
 def delete_transaction(request: HttpRequest, transaction_id: int) -> HttpResponse:
-    """Delete a transaction and update the related position."""
+    """Delete a transaction and replay the related position."""
     try:
         transaction_obj = get_object_or_404(Transaction, id=transaction_id)
 
@@ -1443,49 +1396,22 @@ def delete_transaction(request: HttpRequest, transaction_id: int) -> HttpRespons
             raise PermissionDenied("Vous n'avez pas l'autorisation de supprimer cette transaction")
 
         with transaction.atomic():  # Utilisation de django.db.transaction
-            # Get related position
+            portfolio = lock_portfolio(transaction_obj.portfolio_id)
+            transaction_obj.delete()
+
+            # Replay the later transactions of the position without this one
             try:
-                position = Position.objects.get(
-                    portfolio=transaction_obj.portfolio,
-                    stock=transaction_obj.stock
+                replay_positions(portfolio, transaction_obj.stock, since=transaction_obj.date)
+            except ValidationError:
+                raise ValidationError(
+                    "La suppression de cette transaction rendrait une vente ultérieure supérieure à la position détenue"
                 )
 
-                # Reverse the transaction effect on position
-                if transaction_obj.transaction_type == 'BUY':
-                    # Remove bought quantity
-                    new_quantity = position.quantity - transaction_obj.quantity
-                    if new_quantity < 0:
-                        raise ValidationError("La suppression de cette transaction rendrait la quantité négative")
-
-                    # Recalculate average price if quantity > 0
-                    if new_quantity > 0:
-                        total_cost = (position.quantity * position.average_price) - (
-                                    transaction_obj.quantity * transaction_obj.price)
-                        position.average_price = total_cost / new_quantity
-                    position.quantity = new_quantity
-
-                else:  # SELL
-                    # Add back sold quantity
-                    position.quantity += transaction_obj.quantity
-
-                # Save or delete position based on quantity
-                if position.quantity > 0:
-                    position.save()
-                else:
-                    position.delete()
-
-            except Position.DoesNotExist:
-                # If no position exists, this is an error state
-                raise ValidationError("Position introuvable pour cette transaction")
-
-            # Delete the transaction
-            transaction_obj.delete()
-
         messages.success(request, "Transaction supprimée avec succès")
         return JsonResponse({"status": "success"})
 
     except ValidationError as e:
-        return JsonResponse({"status": "error", "message": str(e)}, status=400)
+        return JsonResponse({"status": "error", "message": ' '.join(e.messages)}, status=400)
     except PermissionDenied as e:
         return JsonResponse({"status": "error", "message": str(e)}, status=403)
     except Exception as e: